@@ -4,6 +4,12 @@ import i2c
 from i2c import *
 __all__.extend(i2c.__all__)
 
+import aio
+import emulators
+import timeseries
+import trace
+
 import sensors
 import radio
+import mux
 import lcd
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+asyncio support of the drivers, based on trollius (the asyncio port for
+python 2). The blocking bus or serial I/O runs in a single worker
+executor per port, or per bus and event loop, while the conversion delays
+are awaited on the event loop, so that one loop can drive several devices.
+
+The coroutines are written in the trollius style:
+
+  pressure, temp = yield From(bmp.readAsync())
+
+The executors of a loop are stopped by AsyncI2C.closeLoop(loop) before the
+loop is closed, else when another loop first uses a bus.
+'''
+
+__all__ = [ "AsyncI2C" ]
+
+import threading
+
+try:
+  import trollius as asyncio
+  from trollius import From, Return
+  from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+  asyncio = None
+
+  def From(obj):
+    return obj
+
+  class Return(StopIteration):
+    def __init__(self, value = None):
+      StopIteration.__init__(self, value)
+      self.value = value
+
+
+def coroutine(func):
+  """Declares an asyncio coroutine, fails on call if trollius is missing"""
+  if asyncio is not None:
+    return asyncio.coroutine(func)
+
+  def unavailable(*args, **kwargs):
+    raise ImportError("trollius is required by {0}()".format(func.__name__))
+  unavailable.__name__ = func.__name__
+  unavailable.__doc__  = func.__doc__
+  return unavailable
+
+
+def sleep(delay):
+  return asyncio.sleep(delay)
+
+
+__executors      = {}
+__executors_lock = threading.Lock()
+
+def executor(key):
+  """Returns the single worker executor of a resource (bus, serial port),
+  the transfers being serial there is no point in more threads"""
+  with __executors_lock:
+    if key not in __executors:
+      __executors[key] = ThreadPoolExecutor(max_workers = 1)
+    return __executors[key]
+
+
+def shutdown(key = None, wait = True):
+  """Stops the worker thread of the executor of key, of all the executors
+  of executor() if None. A key used again gets a new executor"""
+  with __executors_lock:
+    if key is None:
+      executors = __executors.values()
+      __executors.clear()
+    else:
+      executors = [ __executors.pop(key) ] if key in __executors else []
+  for executor in executors:
+    executor.shutdown(wait = wait)
+
+
+def run(executor, func, *args):
+  """Schedules func(*args) in the executor, returns an asyncio future"""
+  return asyncio.get_event_loop().run_in_executor(executor, func, *args)
+
+
+# ===========================================================================
+# AsyncI2C Class
+# ===========================================================================
+
+class AsyncI2C :
+  """asyncio transport over an I2C device, the methods mirror the I2C ones
+  but return futures. Each event loop gets its own bus executor and its own
+  asyncio locks, an asyncio lock being bound to a single loop"""
+
+  __loops      = {} # loop -> { "executors", "locks" }
+  __loops_lock = threading.Lock()
+
+  class Held :
+    """Hold on a device returned by AsyncI2C.exclusive()"""
+
+    def __init__(self, executor, device, lock):
+      self.__executor = executor
+      self.__device   = device
+      self.__lock     = lock
+
+    def __enter__(self):
+      return self
+
+    def __exit__(self, *args):
+      # queued before anything the next owner may schedule
+      self.__executor.submit(self.__device.release)
+      self.__lock.release()
+
+  @staticmethod
+  def closeLoop(loop = None, wait = True):
+    """Stops the bus executors of loop (the current one by default) and
+    forgets its locks, to call before closing a loop. The executors of the
+    loops closed without it are stopped when another loop uses a bus"""
+    if loop is None:
+      loop = asyncio.get_event_loop()
+    with AsyncI2C.__loops_lock:
+      context = AsyncI2C.__loops.pop(loop, None)
+    if context is not None:
+      for executor in context["executors"].values():
+        executor.shutdown(wait = wait)
+
+  def __init__(self, i2c):
+    self.__i2c = i2c
+
+  def __context(self):
+    """Returns the executor and the asyncio lock of the device for the
+    current event loop"""
+    loop = asyncio.get_event_loop()
+    key  = (self.__i2c.busnum(), self.__i2c.address(), self.__i2c.route())
+    with AsyncI2C.__loops_lock:
+      if loop not in AsyncI2C.__loops:
+        # the locks keep their loop alive, the closed ones are dropped here
+        closed = [ other for other in AsyncI2C.__loops if other.is_closed() ]
+        AsyncI2C.__loops[loop] = { "executors": {}, "locks": {} }
+      else:
+        closed = []
+      context = AsyncI2C.__loops[loop]
+      executors, locks = context["executors"], context["locks"]
+      if key[0] not in executors:
+        executors[key[0]] = ThreadPoolExecutor(max_workers = 1)
+      if key not in locks:
+        locks[key] = asyncio.Lock(loop = loop)
+      executor, lock = executors[key[0]], locks[key]
+    for other in closed:
+      AsyncI2C.closeLoop(other, wait = False)
+    return executor, lock
+
+  @coroutine
+  def exclusive(self):
+    """Holds the device for a multi-step sequence, to use as:
+
+      with (yield From(bus.exclusive())):
+
+    The asyncio lock orders the coroutines of the loop, then the bus executor
+    of the loop takes I2C.exclusive() so that the other threads and loops
+    wait for the sequence to complete"""
+    executor, lock = self.__context()
+    device = self.__i2c.exclusive()
+    yield From(lock.acquire())
+    acquired = executor.submit(device.acquire)
+    try:
+      yield From(asyncio.wrap_future(acquired))
+    except BaseException:
+      # cancelled while waiting, the executor may still get the device
+      def release(future):
+        if not future.cancelled() and future.exception() is None:
+          executor.submit(device.release)
+      acquired.add_done_callback(release)
+      lock.release()
+      raise
+    raise Return(AsyncI2C.Held(executor, device, lock))
+
+  def run(self, func, *args):
+    """Runs a blocking call using the device in the bus executor"""
+    return run(self.__context()[0], func, *args)
+
+  def write_byte(self, reg, value):
+    return self.run(self.__i2c.write_byte, reg, value)
+
+  def write_short(self, reg, value):
+    return self.run(self.__i2c.write_short, reg, value)
+
+  def write_block(self, reg, list):
+    return self.run(self.__i2c.write_block, reg, list)
+
+  def read_block(self, reg, length):
+    return self.run(self.__i2c.read_block, reg, length)
+
+  def transfer(self, write, read_length = 0):
+    return self.run(self.__i2c.transfer, write, read_length)
+
+  def read_registers(self, reg, length):
+    return self.run(self.__i2c.read_registers, reg, length)
+
+  def read_byte(self, reg):
+    return self.run(self.__i2c.read_byte, reg)
+
+  def read_short(self, reg):
+    return self.run(self.__i2c.read_short, reg)
+
+  def read_signed_short(self, reg):
+    return self.run(self.__i2c.read_signed_short, reg)
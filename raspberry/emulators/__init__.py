@@ -0,0 +1,17 @@
+__all__ = []
+
+import bus
+from bus import EmulatedBus, EmulatedDevice
+__all__.extend(bus.__all__)
+
+import bmp085
+from bmp085 import BMP085Emulator
+__all__.extend(bmp085.__all__)
+
+import si4703
+from si4703 import SI4703Emulator
+__all__.extend(si4703.__all__)
+
+import tca9548a
+from tca9548a import TCA9548AEmulator
+__all__.extend(tca9548a.__all__)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "BMP085Emulator" ]
+
+import random
+import struct
+import time
+
+from .bus import EmulatedDevice
+
+# ===========================================================================
+# BMP085Emulator Class
+# ===========================================================================
+
+class BMP085Emulator(EmulatedDevice) :
+  """Register model of the BMP085 (datasheet rev 1.2): calibration EEPROM
+  (0xAA-0xBF), chip id (0xD0), control register (0xF4) with its start of
+  conversion bit and the conversion results (0xF6-0xF8) that are only
+  updated once the conversion time has elapsed.
+
+  The raw values are computed from the simulated temperature (C) and
+  pressure (Pa) by inverting the compensation of the datasheet. noise is
+  the RMS pressure noise in Pa, True uses the datasheet values of each
+  mode. With instant the conversions complete immediately."""
+
+  ADDRESS = 0x77
+
+  # Example calibration of the datasheet
+  CALIBRATION = ( 408, -72, -14383, 32741, 32757, 23153,
+                  6190, 4, -32768, -8711, 2868 )
+
+  # Maximum conversion times and RMS noise (Pa) per oversampling setting
+  TEMPERATURE_TIME = 0.0045
+  PRESSURE_TIME    = [ 0.0045, 0.0075, 0.0135, 0.0255 ]
+  PRESSURE_NOISE   = [ 6., 5., 4., 3. ]
+
+  CHIP_ID = 0x55
+
+  __CAL      = 0xAA
+  __CHIP_ID  = 0xD0
+  __RESET    = 0xE0
+  __CONTROL  = 0xF4
+  __OUT      = 0xF6
+  __SCO      = 0x20
+
+  __cal_layout = struct.Struct(">hhhHHHhhhhh")
+
+  def __init__(self, temperature = 15.0, pressure = 101325., noise = 0.,
+               calibration = CALIBRATION, instant = False, clock = time.time):
+    self.__regs = bytearray(256)
+    self.__regs[self.__CAL:self.__CAL + 22] = bytearray(self.__cal_layout.pack(*calibration))
+    self.__regs[self.__CHIP_ID] = self.CHIP_ID
+    self.__cal = calibration
+
+    self.__noise   = noise
+    self.__instant = instant
+    self.__clock   = clock
+    self.__pointer = 0
+    self.__pending = None # (ready time, oss or None for temperature)
+
+    self.conversions = 0
+    self.setConditions(temperature, pressure)
+
+  def setConditions(self, temperature = None, pressure = None):
+    """Changes the simulated temperature (C) and/or pressure (Pa)"""
+    if temperature is not None:
+      self.temperature = temperature
+    if pressure is not None:
+      self.pressure = pressure
+
+  # --------------------------------------------------------------------------
+  # Compensation of the datasheet and its inverse
+  def __b5(self, UT):
+    AC1, AC2, AC3, AC4, AC5, AC6, B1, B2, MB, MC, MD = self.__cal
+    X1 = ((UT - AC6) * AC5) >> 15
+    X2 = (MC << 11) // (X1 + MD)
+    return X1 + X2
+
+  def __p(self, UP, B5, oss):
+    AC1, AC2, AC3, AC4, AC5, AC6, B1, B2, MB, MC, MD = self.__cal
+    B6 = B5 - 4000
+    X1 = (B2 * (B6 * B6) >> 12) >> 11
+    X2 = (AC2 * B6) >> 11
+    B3 = (((AC1 * 4 + X1 + X2) << oss) + 2) // 4
+    X1 = (AC3 * B6) >> 13
+    X2 = (B1 * ((B6 * B6) >> 12)) >> 16
+    X3 = ((X1 + X2) + 2) >> 2
+    B4 = (AC4 * (X3 + 32768)) >> 15
+    B7 = (UP - B3) * (50000 >> oss)
+    p = (B7 * 2) // B4 if B7 < 0x80000000 else (B7 // B4) * 2
+    X1 = ((p >> 8) * (p >> 8) * 3038) >> 16
+    X2 = (-7357 * p) >> 16
+    return p + ((X1 + X2 + 3791) >> 4)
+
+  @staticmethod
+  def __invert(func, target, high):
+    """Smallest raw value in [0, high) where the increasing func reaches target"""
+    low = 0
+    while low < high:
+      mid = (low + high) // 2
+      if func(mid) < target:
+        low = mid + 1
+      else:
+        high = mid
+    return low
+
+  def __rawTemperature(self):
+    return self.__invert(lambda ut: (self.__b5(ut) + 8) >> 4,
+                         int(round(self.temperature * 10)), 1 << 16)
+
+  def __rawPressure(self, oss):
+    B5 = self.__b5(self.__rawTemperature())
+    pressure = self.pressure
+    noise = self.PRESSURE_NOISE[oss] if self.__noise is True else self.__noise
+    if noise:
+      pressure += random.gauss(0., noise)
+    return self.__invert(lambda up: self.__p(up, B5, oss),
+                         int(round(pressure)), 1 << (16 + oss))
+
+  # --------------------------------------------------------------------------
+  def __complete(self):
+    """Latches the result of the pending conversion once it is ready"""
+    if self.__pending is None or self.__clock() < self.__pending[0]:
+      return
+
+    oss = self.__pending[1]
+    if oss is None:
+      self.__regs[self.__OUT:self.__OUT + 2] = bytearray(struct.pack(">H", self.__rawTemperature()))
+    else:
+      raw = self.__rawPressure(oss) << (8 - oss)
+      self.__regs[self.__OUT:self.__OUT + 3] = bytearray(struct.pack(">I", raw)[1:])
+    self.__regs[self.__CONTROL] &= ~self.__SCO & 0xFF
+    self.__pending = None
+
+  def __start(self, command):
+    self.__regs[self.__CONTROL] = command | self.__SCO
+    oss = (command >> 6) & 0x3
+    if command & 0x3F == 0x2E:
+      delay, oss = self.TEMPERATURE_TIME, None
+    elif command & 0x3F == 0x34:
+      delay = self.PRESSURE_TIME[oss]
+    else:
+      return
+    self.conversions += 1
+    self.__pending = (self.__clock() + (0 if self.__instant else delay), oss)
+
+  def write(self, data):
+    if not data:
+      return
+    self.__pointer = data[0]
+    for value in data[1:]:
+      if self.__pointer == self.__CONTROL:
+        self.__complete()
+        self.__start(value)
+      elif self.__pointer == self.__RESET and value == 0xB6:
+        self.__pending = None
+        self.__regs[self.__CONTROL] = 0
+      self.__pointer = (self.__pointer + 1) & 0xFF
+
+  def read(self, length):
+    self.__complete()
+    data = [ self.__regs[(self.__pointer + i) & 0xFF] for i in range(length) ]
+    self.__pointer = (self.__pointer + length) & 0xFF
+    return data
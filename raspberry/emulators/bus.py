@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "EmulatedBus", "EmulatedDevice" ]
+
+import ctypes
+import errno
+import threading
+
+from ..i2c import I2C, I2CBus, I2C_M_RD
+
+# ===========================================================================
+# EmulatedDevice Class
+# ===========================================================================
+
+class EmulatedDevice :
+  """Base of the device models: a device sees the raw I2C messages, a
+  write of a list of bytes or a read of a number of bytes"""
+
+  ADDRESS = None
+
+  def route(self, address):
+    """Device answering at address behind this one (multiplexers), None
+    for the plain devices"""
+    return None
+
+  def write(self, data):
+    raise NotImplementedError()
+
+  def read(self, length):
+    raise NotImplementedError()
+
+
+# ===========================================================================
+# EmulatedBus Class
+# ===========================================================================
+
+class EmulatedBus :
+  """smbus compatible bus serving the devices attached to it
+
+  bus = EmulatedBus()
+  bus.attach(BMP085Emulator())
+  bus.install(1)  # I2C(address, 1) now talks to the emulators
+  """
+
+  __installed = {}
+  __lock      = threading.Lock()
+
+  @classmethod
+  def open(cls, busnum):
+    """Factory of I2CBus serving the installed emulated buses"""
+    with cls.__lock:
+      if busnum not in cls.__installed:
+        raise IOError(errno.ENOENT, "No emulated bus {0}".format(busnum))
+      return cls.__installed[busnum]
+
+  @classmethod
+  def uninstallAll(cls):
+    with cls.__lock:
+      cls.__installed = {}
+    I2CBus.setFactory(None)
+
+  def __init__(self):
+    self.__devices = {}
+    self.__lock    = threading.Lock()
+
+  def attach(self, device, address = None):
+    """Plugs device at address (device.ADDRESS by default)"""
+    address = device.ADDRESS if address is None else address
+    self.__devices[address] = device
+    return device
+
+  def detach(self, address):
+    del self.__devices[address]
+
+  def device(self, address):
+    return self.__devices.get(address)
+
+  def install(self, busnum = None):
+    """Serves this bus as busnum (the auto-detected bus by default) for
+    the I2C devices created afterwards"""
+    if busnum is None:
+      busnum = I2C.getPiI2CBusNumber()
+    with EmulatedBus.__lock:
+      EmulatedBus.__installed[busnum] = self
+    I2CBus.setFactory(EmulatedBus.open)
+    return self
+
+  def __device(self, address):
+    device = self.__devices.get(address)
+    if device is None:
+      for mux in self.__devices.values():
+        device = mux.route(address)
+        if device is not None:
+          return device
+
+      # nobody acknowledges the address
+      raise IOError(errno.EREMOTEIO, "Remote I/O error")
+    return device
+
+  def __write(self, address, data):
+    with self.__lock:
+      self.__device(address).write([ b & 0xFF for b in data ])
+
+  def __writeRead(self, address, data, length):
+    with self.__lock:
+      device = self.__device(address)
+      device.write([ b & 0xFF for b in data ])
+      return device.read(length)
+
+  # --------------------------------------------------------------------------
+  # smbus interface
+  def close(self):
+    pass
+
+  def read_byte(self, address):
+    with self.__lock:
+      return self.__device(address).read(1)[0]
+
+  def write_byte(self, address, value):
+    self.__write(address, [ value ])
+
+  def read_byte_data(self, address, reg):
+    return self.__writeRead(address, [ reg ], 1)[0]
+
+  def write_byte_data(self, address, reg, value):
+    self.__write(address, [ reg, value ])
+
+  def read_word_data(self, address, reg):
+    lsb, msb = self.__writeRead(address, [ reg ], 2)
+    return (msb << 8) + lsb
+
+  def write_word_data(self, address, reg, value):
+    self.__write(address, [ reg, value & 0xFF, value >> 8 ])
+
+  def read_i2c_block_data(self, address, reg, length = 32):
+    return list(self.__writeRead(address, [ reg ], length))
+
+  def write_i2c_block_data(self, address, reg, data):
+    self.__write(address, [ reg ] + list(data))
+
+  def i2c_rdwr(self, *msgs):
+    with self.__lock:
+      for msg in msgs:
+        device = self.__device(msg.addr)
+        if msg.flags & I2C_M_RD:
+          data = bytearray(device.read(msg.len))
+          ctypes.memmove(msg.buf, bytes(data), msg.len)
+        else:
+          device.write(list(bytearray(ctypes.string_at(msg.buf, msg.len))))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms 
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "SI4703Emulator" ]
+
+import collections
+import struct
+import threading
+import time
+
+from .bus import EmulatedDevice
+
+class SI4703Emulator(EmulatedDevice):
+    '''
+    Register model of the Si4702/03 (datasheet rev 1.1, AN230): the 16
+    registers are read starting at 0x0A and wrapping around, they are
+    written starting at 0x02, a register being committed only once its two
+    bytes are received.
+
+    Setting TUNE or SEEK sets STC after tune_time, clearing them clears
+    STC. The seek scans the stations (frequency in MHz: RSSI) in the
+    direction, mode and RSSI threshold programmed, setting SF/BL on failure
+    or at the band limit. The RDS groups injected are delivered one per
+    87.6ms (the group period at 1187.5 bit/s), RDSR staying set 40ms as in
+    the standard RDS mode. With instant the tuning completes immediately
+    and each read of the RDS registers delivers the next group.
+
+    GPIO2 programmed as the STC/RDS interrupt (GPIO2[1:0] = 01) calls the
+    function given to setInterrupt() when STC (STCIEN) or RDSR (RDSIEN)
+    get set, from a timer thread when the event is not immediate.
+    '''
+
+    ADDRESS = 0x10
+
+    DEVICE_ID = 0x1242 # Si4702/03 by Silicon Laboratories
+    CHIP_ID   = 0x1253 # Si4703 rev C, firmware 19
+
+    TUNE_TIME  = 0.060
+    RDS_PERIOD = 0.0876
+    RDSR_TIME  = 0.040
+    NOISE_RSSI = 8
+
+    __band_min = { 0x0: 87.5, 0x1: 76., 0x2: 76. }
+    __band_max = { 0x0: 108., 0x1: 108., 0x2: 90. }
+    __spacing  = { 0x0: 0.2, 0x1: 0.1, 0x2: 0.05 }
+
+    def __init__(self, stations = None, tune_time = TUNE_TIME,
+                 instant = False, clock = time.time):
+        self.__regs = [0] * 16
+        self.__regs[0x00] = self.DEVICE_ID
+        self.__regs[0x01] = self.CHIP_ID
+
+        self.stations = dict(stations or {})
+        self.__tune_time = 0 if instant else tune_time
+        self.__instant   = instant
+        self.__clock     = clock
+
+        self.__stc_at   = None # completion time of the tune/seek in progress
+        self.__seek_to  = None # (channel, failed) found by the seek in progress
+        self.__rds      = collections.deque()
+        self.__rds_next = None
+        self.__rdsr_end = 0
+        self.__interrupt = None
+
+        self.tunes = 0
+        self.seeks = 0
+        self.groups_sent = 0
+
+    # --------------------------------------------------------------------------
+    # RDS groups
+    def injectRDS(self, a, b, c, d, errors = (0, 0, 0, 0)):
+        '''
+        Queues a raw RDS group, errors holds the BLERA-D levels (0 to 3)
+        '''
+        self.__rds.append((a, b, c, d, tuple(errors)))
+        if len(self.__rds) == 1:
+            self.__scheduleRDS()
+
+    def setInterrupt(self, callback):
+        '''
+        Wires GPIO2: callback() is the falling edge of the interrupt
+        '''
+        self.__interrupt = callback
+
+    def __pulse(self, enable_bit):
+        if self.__interrupt is not None and self.__get(0x04, 2, 0x3) == 0x1 and \
+           self.__get(0x04, enable_bit, 0x1):
+            self.__interrupt()
+
+    def __schedule(self, when, enable_bit):
+        '''Raises the interrupt at the time of the event'''
+        if self.__interrupt is None:
+            return
+        delay = when - self.__clock()
+        if delay <= 0:
+            self.__pulse(enable_bit)
+        else:
+            timer = threading.Timer(delay, self.__pulse, (enable_bit,))
+            timer.daemon = True
+            timer.start()
+
+    def __scheduleRDS(self):
+        if self.__rds and self.__rds_next is not None:
+            self.__schedule(0 if self.__instant else self.__rds_next, 15)
+
+    def pendingRDS(self):
+        return len(self.__rds)
+
+    def injectStation(self, pi, ps = "", rt = "", pty = 0, afs = ()):
+        '''
+        Queues the 0A groups of the program service name ps (8 chars) and
+        the 2A groups of the radio text rt (64 chars max) of a station
+        '''
+        b = (pty & 0x1F) << 5
+        ps = ps.ljust(8)[:8]
+        # AF list: the number of frequencies then their codes, 0xCD fills
+        afs = [ 0xE0 + len(afs) ] + [ int(round((f - 87.6) / 0.1)) + 1 for f in afs ]
+        afs += [ 0xCD ] * (8 - len(afs) % 8 if len(afs) % 8 else 0)
+        for i in range(4):
+            c = (afs[2*i % len(afs)] << 8) | afs[(2*i + 1) % len(afs)]
+            self.injectRDS(pi, b | i, c, (ord(ps[2*i]) << 8) | ord(ps[2*i + 1]))
+
+        if rt:
+            rt = rt[:64]
+            if len(rt) < 64: rt += "\r"
+            rt = rt.ljust((len(rt) + 3) // 4 * 4)
+            for i in range(len(rt) // 4):
+                chars = [ ord(ch) for ch in rt[4*i:4*i + 4] ]
+                self.injectRDS(pi, (0x2 << 12) | b | i,
+                               (chars[0] << 8) | chars[1], (chars[2] << 8) | chars[3])
+
+    # --------------------------------------------------------------------------
+    def __get(self, reg, pos, mask):
+        return (self.__regs[reg] >> pos) & mask
+
+    def __set(self, reg, pos, mask, value):
+        self.__regs[reg] = (self.__regs[reg] & ~(mask << pos)) | ((value & mask) << pos)
+
+    def __band(self):
+        band = self.__get(0x05, 6, 0x3)
+        return self.__band_min.get(band, 76.), self.__band_max.get(band, 108.), \
+            self.__spacing.get(self.__get(0x05, 4, 0x3), 0.2)
+
+    def __frequency(self, channel):
+        low, high, spacing = self.__band()
+        return round(low + spacing * channel, 2)
+
+    def __rssi(self, channel):
+        return self.stations.get(self.__frequency(channel), self.NOISE_RSSI)
+
+    def __seek(self):
+        '''Channel where the seek stops and whether it failed'''
+        low, high, spacing = self.__band()
+        last   = int(round((high - low) / spacing))
+        step   = 1 if self.__get(0x02, 9, 0x1) else -1
+        limit  = self.__get(0x02, 10, 0x1)
+        thresh = self.__get(0x05, 8, 0xFF)
+
+        start   = self.__get(0x0B, 0, 0x3FF)
+        channel = start
+        for i in range(last + 1):
+            channel += step
+            if channel < 0 or channel > last:
+                if limit:
+                    return min(max(channel, 0), last), True
+                channel = last if channel < 0 else 0
+            if channel == start:
+                break
+            if self.__rssi(channel) >= thresh:
+                return channel, False
+        return start, True
+
+    def __started(self, old_powercfg, old_channel):
+        '''Reacts to the TUNE and SEEK bits written'''
+        tune = self.__get(0x03, 15, 0x1)
+        seek = self.__get(0x02, 8, 0x1)
+        was_tune = (old_channel >> 15) & 0x1
+        was_seek = (old_powercfg >> 8) & 0x1
+
+        if tune and not was_tune:
+            self.tunes += 1
+            self.__seek_to = (self.__get(0x03, 0, 0x3FF), False)
+            self.__stc_at  = self.__clock() + self.__tune_time
+            self.__schedule(self.__stc_at, 14)
+        elif seek and not was_seek:
+            self.seeks += 1
+            self.__seek_to = self.__seek()
+            self.__stc_at  = self.__clock() + self.__tune_time
+            self.__schedule(self.__stc_at, 14)
+        elif not tune and not seek:
+            # clearing TUNE/SEEK clears STC
+            self.__stc_at = None
+            self.__set(0x0A, 14, 0x1, 0)
+            self.__set(0x0A, 13, 0x1, 0)
+
+    def __update(self):
+        '''Completes the tuning and delivers the RDS groups due'''
+        now = self.__clock()
+        if self.__stc_at is not None and now >= self.__stc_at:
+            channel, failed = self.__seek_to
+            rssi = self.__rssi(channel)
+            self.__set(0x0B, 0, 0x3FF, channel)
+            self.__set(0x0A, 0, 0xFF, rssi)
+            self.__set(0x0A, 8, 0x1, 1 if rssi > self.NOISE_RSSI else 0)
+            self.__set(0x0A, 13, 0x1, 1 if failed else 0)
+            self.__set(0x0A, 14, 0x1, 1)
+            self.__stc_at = None
+            self.__rds_next = now
+            self.__scheduleRDS()
+
+        enabled = self.__get(0x02, 0, 0x1) and self.__get(0x04, 12, 0x1)
+        if not enabled or self.__rds_next is None:
+            self.__set(0x0A, 15, 0x1, 0)
+            return
+
+        if self.__instant:
+            ready = len(self.__rds) > 0
+        else:
+            ready = len(self.__rds) > 0 and now >= self.__rds_next
+            if now >= self.__rdsr_end:
+                self.__set(0x0A, 15, 0x1, 0)
+
+        if ready:
+            a, b, c, d, errors = self.__rds.popleft()
+            self.__regs[0x0C:0x10] = [ a, b, c, d ]
+            self.__set(0x0A, 9, 0x3, errors[0])
+            self.__set(0x0B, 14, 0x3, errors[1])
+            self.__set(0x0B, 12, 0x3, errors[2])
+            self.__set(0x0B, 10, 0x3, errors[3])
+            self.__set(0x0A, 15, 0x1, 1)
+            self.__rds_next = max(self.__rds_next + self.RDS_PERIOD, now - self.RDS_PERIOD)
+            self.__rdsr_end = now + self.RDSR_TIME
+            self.groups_sent += 1
+            self.__scheduleRDS()
+        elif self.__instant:
+            self.__set(0x0A, 15, 0x1, 0)
+
+    # --------------------------------------------------------------------------
+    def write(self, data):
+        old_powercfg, old_channel = self.__regs[0x02], self.__regs[0x03]
+        # an odd trailing byte is not committed
+        for i in range(len(data) // 2):
+            reg = 0x02 + i
+            if reg > 0x09: # 0x0A-0x0F are read-only
+                break
+            self.__regs[reg] = (data[2*i] << 8) | data[2*i + 1]
+
+        if len(data) >= 2:
+            self.__started(old_powercfg, old_channel)
+
+    def read(self, length):
+        self.__update()
+        words = struct.pack(">16H", *[ self.__regs[(0x0A + i) & 0xF] for i in range(16) ])
+        return [ ord(words[i % 32]) for i in range(length) ]
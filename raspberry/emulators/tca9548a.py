@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "TCA9548AEmulator" ]
+
+from .bus import EmulatedDevice
+
+# ===========================================================================
+# TCA9548AEmulator Class
+# ===========================================================================
+
+class TCA9548AEmulator(EmulatedDevice) :
+  """1-to-8 multiplexer: the devices attached to a channel answer on the
+  bus while the bit of the channel is set in the control register"""
+
+  ADDRESS = 0x70
+
+  def __init__(self):
+    self.__control  = 0
+    self.__channels = [ {} for i in range(8) ]
+    self.writes = 0
+
+  def attach(self, channel, device, address = None):
+    """Plugs device on channel at address (device.ADDRESS by default)"""
+    address = device.ADDRESS if address is None else address
+    self.__channels[channel][address] = device
+    return device
+
+  def route(self, address):
+    for channel, devices in enumerate(self.__channels):
+      if self.__control & (1 << channel) and address in devices:
+        return devices[address]
+    return None
+
+  def write(self, data):
+    if data:
+      self.__control = data[-1]
+      self.writes += 1
+
+  def read(self, length):
+    return [ self.__control ] * length
@@ -34,18 +34,452 @@
 # modified by netWorms to be integrated in Raspberry Pi tools
 
 
-__all__ = [ "I2C" ]
+__all__ = [ "I2C", "I2CBus", "I2CStats", "I2CError", "UnsupportedTransfer",
+            "RetryPolicy", "FairLock", "ShadowRegisters" ]
+
+import contextlib
+import ctypes
+import errno
+import struct
+import threading
+import time
+
+# smbus2 is a drop-in replacement of python-smbus that also exposes the
+# combined transactions (i2c_rdwr) of the kernel driver. Without any of
+# them only the backends set with I2CBus.setFactory() can be used
+try:
+  import smbus2 as smbus
+  from smbus2 import i2c_msg
+except ImportError:
+  try:
+    import smbus
+  except ImportError:
+    smbus = None
+  i2c_msg = None
+
+# Read flag of an i2c_msg (linux/i2c.h)
+I2C_M_RD = 0x0001
+
+# ===========================================================================
+# I2CError Class
+# ===========================================================================
+
+class I2CError(IOError):
+  """Transfer that failed for good, either with an error that cannot be
+  retried or after all the attempts of the retry policy"""
+
+  def __init__(self, address, reg, err, attempts):
+    IOError.__init__(self, err.errno,
+                     "Error accessing {0:#X} (register {1}) after {2} attempt(s): {3}".format(
+                       address, "-" if reg is None else "{0:#X}".format(reg),
+                       attempts, err.strerror or err))
+    self.address  = address
+    self.reg      = reg
+    self.attempts = attempts
+    self.cause    = err
+
+
+class UnsupportedTransfer(ValueError):
+  """Transaction the smbus backend cannot do as a single I2C transaction,
+  python-smbus lacking the combined transactions of smbus2 (i2c_rdwr)"""
+  pass
+
+
+# ===========================================================================
+# RetryPolicy Class
+# ===========================================================================
+
+class RetryPolicy :
+  """Number of attempts of a transfer, exponential backoff between them and
+  errnos worth a retry (the ones a glitch on the lines can produce)"""
+
+  RETRYABLE = ( errno.EIO, errno.EAGAIN, errno.ETIMEDOUT, errno.EREMOTEIO )
+
+  def __init__(self, attempts = 3, backoff = 0.001, factor = 2., max_backoff = 0.05,
+               retryable = RETRYABLE):
+    self.attempts    = max(1, attempts)
+    self.backoff     = backoff
+    self.factor      = factor
+    self.max_backoff = max_backoff
+    self.retryable   = frozenset(retryable)
+
+  def delay(self, attempt):
+    """Time to wait after the failed attempt number attempt (from 1)"""
+    return min(self.max_backoff, self.backoff * self.factor ** (attempt - 1))
+
+  def shouldRetry(self, err, attempt):
+    return attempt < self.attempts and err.errno in self.retryable
+
+
+# ===========================================================================
+# FairLock Class
+# ===========================================================================
+
+class FairLock :
+  """Reentrant lock granted in arrival order (ticket lock), so that a busy
+  thread cannot starve the others. It keeps track of the time spent waiting"""
+
+  def __init__(self):
+    self.__cond    = threading.Condition(threading.Lock())
+    self.__next    = 0 # next ticket handed out
+    self.__serving = 0 # ticket owning the lock
+    self.__owner   = None
+    self.__depth   = 0
+    self.resetStats()
+
+  def acquire(self):
+    """Blocks until the lock is granted, returns the time spent waiting"""
+    me = threading.current_thread()
+    with self.__cond:
+      if self.__owner is me:
+        self.__depth += 1
+        return 0.
+
+      ticket = self.__next
+      self.__next += 1
+      if ticket != self.__serving:
+        self.__contended += 1
+      start = time.time()
+      while ticket != self.__serving:
+        self.__cond.wait()
+      waited = time.time() - start
+
+      self.__owner = me
+      self.__depth = 1
+
+      self.__acquisitions += 1
+      self.__wait_total += waited
+      self.__wait_max    = max(self.__wait_max, waited)
+      return waited
+
+  def release(self):
+    with self.__cond:
+      if self.__owner is not threading.current_thread():
+        raise RuntimeError("cannot release un-acquired lock")
+      self.__depth -= 1
+      if self.__depth == 0:
+        self.__owner = None
+        self.__serving += 1
+        self.__cond.notify_all()
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, *args):
+    self.release()
+
+  def stats(self):
+    """Returns the number of acquisitions, how many had to wait and the
+    total/max waiting time in seconds"""
+    with self.__cond:
+      return { "acquisitions": self.__acquisitions,
+               "contended"   : self.__contended,
+               "wait_total"  : self.__wait_total,
+               "wait_max"    : self.__wait_max }
+
+  def resetStats(self):
+    self.__acquisitions = 0
+    self.__contended    = 0
+    self.__wait_total   = 0.
+    self.__wait_max     = 0.
+
+
+# ===========================================================================
+# ShadowRegisters Class
+# ===========================================================================
+
+class ShadowRegisters :
+  """Last known value of the 8-bit registers of a device, so that writing
+  an unchanged value can be skipped, and the registers written during a
+  batch that still have to be flushed to the device. The volatile
+  registers (commands, status) are never cached"""
+
+  # Clean registers rewritten to merge two dirty runs separated by at most
+  # this many registers, cheaper than the start, address and register
+  # bytes of another transfer
+  BRIDGE_MAX = 2
+
+  def __init__(self, volatile = ()):
+    self.volatile = frozenset(volatile)
+    self.values   = {}
+    self.dirty    = {}
+    self.depth    = 0 # nesting of the batches
+    self.resetStats()
+
+  def cacheable(self, reg):
+    return reg not in self.volatile
+
+  def known(self, reg, value):
+    """True if value is what the device holds (or will after the flush)"""
+    return self.cacheable(reg) and \
+      self.dirty.get(reg, self.values.get(reg)) == value
+
+  def update(self, reg, values):
+    """Records values read from or written to the device from reg"""
+    for i, value in enumerate(values):
+      if self.cacheable(reg + i):
+        self.values[reg + i] = value & 0xFF
+
+  def invalidate(self, reg = None, length = 1):
+    if reg is None:
+      self.values = {}
+    else:
+      for r in range(reg, reg + length):
+        self.values.pop(r, None)
+
+  def runs(self, block_max):
+    """Splits the dirty registers that differ from the device in the
+    fewest contiguous (reg, [values]) block writes"""
+    regs = sorted([ r for r, v in self.dirty.items() if self.values.get(r) != v ])
+    runs = []
+    for reg in regs:
+      if runs:
+        start, values = runs[-1]
+        gap = range(start + len(values), reg)
+        if len(gap) <= self.BRIDGE_MAX and len(values) + len(gap) < block_max and \
+           all([ r in self.values for r in gap ]):
+          values.extend([ self.values[r] for r in gap ] + [ self.dirty[reg] ])
+          continue
+      runs.append((reg, [ self.dirty[reg] ]))
+    return runs
+
+  def stats(self):
+    """Returns the number of writes suppressed, the bytes they would have
+    sent, the flushes of the batches and the block writes they took"""
+    return { "suppressed"  : self.__suppressed,
+             "bytes_saved" : self.__bytes_saved,
+             "flushes"     : self.__flushes,
+             "block_writes": self.__block_writes }
+
+  def countSuppressed(self, nbytes):
+    self.__suppressed  += 1
+    self.__bytes_saved += nbytes
+
+  def countFlush(self, writes):
+    self.__flushes      += 1
+    self.__block_writes += writes
+
+  def resetStats(self):
+    self.__suppressed   = 0
+    self.__bytes_saved  = 0
+    self.__flushes      = 0
+    self.__block_writes = 0
+
+
+# ===========================================================================
+# I2CStats Class
+# ===========================================================================
+
+class I2CStats :
+  """Counters of the transfers per device address and per smbus operation:
+  number of calls, errors, payload bytes and a latency histogram whose
+  bucket i counts the transfers that took less than 2**i microseconds"""
+
+  HISTOGRAM_BUCKETS = 24
+
+  def __init__(self):
+    self.__lock    = threading.Lock()
+    self.__entries = {}
+
+  def record(self, address, op, nbytes, latency, error = False):
+    bucket = min(int(latency * 1e6).bit_length(), I2CStats.HISTOGRAM_BUCKETS - 1)
+    with self.__lock:
+      entry = self.__entries.get((address, op))
+      if entry is None:
+        entry = self.__entries[(address, op)] = \
+            { "count": 0, "errors": 0, "bytes": 0,
+              "time_total": 0., "time_max": 0.,
+              "histogram": [0] * I2CStats.HISTOGRAM_BUCKETS }
+      entry["count"]      += 1
+      entry["errors"]     += 1 if error else 0
+      entry["bytes"]      += nbytes
+      entry["time_total"] += latency
+      entry["time_max"]    = max(entry["time_max"], latency)
+      entry["histogram"][bucket] += 1
+
+  def snapshot(self):
+    """Returns a copy of the counters as { (address, op): counters }"""
+    with self.__lock:
+      return dict([ (key, dict(entry, histogram = list(entry["histogram"])))
+                    for key, entry in self.__entries.items() ])
+
+  def reset(self):
+    with self.__lock:
+      self.__entries = {}
+
+  def __str__(self):
+    lines = [ "{0:>6} {1:<22} {2:>8} {3:>6} {4:>9} {5:>10} {6:>10}".format(
+        "addr", "operation", "count", "errors", "bytes", "mean (us)", "max (us)") ]
+    for (address, op), e in sorted(self.snapshot().items()):
+      lines.append("{0:>#6x} {1:<22} {2:>8} {3:>6} {4:>9} {5:>10.1f} {6:>10.1f}".format(
+          address, op, e["count"], e["errors"], e["bytes"],
+          1e6 * e["time_total"] / e["count"], 1e6 * e["time_max"]))
+    return "\n".join(lines)
+
+  # --------------------------------------------------------------------------
+  class SMBus :
+    """Wraps an smbus handle and records every transfer in the stats"""
+
+    # payload size of each operation as a function of (args, result)
+    __payload = { "read_byte"           : lambda args, res: 1,
+                  "write_byte"          : lambda args, res: 1,
+                  "read_byte_data"      : lambda args, res: 1,
+                  "write_byte_data"     : lambda args, res: 1,
+                  "read_word_data"      : lambda args, res: 2,
+                  "write_word_data"     : lambda args, res: 2,
+                  "read_i2c_block_data" : lambda args, res: args[2],
+                  "write_i2c_block_data": lambda args, res: len(args[2]),
+                  "i2c_rdwr"            : lambda args, res: sum([ m.len for m in args ]) }
+
+    def __init__(self, handle, stats):
+      self.__handle = handle
+      self.__stats  = stats
+
+    def __getattr__(self, name):
+      func = getattr(self.__handle, name)
+      if name not in self.__payload:
+        return func
+
+      payload = self.__payload[name]
+      stats   = self.__stats
+      def instrumented(*args):
+        address = args[0].addr if name == "i2c_rdwr" else args[0]
+        start = time.time()
+        try:
+          res = func(*args)
+        except IOError:
+          stats.record(address, name, 0, time.time() - start, True)
+          raise
+        stats.record(address, name, payload(args, res), time.time() - start)
+        return res
+
+      # the wrapper is built once per operation
+      setattr(self, name, instrumented)
+      return instrumented
+
+
+# ===========================================================================
+# I2CBus Class
+# ===========================================================================
+
+class I2CBus :
+  """Reference-counted smbus handle shared by every device on the same bus"""
+
+  __buses   = {}
+  __lock    = threading.Lock()
+  __stats   = None
+  __factory = None
+
+  @classmethod
+  def acquire(cls, busnum):
+    """Returns the shared handle of the bus, opening it on first use"""
+    with cls.__lock:
+      bus = cls.__buses.get(busnum)
+      if bus is None:
+        bus = cls(busnum)
+        cls.__buses[busnum] = bus
+      bus.__refcount += 1
+      return bus
+
+  @classmethod
+  def setFactory(cls, factory):
+    """Sets the callable returning the smbus handle of a bus number, for
+    the buses opened afterwards. None restores smbus.SMBus. Returns the
+    factory replaced, to be set back"""
+    with cls.__lock:
+      previous, cls.__factory = cls.__factory, factory
+    return previous
+
+  @classmethod
+  def factory(cls):
+    if cls.__factory is not None:
+      return cls.__factory
+    if smbus is None:
+      raise ImportError("smbus (or smbus2) is required to open the I2C buses")
+    return smbus.SMBus
+
+  @classmethod
+  def setStats(cls, stats):
+    """Instruments every bus with stats, None removes the instrumentation"""
+    with cls.__lock:
+      cls.__stats = stats
+      for bus in cls.__buses.values():
+        bus.__instrument()
+
+  @classmethod
+  def stats(cls):
+    return cls.__stats
+
+  @classmethod
+  def opened(cls):
+    """Returns the bus numbers currently opened"""
+    with cls.__lock:
+      return sorted(cls.__buses.keys())
+
+  def __init__(self, busnum):
+    print("Connecting to I2C{0}".format(busnum))
+    self.busnum     = busnum
+    self.handle     = I2CBus.factory()(busnum)
+    self.lock       = FairLock()
+    self.__devices  = {}
+    self.__refcount = 0
+    self.__instrument()
+
+  def __instrument(self):
+    # smbus is the handle used for the transfers, wrapped only when the
+    # stats are enabled so that they cost nothing otherwise
+    if I2CBus.__stats is None:
+      self.smbus = self.handle
+    else:
+      self.smbus = I2CStats.SMBus(self.handle, I2CBus.__stats)
+
+  def refcount(self):
+    return self.__refcount
+
+  def deviceLock(self, address, route = None):
+    """Returns the lock shared by every view on the device at address, the
+    devices behind a multiplexer being told apart by their route"""
+    key = address if route is None else (route, address)
+    with I2CBus.__lock:
+      return self.__devices.setdefault(key, FairLock())
+
+  def release(self):
+    """Drops one reference, the bus is closed when the last one is gone"""
+    with I2CBus.__lock:
+      self.__refcount -= 1
+      if self.__refcount > 0:
+        return
+      if I2CBus.__buses.get(self.busnum) is self:
+        del I2CBus.__buses[self.busnum]
+    self.handle.close()
 
-import smbus
 
 # ===========================================================================
 # Adafruit_I2C Class
 # ===========================================================================
 
 class I2C :
+  # Largest block of an SMBus i2c block transfer
+  BLOCK_MAX = 32
+
+  # Precompiled big-endian layouts
+  __U16 = struct.Struct(">H")
+  __S16 = struct.Struct(">h")
+
+  __revision = None
+  __bus      = None
+
   @staticmethod
   def getPiRevision():
     "Gets the version number of the Raspberry Pi board"
+    # /proc/cpuinfo is only parsed once per process
+    if I2C.__revision is None:
+      I2C.__revision = I2C.__readPiRevision()
+    return I2C.__revision
+
+  @staticmethod
+  def __readPiRevision():
     # Courtesy quick2wire-python-api
     # https://github.com/quick2wire/quick2wire-python-api
     try:
@@ -54,71 +488,332 @@ class I2C :
           if line.startswith('Revision'):
             return 1 if line.rstrip()[-1] in ['1','2'] else 2
     except:
-      return 0
+      pass
+    return 0
 
   @staticmethod
   def getPiI2CBusNumber():
     # Gets the I2C bus number /dev/i2c#
     return 1 if I2C.getPiRevision() > 1 else 0
+
+  # Policy of the devices created without an explicit one
+  DEFAULT_RETRY = RetryPolicy()
  
-  def __init__(self, address, busnum = -1):
+  def __init__(self, address, busnum = -1, retry = None, route = None):
     self.__address = address
+    self.__route   = route # (mux address, channel) or None if on the bus
+    self.__retry   = retry if retry is not None else I2C.DEFAULT_RETRY
+    self.__retries  = 0 # failed attempts that were retried
+    self.__recovered = 0 # transfers that succeeded after a retry
+    self.__failures = 0 # I2CError raised
+    self.__busnum  = busnum if busnum >= 0 else I2C.getPiI2CBusNumber()
     # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
-    # Alternatively, you can hard-code the bus version below:
-    # self.__smbus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
-    # self.__smbus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
-    print("Connecting to I2C{0}".format(busnum if busnum >= 0 else I2C.getPiI2CBusNumber()))
-    self.__smbus = smbus.SMBus(busnum if busnum >= 0 else I2C.getPiI2CBusNumber())
+    # Alternatively, you can hard-code the bus version:
+    # I2C(address, 0) # Force I2C0 (early 256MB Pi's)
+    # I2C(address, 1) # Force I2C1 (512MB Pi's)
+    # Devices on the same bus share a single smbus handle
+    self.__bus   = I2CBus.acquire(self.__busnum)
+    self.__lock  = self.__bus.lock
+    self.__device_lock = self.__bus.deviceLock(address, route)
+    self.__shadow  = None
+
+  def __del__(self):
+    self.close()
+
+  def close(self):
+    """Releases the shared bus handle"""
+    bus, self.__bus = self.__bus, None
+    if bus is not None:
+      bus.release()
+
+  def address(self):
+    return self.__address
+
+  def busnum(self):
+    return self.__busnum
+
+  def route(self):
+    """(mux address, channel) the device sits behind, None if it is directly
+    on the bus"""
+    return self.__route
+
+  def atomic(self):
+    """Context manager giving the exclusive use of the whole bus, so that a
+    sequence of transfers cannot be interleaved with any other device"""
+    return self.__lock
+
+  def exclusive(self):
+    """Context manager giving the exclusive use of this device, the other
+    devices of the bus can still be accessed between the transfers. It is
+    taken before atomic() and after the channel of a multiplexer, see
+    TCA9548A.use()"""
+    return self.__device_lock
+
+  def lockStats(self):
+    """Returns the contention statistics of the bus lock"""
+    return self.__lock.stats()
+
+  def setRetryPolicy(self, retry):
+    self.__retry = retry if retry is not None else I2C.DEFAULT_RETRY
+
+  def retryStats(self):
+    """Returns the number of retried attempts, of transfers recovered by a
+    retry and of transfers that failed for good"""
+    return { "retries"  : self.__retries,
+             "recovered": self.__recovered,
+             "failures" : self.__failures }
+
+  def enableShadow(self, enable = True, volatile = ()):
+    """Turns on/off the shadow register cache: a write of the value a
+    register is known to hold is skipped. volatile lists the registers
+    that are neither cached nor suppressed (commands, status)"""
+    self.__shadow = ShadowRegisters(volatile) if enable else None
+
+  def invalidateShadow(self, reg = None, length = 1):
+    """Forgets the cached value of length registers from reg, of all the
+    registers if reg is None (after a reset of the device)"""
+    if self.__shadow is not None:
+      self.__shadow.invalidate(reg, length)
+
+  def shadowStats(self):
+    """Returns the counters of the shadow cache, empty if disabled"""
+    return {} if self.__shadow is None else self.__shadow.stats()
+
+  @contextlib.contextmanager
+  def batch(self):
+    """Context manager deferring the register writes, the dirty registers
+    are flushed on exit in the fewest block writes (dropped if an exception
+    is raised). The device is held exclusively during the batch"""
+    shadow = self.__shadow
+    if shadow is None:
+      raise RuntimeError("batch() requires the shadow registers, see enableShadow()")
+
+    with self.__device_lock:
+      shadow.depth += 1
+      try:
+        yield self
+      except:
+        shadow.depth -= 1
+        if shadow.depth == 0:
+          shadow.dirty = {}
+        raise
+      shadow.depth -= 1
+      if shadow.depth == 0:
+        self.flush()
+
+  def flush(self):
+    """Writes the dirty registers of the current batch, returns the number
+    of block writes it took"""
+    shadow = self.__shadow
+    if shadow is None or not shadow.dirty:
+      return 0
+
+    with self.__device_lock:
+      runs = shadow.runs(I2C.BLOCK_MAX)
+      try:
+        for reg, values in runs:
+          self.__writeRegisters(reg, values)
+      finally:
+        shadow.dirty = {}
+      shadow.countFlush(len(runs))
+    return len(runs)
+
+  @staticmethod
+  def enableStats(enable = True):
+    """Turns on/off the transfer statistics of all the buses"""
+    if not enable:
+      I2CBus.setStats(None)
+    elif I2CBus.stats() is None:
+      I2CBus.setStats(I2CStats())
+
+  @staticmethod
+  def stats():
+    """Returns the I2CStats collecting the transfers, None if disabled"""
+    return I2CBus.stats()
+
+  @staticmethod
+  def statsSnapshot():
+    """Returns a copy of the transfer statistics, empty if disabled"""
+    stats = I2CBus.stats()
+    return {} if stats is None else stats.snapshot()
+
+  @staticmethod
+  def resetStats():
+    stats = I2CBus.stats()
+    if stats is not None:
+      stats.reset()
 
   def reverseByteOrder(self, data):
     """Reverses the byte order of an int (16-bit) or long (32-bit) value"""
     # Courtesy Vishal Sapre
-    byteCount = len(hex(data)[2:].replace('L','')[::2])
+    byteCount = max(1, (data.bit_length() + 7) >> 3)
     val       = 0
     for i in range(byteCount):
       val    = (val << 8) | (data & 0xff)
       data >>= 8
     return val
 
-  def errMsg(self):
-    print("Error accessing {0:#X}: Check your I2C address".format(self.__address))
-    return -1
+  def __call(self, reg, func, *args):
+    """Runs a transfer with the bus lock held, applying the retry policy"""
+    attempt = 1
+    while True:
+      try:
+        with self.__lock:
+          result = func(*args)
+        if attempt > 1:
+          self.__recovered += 1
+        return result
+      except IOError, err:
+        if not self.__retry.shouldRetry(err, attempt):
+          self.__failures += 1
+          raise I2CError(self.__address, reg, err, attempt)
+      self.__retries += 1
+      time.sleep(self.__retry.delay(attempt))
+      attempt += 1
+
+  def __writeRegisters(self, reg, values):
+    """Writes values from reg and records them in the shadow registers"""
+    try:
+      if len(values) == 1:
+        self.__call(reg, self.__bus.smbus.write_byte_data, self.__address, reg, values[0])
+      else:
+        self.__call(reg, self.__bus.smbus.write_i2c_block_data, self.__address, reg, values)
+    except I2CError:
+      self.__shadow.invalidate(reg, len(values))
+      raise
+    self.__shadow.update(reg, values)
+
+  def __writeShadowed(self, reg, values):
+    """Write with the shadow registers enabled: skipped if the registers
+    already hold values, deferred during a batch"""
+    shadow = self.__shadow
+    with self.__device_lock:
+      if all([ shadow.known(reg + i, v & 0xFF) for i, v in enumerate(values) ]):
+        shadow.countSuppressed(len(values))
+        return
+
+      if shadow.depth > 0:
+        if all([ shadow.cacheable(reg + i) for i in range(len(values)) ]):
+          for i, v in enumerate(values):
+            shadow.dirty[reg + i] = v & 0xFF
+          return
+        # a command goes after the configuration written before it
+        self.flush()
+
+      self.__writeRegisters(reg, values)
 
   def write_byte(self, reg, value):
     """Writes an 8-bit value to the specified register"""
-    try:
-      self.__smbus.write_byte_data(self.__address, reg, value)
-    except IOError, err:
-      return self.errMsg()
+    if self.__shadow is not None:
+      return self.__writeShadowed(reg, [ value ])
+    self.__call(reg, self.__bus.smbus.write_byte_data, self.__address, reg, value)
+
+  def send_byte(self, value):
+    """Writes a single byte without register (the control register of the
+    multiplexers and of the simplest devices)"""
+    self.__call(None, self.__bus.smbus.write_byte, self.__address, value)
+
+  def receive_byte(self):
+    """Reads a single byte without register"""
+    return self.__call(None, self.__bus.smbus.read_byte, self.__address)
 
   def write_short(self, reg, value):
     """Writes a 16-bit value to the specified register"""
-    try:
-      self.__smbus.write_word_data(self.__address, reg, value)
-    except IOError, err:
-      return self.errMsg()
+    if self.__shadow is not None:
+      # smbus words are sent low byte first
+      return self.__writeShadowed(reg, [ value & 0xFF, (value >> 8) & 0xFF ])
+    self.__call(reg, self.__bus.smbus.write_word_data, self.__address, reg, value)
 
   def write_block(self, reg, list):
     """Writes an array of bytes using I2C format"""
-    try:
-      self.__smbus.write_i2c_block_data(self.__address, reg, list)
-    except IOError, err:
-      return self.errMsg()
+    if self.__shadow is not None:
+      return self.__writeShadowed(reg, [ v for v in list ])
+    self.__call(reg, self.__bus.smbus.write_i2c_block_data, self.__address, reg, list)
 
   def read_block(self, reg, length):
     """Read a list of bytes from the I2C device"""
-    try:
-      results = self.__smbus.read_i2c_block_data(self.__address, reg, length)
+    result = self.__call(reg, self.__bus.smbus.read_i2c_block_data, self.__address, reg, length)
+    if self.__shadow is not None:
+      self.__shadow.update(reg, result)
+    return result
+
+  def transfer(self, write, read_length = 0):
+    """Writes a list of bytes then reads read_length bytes after a repeated
+    start, the whole exchange being a single I2C transaction.
+
+    Arbitrary transactions require smbus2 (i2c_rdwr). With python-smbus
+    only a write alone, or a register byte followed by a read of at most
+    BLOCK_MAX bytes, are supported, anything else raises
+    UnsupportedTransfer: a write then a separate read would not be the
+    same transaction"""
+    reg = write[0] if len(write) > 0 else None
+    if i2c_msg is not None:
+      def rdwr():
+        msgs = [ i2c_msg.write(self.__address, write) ]
+        if read_length > 0:
+          msgs.append(i2c_msg.read(self.__address, read_length))
+        self.__bus.smbus.i2c_rdwr(*msgs)
+        return list(msgs[-1]) if read_length > 0 else []
+      return self.__call(reg, rdwr)
+
+    # python-smbus only knows the register based combined transactions
+    if read_length == 0:
+      self.write_block(write[0], list(write[1:]))
+      return []
+    if len(write) == 1 and read_length <= I2C.BLOCK_MAX:
+      return self.read_block(write[0], read_length)
+    raise UnsupportedTransfer("python-smbus cannot write more than a register byte then "
+                              "read, or read more than {0} bytes, in a single transaction "
+                              "(smbus2 is required)".format(I2C.BLOCK_MAX))
+
+  def read_registers(self, reg, length):
+    """Reads length contiguous registers starting at reg"""
+    if i2c_msg is not None or length <= I2C.BLOCK_MAX:
+      results = self.transfer([reg], length)
+      if self.__shadow is not None:
+        self.__shadow.update(reg, results)
       return results
-    except IOError, err:
-      return self.errMsg()
+
+    # Without i2c_rdwr the block reads are limited to 32 bytes
+    results = []
+    with self.__lock:
+      for offset in range(0, length, I2C.BLOCK_MAX):
+        results += self.read_block(reg + offset, min(I2C.BLOCK_MAX, length - offset))
+    return results
+
+  def read_into(self, reg, buf, length = None):
+    """Reads contiguous registers starting at reg into buf, a bytearray or
+    a writable memoryview, returns the number of bytes read"""
+    length = len(buf) if length is None else length
+    if i2c_msg is not None and isinstance(buf, bytearray):
+      # The read message points to buf itself, nothing is copied
+      target = (ctypes.c_char * length).from_buffer(buf)
+      def rdwr():
+        self.__bus.smbus.i2c_rdwr(i2c_msg.write(self.__address, [reg]),
+                                  i2c_msg(addr = self.__address, flags = I2C_M_RD,
+                                          len = length, buf = target))
+      self.__call(reg, rdwr)
+      if self.__shadow is not None:
+        self.__shadow.update(reg, buf[0:length])
+    else:
+      buf[0:length] = bytearray(self.read_registers(reg, length))
+    return length
+
+  def read_struct(self, reg, layout, buf = None):
+    """Reads layout.size registers starting at reg and decodes them in a
+    single unpack of the precompiled struct.Struct layout, buf is an
+    optional bytearray of at least layout.size bytes to read into"""
+    if buf is None:
+      buf = bytearray(layout.size)
+    self.read_into(reg, buf, layout.size)
+    return layout.unpack_from(buf)
 
   def read_byte(self, reg):
     """Read an byte from the I2C device"""
-    try:
-      return self.__smbus.read_byte_data(self.__address, reg)
-    except IOError, err:
-      return self.errMsg()
+    result = self.__call(reg, self.__bus.smbus.read_byte_data, self.__address, reg)
+    if self.__shadow is not None:
+      self.__shadow.update(reg, [ result ])
+    return result
 
   def read_signed_byte(self, reg):
     """Reads a signed byte from the I2C device"""
@@ -130,14 +825,12 @@ class I2C :
   def read_short(self, reg):
     """Reads an unsigned 16-bit value from the I2C device"""
 
-    msb, lsb = self.read_block(reg, 2)
-    return ((msb << 8) + lsb)
+    return self.read_struct(reg, I2C.__U16)[0]
 
 
   def read_signed_short(self, reg):
     "Reads a signed 16-bit value from the I2C device"
 
-    result = self.read_short(reg)
-    return result - (1 << 16) * (result >> 15)
+    return self.read_struct(reg, I2C.__S16)[0]
 
 
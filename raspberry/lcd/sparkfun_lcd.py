@@ -2,7 +2,11 @@
 
 __all__ = [ "SparkfunLCD" ]
 
-import serial
+try:
+    import serial
+except ImportError:
+    serial = None
+from .. import aio
 
 class SparkfunLCD:
     def __sendCommand(self, command):
@@ -16,7 +20,10 @@ class SparkfunLCD:
         self.__width  = width
         self.__height = height
  
+        if serial is None:
+            raise ImportError("pyserial is required by the SparkfunLCD")
         self.__serial = serial.Serial(serial_port, baudrate)
+        self.__serial_port = serial_port
 
         self.__escape_chr = "\x7C"
         self.__command_list = { "clearScreen":   "\x00", # C-@
@@ -137,3 +144,48 @@ class SparkfunLCD:
 
     def toggleSplash(self):
         self.__sendCommand("toggleSplash")
+
+    # --------------------------------------------------------------------------
+    # Coroutine variants, the serial writes run in the executor of the port
+    def __runAsync(self, method, *args):
+        return aio.run(aio.executor(("serial", self.__serial_port)), method, *args)
+
+    @aio.coroutine
+    def clearScreenAsync(self):
+        yield aio.From(self.__runAsync(self.clearScreen))
+
+    @aio.coroutine
+    def setBacklightAsync(self, backlight):
+        yield aio.From(self.__runAsync(self.setBacklight, backlight))
+
+    @aio.coroutine
+    def writeAsync(self, txt):
+        yield aio.From(self.__runAsync(self.write, txt))
+
+    @aio.coroutine
+    def setPositionAsync(self, x, y):
+        yield aio.From(self.__runAsync(self.setPosition, x, y))
+
+    @aio.coroutine
+    def setCharPositionAsync(self, x, y):
+        yield aio.From(self.__runAsync(self.setCharPosition, x, y))
+
+    @aio.coroutine
+    def setPixelAsync(self, x, y, val = 0x01):
+        yield aio.From(self.__runAsync(self.setPixel, x, y, val))
+
+    @aio.coroutine
+    def drawLineAsync(self, x1, y1, x2, y2, val = 0x01):
+        yield aio.From(self.__runAsync(self.drawLine, x1, y1, x2, y2, val))
+
+    @aio.coroutine
+    def drawBoxAsync(self, x1, y1, x2, y2, val = 0x01):
+        yield aio.From(self.__runAsync(self.drawBox, x1, y1, x2, y2, val))
+
+    @aio.coroutine
+    def eraseBoxAsync(self, x1, y1, x2, y2):
+        yield aio.From(self.__runAsync(self.eraseBox, x1, y1, x2, y2))
+
+    @aio.coroutine
+    def drawCircleAsync(self, x, y, r, val = 0x01):
+        yield aio.From(self.__runAsync(self.drawCircle, x, y, r, val))
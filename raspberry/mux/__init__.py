@@ -0,0 +1,6 @@
+__all__ = [  ]
+
+import tca9548a
+
+from tca9548a import TCA9548A
+__all__.extend(tca9548a.__all__)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "TCA9548A" ]
+
+import contextlib
+
+from ..i2c import I2C
+
+# ===========================================================================
+# TCA9548A Class
+# ===========================================================================
+
+class TCA9548A :
+  """1-to-8 I2C multiplexer (TI datasheet SCPS207). The single control
+  register holds one enable bit per downstream channel. The driver
+  remembers the channel it enabled, so selecting it again sends nothing.
+
+  The devices behind a channel are created with route = (address, channel)
+  so that identical devices on different channels get their own lock. The
+  locks are taken in the order multiplexer, device then bus: use() must not
+  be entered while holding the lock of a device or of the bus"""
+
+  CHANNELS = 8
+
+  def __init__(self, address = 0x70, busnum = -1, retry = None):
+    self.__i2c      = I2C(address, busnum, retry = retry)
+    self.__channel  = -1 # unknown until the first write
+    self.__switches = 0
+    self.select(None)
+
+  def address(self):
+    return self.__i2c.address()
+
+  def busnum(self):
+    return self.__i2c.busnum()
+
+  def route(self, channel):
+    """Route of the devices behind channel, see I2C"""
+    return (self.address(), channel)
+
+  @contextlib.contextmanager
+  def use(self, channel):
+    """Selects channel and keeps it selected until the block exits, the other
+    threads waiting to select a channel of this multiplexer"""
+    with self.__i2c.exclusive():
+      self.select(channel)
+      yield self
+
+  def channel(self):
+    """Channel enabled, None if they are all disabled"""
+    return self.__channel
+
+  def select(self, channel):
+    """Connects the downstream channel (0-7) to the bus, None disconnects
+    all of them. Returns True if the control register was written"""
+    if channel is not None and not 0 <= channel < self.CHANNELS:
+      raise ValueError("Invalid channel {0}".format(channel))
+    with self.__i2c.exclusive():
+      if channel == self.__channel:
+        return False
+      self.__i2c.send_byte(0 if channel is None else 1 << channel)
+      self.__channel = channel
+      self.__switches += 1
+    return True
+
+  def readControl(self):
+    """Reads back the control register"""
+    return self.__i2c.receive_byte()
+
+  def switches(self):
+    """Number of writes of the control register"""
+    return self.__switches
@@ -9,3 +9,8 @@ import rds
 
 from rds import RDS
 __all__.extend(rds.__all__)
+
+import rdsworker
+
+from rdsworker import RDSWorker
+__all__.extend(rdsworker.__all__)
@@ -35,20 +35,15 @@ class RDS:
     __pty = 0
     __tp = 0
     __pi = 0
-    __reg = ['']*8
-    __radio_text = ['']*64
 
     __text_ab = -1;
+    __text_end = 64 # position of the carriage return ending the text
 
     __static_pty = True
     __compressed = False
     __stereo     = True
     __artificial_head = False
 
-    __seen_groups = Set()
-
-    __alternative_frequency = Set()
-
     UNKNOWN = 0
     EUROPE  = 1
     USA     = 2
@@ -56,6 +51,12 @@ class RDS:
     def __init__(self, region = UNKNOWN):
         self.__region = region
 
+        # the buffers are filled in place by the groups of the station
+        self.__reg = ['']*8
+        self.__radio_text = ['']*64
+        self.__seen_groups = Set()
+        self.__alternative_frequency = Set()
+
     def __str__(self):
         msg = ["RDS: "]
         msg += [ " - PI : {0:X}{1}".format(self.__pi,
@@ -75,32 +76,50 @@ class RDS:
     def getProgramName(self):
         return"".join(self.__reg)
 
+    def getCompleteProgramName(self):
+        '''
+        Return the program service name once its 4 segments were
+        received, None before
+        '''
+        if '' in self.__reg:
+            return None
+        return "".join(self.__reg)
+
     def getRadioText(self):
         return "".join(self.__radio_text)
 
-    def decode(self, a, chwa, b, chwb, c, chwc, d, chwd):
-        if chwa > 2:
-            return False
+    def getCompleteRadioText(self):
+        '''
+        Return the radio text once all its segments up to the carriage
+        return ending it were received, None before
+        '''
+        text = self.__radio_text[:self.__text_end]
+        if not text or '' in text:
+            return None
+        return "".join(text)
 
-        self.__pi = a
+    def getAlternativeFrequencies(self):
+        return sorted(self.__alternative_frequency)
 
-        if chwb > 2:
+    def decode(self, a, chwa, b, chwb, c, chwc, d, chwd):
+        '''
+        Decodes a group given its blocks and their error levels (BLERA-D),
+        returns False if the group is rejected. The group is checked
+        before any change: a rejected group leaves the state untouched
+        '''
+        b0 = (b >> 11) & 0x1
+        if chwa > 2 or chwb > 2 or chwd > 2 or (b0 == 0 and chwc > 2):
             return False
 
+        self.__pi  = a
         self.__pty = (b >>  5) & 0xF
         self.__tp  = (b >> 10) & 0x1
 
         group_type = (b >> 12) & 0xF
-        b0         = (b >> 11) & 0x1
-        
-        if chwd < 3:
-            if b0 == 0: # Version A
-                if chwc < 3:
-                    self.__decodeVersionA(group_type, b & 0x1F, c, d)
-                else: return False
-            else: # Verison B
-                self.__decodeVersionB(group_type, b & 0x1F, d)
-        else: return False
+        if b0 == 0: # Version A
+            self.__decodeVersionA(group_type, b & 0x1F, c, d)
+        else: # Verison B
+            self.__decodeVersionB(group_type, b & 0x1F, d)
 
         self.__seen_groups.add(group_type)
         return True
@@ -109,13 +128,13 @@ class RDS:
         if group == 0:
             self.__decode0B(b, d)
         if group == 2:
-            self.__decode2(b, [d >> 8, d & 0xFF])
+            self.__decode2(b, 2, d, 0)
 
     def __decodeVersionA(self, group, b, c, d):
         if group == 0:
             self.__decode0A(b, c, d)
         if group == 2:
-            self.__decode2(b, [c >> 8, c & 0xFF, d >> 8, d & 0xFF])
+            self.__decode2(b, 4, c, d)
 
     def __decode0A(self, b, c, d):
         fs = [c >> 8, c & 0xFF]
@@ -132,16 +151,37 @@ class RDS:
         self.__reg[2*c    ] = self.__ascii_table[d >> 8  ]
         self.__reg[2*c + 1] = self.__ascii_table[d & 0xFF]
 
-    def __decode2(self, b, chars):
+    def __decode2(self, b, length, first, second):
+        '''
+        Radio text segment of length characters (4 in 2A, 2 in 2B) held
+        by the words first and second
+        '''
         c = b & 0xF
         t_ab = b >> 4
 
         if not self.__text_ab == t_ab:
             self.__radio_text = [''] * 64
             self.__text_ab = t_ab
-
-        for i, ch in enumerate(chars):
-            self.__radio_text[len(chars) * c + i] = self.__ascii_table[ch & 0xFF]
+            self.__text_end = 64
+
+        text = self.__radio_text
+        pos  = length * c
+        text[pos    ] = self.__ascii_table[first >> 8  ]
+        text[pos + 1] = self.__ascii_table[first & 0xFF]
+        if length == 4:
+            text[pos + 2] = self.__ascii_table[second >> 8  ]
+            text[pos + 3] = self.__ascii_table[second & 0xFF]
+
+        # the table maps the carriage return to a space, it is found in
+        # the bytes
+        if first >> 8 == 0x0D:
+            self.__text_end = min(self.__text_end, pos)
+        elif first & 0xFF == 0x0D:
+            self.__text_end = min(self.__text_end, pos + 1)
+        elif length == 4 and second >> 8 == 0x0D:
+            self.__text_end = min(self.__text_end, pos + 2)
+        elif length == 4 and second & 0xFF == 0x0D:
+            self.__text_end = min(self.__text_end, pos + 3)
 
 
     def __decodeDI(self, di, c):
@@ -181,8 +221,8 @@ class RDS:
                      '0' ,'1' ,'2' ,'3' ,'4' ,'5' ,'6' ,'7' ,'8' ,'9' ,':' ,';' ,'<' ,'=' ,'>' ,'?' ,
                      '@' ,'A' ,'B' ,'C' ,'D' ,'E' ,'F' ,'G' ,'H' ,'I' ,'J' ,'K' ,'L' ,'M' ,'N' ,'O' ,
                      'P' ,'Q' ,'R' ,'S' ,'T' ,'U' ,'V' ,'W' ,'X' ,'Y' ,'Z' ,'[' ,'\\',']' ,'―' ,'_' ,
-                     'a' ,'b' ,'c' ,'d' ,'e' ,'f' ,'g' ,'h' ,'i' ,'j' ,'k' ,'l' ,'m' ,'n' ,'o' ,'p' ,
-                     'q' ,'r' ,'s' ,'t' ,'u' ,'1' ,'v' ,'w' ,'x' ,'y' ,'z' ,'{' ,'|' ,'}' ,'̄ ' ,' ' ,
+                     '‖' ,'a' ,'b' ,'c' ,'d' ,'e' ,'f' ,'g' ,'h' ,'i' ,'j' ,'k' ,'l' ,'m' ,'n' ,'o' ,
+                     'p' ,'q' ,'r' ,'s' ,'t' ,'u' ,'v' ,'w' ,'x' ,'y' ,'z' ,'{' ,'|' ,'}' ,'̄ ' ,' ' ,
                      'á' ,'à' ,'é' ,'è' ,'í' ,'ì' ,'ó' ,'ò' ,'ú' ,'ù' ,'Ñ' ,'Ç' ,'Ş' ,'ß' ,'¡' ,'I' ,
                      'â' ,'ä' ,'ê' ,'ë' ,'î' ,'ï' ,'ô' ,'ö' ,'û' ,'ü' ,'ñ' ,'ç' ,'ş' ,'ğ' ,'ı' ,'i' ,
                      'a' ,'α' ,'©' ,'‰' ,'Ğ' ,'ĕ' ,'ň' ,'ő' ,'π' ,'€' ,'₤' ,'$' ,'←' ,'↑' ,'→' ,'↓' ,
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms 
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "RDSWorker" ]
+
+import Queue
+import threading
+import time
+
+from .rds import RDS
+
+class RDSWorker:
+    '''
+    Background RDS acquisition of a SI470x: a thread reads the groups
+    (SI470x.nextRDSGroup()) into a bounded queue, a second one decodes
+    them and notifies the subscribers, so that a slow application does
+    not make the radio miss groups:
+
+        worker = RDSWorker(radio)
+        worker.subscribe("ps", lambda freq, ps: display(ps))
+        worker.start()
+        ...
+        worker.stop()
+
+    The events and the value given with the frequency to their callbacks:
+     - "group": the raw group (a, b, c, d, errors, timestamp)
+     - "ps"   : the program service name, once complete and changed
+     - "rt"   : the radio text, once complete and changed
+     - "af"   : the list of the alternative frequencies, when it grows
+
+    The callbacks run in the decoding thread. When the queue is full the
+    oldest group is dropped and counted. An unexpected exception in one
+    of the threads stops the worker: running() turns False and error()
+    returns the exception.
+    '''
+
+    EVENTS = ( "group", "ps", "rt", "af" )
+
+    # delay before reading again after a failed transfer
+    __error_delay = 0.1
+
+    def __init__(self, radio, queue_size = 64):
+        self.__radio = radio
+        self.__queue = Queue.Queue(queue_size)
+        self.__subscribers = dict([ (event, []) for event in self.EVENTS ])
+
+        self.__rds  = {} # RDS state per frequency
+        self.__last = {} # last value notified per (event, frequency)
+
+        self.__running = False
+        self.__error = None
+        self.__acquisition = None
+        self.__decoding = None
+        self.resetStats()
+
+    def subscribe(self, event, callback):
+        '''
+        Calls callback(frequency, value) on each event
+        '''
+        if event not in self.__subscribers:
+            raise ValueError("Unknown RDS event {0}, expected one of {1}".format(event, self.EVENTS))
+        self.__subscribers[event].append(callback)
+
+    def unsubscribe(self, event, callback):
+        self.__subscribers[event].remove(callback)
+
+    def start(self):
+        '''
+        Starts the threads, after joining the ones of a worker that died
+        '''
+        if self.__running:
+            return
+        self.stop()
+
+        self.__running = True
+        self.__error = None
+        self.__acquisition = threading.Thread(target = self.__run, args = (self.__acquire,),
+                                              name = "rds-acquisition")
+        self.__decoding    = threading.Thread(target = self.__run, args = (self.__decode,),
+                                              name = "rds-decoding")
+        # the decoding first, the acquisition ends it
+        for thread in (self.__decoding, self.__acquisition):
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        '''
+        Stops the acquisition, the groups queued are decoded before
+        returning
+        '''
+        self.__running = False
+        for thread in (self.__acquisition, self.__decoding):
+            if thread is not None:
+                thread.join()
+        self.__acquisition = None
+        self.__decoding = None
+
+    def running(self):
+        '''
+        True while the worker runs, False once stopped or dead
+        '''
+        return self.__running
+
+    def error(self):
+        '''
+        Returns the exception that stopped the worker, None otherwise
+        '''
+        return self.__error
+
+    def rds(self, frequency = None):
+        '''
+        Returns the RDS decoded for frequency (the current channel by
+        default), None if no group was received there
+        '''
+        if frequency is None:
+            frequency = self.__radio.getChannel()
+        return self.__rds.get(frequency)
+
+    def stats(self):
+        '''
+        Returns the number of groups received, dropped (queue full),
+        decoded, rejected (too many errors), waiting in the queue, of
+        failed reads and of callbacks that raised
+        '''
+        return { "received"       : self.__received,
+                 "dropped"        : self.__dropped,
+                 "decoded"        : self.__decoded,
+                 "rejected"       : self.__rejected,
+                 "queued"         : self.__queue.qsize(),
+                 "read_errors"    : self.__read_errors,
+                 "callback_errors": self.__callback_errors }
+
+    def resetStats(self):
+        self.__received = 0
+        self.__dropped  = 0
+        self.__decoded  = 0
+        self.__rejected = 0
+        self.__read_errors     = 0
+        self.__callback_errors = 0
+
+    # --------------------------------------------------------------------------
+    def __run(self, loop):
+        try:
+            loop()
+        except Exception, err:
+            self.__error = err
+            self.__running = False
+
+    def __acquire(self):
+        radio = self.__radio
+        try:
+            while self.__running:
+                try:
+                    group = radio.nextRDSGroup()
+                except IOError:
+                    self.__read_errors += 1
+                    time.sleep(self.__error_delay)
+                    continue
+
+                if group is not None:
+                    self.__received += 1
+                    self.__push((radio.getChannel(), group))
+        finally:
+            # end of the groups for the decoding thread, unless it died
+            while self.__decoding.is_alive():
+                try:
+                    self.__queue.put(None, timeout = self.__error_delay)
+                    break
+                except Queue.Full:
+                    pass
+
+    def __push(self, item):
+        # only this thread fills the queue, there is room after a get
+        try:
+            self.__queue.put_nowait(item)
+        except Queue.Full:
+            try:
+                self.__queue.get_nowait()
+                self.__dropped += 1
+            except Queue.Empty:
+                pass
+            self.__queue.put_nowait(item)
+
+    def __decode(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+
+            frequency, group = item
+            self.__notify("group", frequency, group)
+
+            rds = self.__rds.get(frequency)
+            if rds is None:
+                rds = self.__rds[frequency] = RDS(region = self.__radio.getRDSRegion())
+
+            a, b, c, d, errors, timestamp = group
+            if not rds.decode(a, errors[0], b, errors[1], c, errors[2], d, errors[3]):
+                self.__rejected += 1
+                continue
+            self.__decoded += 1
+
+            ps = rds.getCompleteProgramName()
+            if ps is not None:
+                self.__changed("ps", frequency, ps)
+
+            rt = rds.getCompleteRadioText()
+            if rt is not None:
+                self.__changed("rt", frequency, rt)
+
+            afs = rds.getAlternativeFrequencies()
+            if afs:
+                self.__changed("af", frequency, afs)
+
+    def __changed(self, event, frequency, value):
+        if self.__last.get((event, frequency)) != value:
+            self.__last[(event, frequency)] = value
+            self.__notify(event, frequency, value)
+
+    def __notify(self, event, frequency, value):
+        for callback in self.__subscribers[event]:
+            try:
+                callback(frequency, value)
+            except Exception:
+                self.__callback_errors += 1
@@ -28,12 +28,18 @@
 __all__ = [ "SI470x" ]
 
 from ..i2c import I2C
+from .. import aio
 from .rds import RDS
 
-import RPi.GPIO as gpio 
+try:
+    import RPi.GPIO as gpio
+except ImportError:
+    gpio = None
 import time
 import array
-import copy
+import contextlib
+import struct
+import threading
 
 class SI470x:
     # De-Emphasis[3:0] Space[3:0] Band[3:0]
@@ -51,11 +57,31 @@ class SI470x:
     WRAP  = 0
 
     __i2c = None
+    __async = None
     __registers = None
     __properties = None
 
     __freq = 0
 
+    # interrupt mode, BCM pin wired to GPIO2 (None when polling) and the
+    # interrupts enabled
+    __irq_pin = None
+    __irq_stc = False
+    __irq_rds = False
+
+    # period of the RDS groups (1187.5 bit/s) and polling interval of
+    # nextRDSGroup(), below the 40ms RDSR stays set in the standard mode
+    __rds_period = 0.086
+    __rds_poll   = 0.035
+
+    # STC polling: typical seek/tune time of the datasheet rev 1.1 (table
+    # 8, per channel for the seek) the first delay starts from, interval
+    # of the following polls and smoothing of the durations measured
+    __stc_typical  = 0.060
+    __stc_poll_min = 0.001
+    __stc_poll_max = 0.016
+    __stc_alpha    = 0.25
+
     # configuration values given in Mhz
     __spacing  = { 0x000: 0.2 , 0x010: 0.1, 0x020: 0.050  }
     __band_min = { 0x000: 87.5, 0x001: 76 , 0x002: 76 }
@@ -64,29 +90,47 @@ class SI470x:
     __rds_errors = ["0 errors", "1-2 errors", "3-5 errors", "6+ errors"]
 
     def __init__(self, address=0x10, rst_pin = 23,
-                 region = EUROPE, volume = 16, debug=False):
+                 region = EUROPE, volume = 16, debug=False, retry = None):
         '''
         This initialize the Si470x module according to the datasheet
         rev 1.1 and the document AN230 rev0.9
         can be found here:
         http://www.sparkfun.com/datasheets/BreakoutBoards/Si4702-03-C19-1.pdf
+
+        retry is the RetryPolicy of the I2C transfers (I2C.DEFAULT_RETRY
+        if None), rst_pin can be None when the reset is not wired (or
+        the bus is emulated)
         '''
 
         self.__debug = debug
-        self.__i2c = I2C(address)
+        self.__irq = threading.Condition()
+        self.__interrupts = 0
+        self.__rds_seen   = 0 # interrupts handled by pollRDS()
+        self.__rds        = {}  # RDS state per frequency
+        self.__rds_last   = (None, 0) # last group of nextRDSGroup() and its time
+        self.__stc_expected = { "tune": self.__stc_typical, "seek": self.__stc_typical }
+        self.resetTuneStats()
+        self.__i2c = I2C(address, retry = retry)
         self.__registers = SI470x.Registers(self.__i2c)
+        self.__stc       = self.__registers.getter("stc")
+        self.__rds_group = self.__registers.getter("rdsr",
+                                                   "rdsa", "blera", "rdsb", "blerb",
+                                                   "rdsc", "blerc", "rdsd", "blerd")
         self.__properties = SI470x.Properties(self.__i2c)
 
         self.__rst_pin = rst_pin
 
-        gpio.setwarnings(False)
-        gpio.setmode(gpio.BCM)  # We will use board numbering instead of pin numbering. 
-        gpio.setup(self.__rst_pin, gpio.OUT)
+        if self.__rst_pin is not None:
+            if gpio is None:
+                raise ImportError("RPi.GPIO is required to reset the Si470x")
+            gpio.setwarnings(False)
+            gpio.setmode(gpio.BCM)  # We will use board numbering instead of pin numbering. 
+            gpio.setup(self.__rst_pin, gpio.OUT)
 
-        gpio.output(self.__rst_pin, gpio.LOW)
-        time.sleep(.1)
-        gpio.output(self.__rst_pin ,gpio.HIGH)
-        time.sleep(0.5)
+            gpio.output(self.__rst_pin, gpio.LOW)
+            time.sleep(.1)
+            gpio.output(self.__rst_pin ,gpio.HIGH)
+            time.sleep(0.5)
 
         # initial read
         self.__registers.read()
@@ -123,97 +167,406 @@ class SI470x:
         return s
 
 
-    def __wait_stc(self, value, timeout = 1):
+    def __stcDelays(self, kind):
+        '''
+        Delays before the status reads waiting for STC: most of the
+        duration expected for the tune/seek (nothing to wait for when
+        clearing STC), then from 1ms doubling up to 16ms
+        '''
+        yield 0.95 * self.__stc_expected[kind] if kind is not None else 0
+        delay = self.__stc_poll_min
+        while True:
+            yield delay
+            delay = min(delay * 2, self.__stc_poll_max)
+
+    def __recordStc(self, kind, latency, polls, timeouted, previous):
+        '''
+        Records a tune/seek and refines the duration expected for the
+        next ones. latency is the time of the read that saw STC set, the
+        tune/seek completed after the previous read: the middle of the
+        two is the estimate of its duration
+        '''
+        stats = self.__stc_stats[kind]
+        stats["count"]       += 1
+        stats["polls"]       += polls
+        stats["last_polls"]   = polls
+        stats["last_latency"] = latency
+        stats["total_time"]  += latency
+        stats["max_latency"]  = max(stats["max_latency"], latency)
+        stats["min_latency"]  = latency if stats["count"] == 1 else min(stats["min_latency"], latency)
+        if timeouted:
+            stats["timeouts"] += 1
+        else:
+            estimate = (previous + latency) / 2
+            self.__stc_expected[kind] += self.__stc_alpha * (estimate - self.__stc_expected[kind])
+
+    def __wait_stc(self, value, timeout = 1, kind = None):
+        '''
+        Waits until STC is value, kind ("tune" or "seek") for the waits
+        of the end of a tune/seek that are measured
+        '''
         start = time.time()
+        previous = start # time of the last read that did not see STC
         timeouted = False
+        polls = 0
+
+        stc = self.__stc
+        read = self.__registers.read
+
+        # only the setting of STC raises the interrupt, its clearing is
+        # polled. The interrupt may predate the wait: read first
+        irq = value == 1 and self.__irq_stc
+        seen = self.__interrupts
+        if irq:
+            read(end = "statusrssi")
+            polls += 1
 
-        while(self.__registers.get("stc") != value and not timeouted):
+        delays = self.__stcDelays(kind)
+        while(stc() != value and not timeouted):
             timeouted = (time.time() - start > timeout)
-            self.__registers.read(end = "statusrssi")
+            previous = time.time()
+            if irq:
+                seen = self.__waitInterrupt(seen, start + timeout - time.time())
+            else:
+                time.sleep(max(min(next(delays), start + timeout - time.time()), 0))
+            read(end = "statusrssi")
+            polls += 1
 
+        if kind is not None:
+            self.__recordStc(kind, time.time() - start, polls, timeouted, previous - start)
         return timeouted
 
 
+    @aio.coroutine
+    def __waitStcAsync(self, value, timeout = 1, kind = None):
+        start = time.time()
+        previous = start # time of the last read that did not see STC
+        timeouted = False
+        polls = 0
+
+        bus = self.__asyncBus()
+        irq = value == 1 and self.__irq_stc
+        seen = self.__interrupts
+        if irq:
+            yield aio.From(bus.run(self.__registers.read, "statusrssi"))
+            polls += 1
+
+        delays = self.__stcDelays(kind)
+        while(self.__stc() != value and not timeouted):
+            timeouted = (time.time() - start > timeout)
+            previous = time.time()
+            if irq:
+                seen = yield aio.From(self.__waitInterruptAsync("stc", seen,
+                                                                start + timeout - time.time()))
+            else:
+                yield aio.From(aio.sleep(max(min(next(delays), start + timeout - time.time()), 0)))
+            yield aio.From(bus.run(self.__registers.read, "statusrssi"))
+            polls += 1
+
+        if kind is not None:
+            self.__recordStc(kind, time.time() - start, polls, timeouted, previous - start)
+        raise aio.Return(timeouted)
+
+
+    def tuneStats(self):
+        '''
+        Returns per operation ("tune", "seek") the number of operations,
+        of timeouts and of status reads, the latencies from the command
+        to the STC seen (last, min, max, total) and the duration expected
+        for the next one, from which the polling starts
+        '''
+        stats = {}
+        for kind, values in self.__stc_stats.items():
+            stats[kind] = dict(values, expected = self.__stc_expected[kind])
+        return stats
+
+    def resetTuneStats(self):
+        self.__stc_stats = {}
+        for kind in ("tune", "seek"):
+            self.__stc_stats[kind] = { "count": 0, "timeouts": 0,
+                                       "polls": 0, "last_polls": 0,
+                                       "last_latency": 0., "min_latency": 0.,
+                                       "max_latency": 0., "total_time": 0. }
+
+
+    def __interrupt(self, channel):
+        '''
+        Edge callback of GPIO2, called from the thread of RPi.GPIO. The
+        STC and RDS interrupts share the pin, every waiter sees every
+        interrupt and checks the status itself
+        '''
+        with self.__irq:
+            self.__interrupts += 1
+            self.__irq.notify_all()
+
+    def __waitInterrupt(self, seen, timeout):
+        '''
+        Waits at most timeout for an interrupt after the seen first ones,
+        returns the number of interrupts received
+        '''
+        deadline = time.time() + timeout
+        with self.__irq:
+            while self.__interrupts == seen:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__irq.wait(remaining)
+            return self.__interrupts
+
+    def __waitInterruptAsync(self, waiter, seen, timeout):
+        '''
+        Runs __waitInterrupt() in an executor of the pin per waiter, not
+        in the one of the bus that stays available to the other devices
+        '''
+        return aio.run(aio.executor(("gpio", self.__irq_pin, waiter)),
+                       self.__waitInterrupt, seen, timeout)
+
+
+    def enableInterrupts(self, pin, rds = True, stc = True):
+        '''
+        Interrupt mode: GPIO2 of the chip, wired to the BCM pin, pulses
+        low when a tune/seek completes (stc) and when a RDS group is
+        received (rds). The registers are then only read when the chip
+        signals new data, pollRDS() returns as soon as a group arrives
+        and the tune/seek wait without reading the status in loop.
+        See AN230 rev0.9 and the datasheet rev 1.1 page 25
+        '''
+        if gpio is None:
+            raise ImportError("RPi.GPIO is required by the interrupt mode")
+        if self.__irq_pin is not None:
+            self.disableInterrupts()
+
+        gpio.setwarnings(False)
+        gpio.setmode(gpio.BCM)
+        gpio.setup(pin, gpio.IN, pull_up_down = gpio.PUD_UP)
+        gpio.add_event_detect(pin, gpio.FALLING, callback = self.__interrupt)
+        self.__rds_seen = self.__interrupts
+        self.__irq_pin = pin
+        self.__irq_stc = stc
+        self.__irq_rds = rds
+
+        with self.transaction():
+            self.__registers.set("gpio2", 0x1) # STC/RDS interrupt
+            self.__registers.set("stcien", 0x1 if stc else 0x0)
+            self.__registers.set("rdsien", 0x1 if rds else 0x0)
+
+    def disableInterrupts(self):
+        '''
+        Goes back to polling the registers
+        '''
+        if self.__irq_pin is None:
+            return
+        gpio.remove_event_detect(self.__irq_pin)
+        # the workers waiting for the pin in readAsync() and pollRDSAsync()
+        for waiter in ("stc", "rds"):
+            aio.shutdown(("gpio", self.__irq_pin, waiter), wait = False)
+        self.__irq_pin = None
+        self.__irq_stc = False
+        self.__irq_rds = False
+
+        with self.transaction():
+            self.__registers.set("gpio2", 0x0) # high impedance
+            self.__registers.set("stcien", 0x0)
+            self.__registers.set("rdsien", 0x0)
+
+    def interrupts(self):
+        '''
+        Returns the number of interrupts received
+        '''
+        return self.__interrupts
+
+
+    def __asyncBus(self):
+        if self.__async is None:
+            self.__async = aio.AsyncI2C(self.__i2c)
+        return self.__async
+
+
     def __update_registers(self, direct_update = True, **kwargs):
         if direct_update == True:
-            self.__registers.write()
+            with self.__i2c.exclusive():
+                self.__registers.write()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Context manager grouping configuration changes in a single write:
+
+            with radio.transaction():
+                radio.setVolume(10)
+                radio.setSoftMute(False)
+                radio.setRegion(SI470x.USA)
+
+        the registers 0x02 up to the highest one that changed are written
+        at the end, nothing if they hold their previous values. The chip
+        is held exclusively during the transaction
+        '''
+        with self.__i2c.exclusive():
+            with self.__registers.transaction():
+                yield self
+
+    def writeStats(self):
+        '''
+        Returns the register writes sent, skipped and the bytes saved
+        '''
+        return self.__registers.stats()
 
 
     def status(self): 
         freq = self.getChannel()
+        rdsr, st, rssi, blera, blerb, blerc, blerd = \
+            self.__registers.fields("rdsr", "st", "rssi", "blera", "blerb", "blerc", "blerd")
         return ("Status:\n" + 
                 " - freq: {0}MHz\n" +
                 " - RDS status: {1} (Block A:{4} - B:{5} - C:{6} - C:{7})\n" +
                 " - Stereo indicator: {2}\n" +
                 " - RSSI: {3}/75dBuV").format(freq,
-                                              "ready" if self.__registers.get("rdsr") == 1 else "none",
-                                              "stereo" if self.__registers.get("st") == 1 else "mono",
-                                              self.__registers.get("rssi"),
-                                              self.__rds_errors[self.__registers.get("blera")],
-                                              self.__rds_errors[self.__registers.get("blerb")],
-                                              self.__rds_errors[self.__registers.get("blerc")],
-                                              self.__rds_errors[self.__registers.get("blerd")])
+                                              "ready" if rdsr == 1 else "none",
+                                              "stereo" if st == 1 else "mono",
+                                              rssi,
+                                              self.__rds_errors[blera],
+                                              self.__rds_errors[blerb],
+                                              self.__rds_errors[blerc],
+                                              self.__rds_errors[blerd])
 
 
     def hasRDS(self):
-        self.__registers.read(end = "statusrssi")
-        return self.__registers.get("rdsr") == 1
+        with self.__i2c.exclusive():
+            self.__registers.read(end = "statusrssi")
+            return self.__registers.get("rdsr") == 1
+
+    def nextRDSGroup(self, timeout = None):
+        '''
+        Waits at most timeout (a group period by default) for a new RDS
+        group and returns it undecoded:
+
+            (a, b, c, d, (blera, blerb, blerc, blerd), timestamp)
+
+        None if no group arrived. Without the interrupts the registers are
+        read every 35ms so that no group is missed, a group read again
+        while RDSR is still set is skipped
+        '''
+        timeout = self.__rds_period if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            if self.__irq_rds:
+                seen = self.__waitInterrupt(self.__rds_seen, deadline - time.time())
+                if seen == self.__rds_seen:
+                    return None
+                self.__rds_seen = seen
+
+            with self.__i2c.exclusive():
+                self.__registers.read(end = "rdsd")
+                rdsr, a, chwa, b, chwb, c, chwc, d, chwd = self.__rds_group()
+
+            now = time.time()
+            if rdsr:
+                last, last_time = self.__rds_last
+                # the same group repeated comes a period later
+                if (a, b, c, d) != last or now - last_time > self.__rds_period / 2:
+                    self.__rds_last = ((a, b, c, d), now)
+                    return (a, b, c, d, (chwa, chwb, chwc, chwd), now)
+
+            if now >= deadline:
+                return None
+            if not self.__irq_rds:
+                time.sleep(min(self.__rds_poll, deadline - now))
 
-    __rds = dict()
     def pollRDS(self):
         '''
         The RDS part is experimental and not yet finished Reference is
         AN243 rev0.2 and RDBS Standard that is basically the same info
+
+        In interrupt mode the registers are read once the chip signals
+        a group, or not at all if none arrives during a group period
         '''
+        if self.__irq_rds:
+            seen = self.__waitInterrupt(self.__rds_seen, self.__rds_period)
+            if seen != self.__rds_seen:
+                self.__rds_seen = seen
+                with self.__i2c.exclusive():
+                    self.__registers.read(end = "rdsd")
+                    self.__decodeRDS()
+            return self.__rds.get(self.__freq)
+
         start = time.time();
-        self.__registers.read(end = "rdsd")
+        with self.__i2c.exclusive():
+            self.__registers.read(end = "rdsd")
+            self.__decodeRDS()
 
-        
+        dur = self.__rds_period - (time.time() - start)
+        if(dur > 0):
+            time.sleep(dur)
+
+        if self.__freq in self.__rds:
+            return self.__rds[self.__freq]
+        else:
+            return None
+
+    @aio.coroutine
+    def pollRDSAsync(self):
+        '''
+        Coroutine variant of pollRDS(), the 86ms RDS group period is
+        awaited on the event loop
+        '''
+        if self.__irq_rds:
+            bus = self.__asyncBus()
+            seen = yield aio.From(self.__waitInterruptAsync("rds", self.__rds_seen,
+                                                            self.__rds_period))
+            if seen != self.__rds_seen:
+                self.__rds_seen = seen
+                with (yield aio.From(bus.exclusive())):
+                    yield aio.From(bus.run(self.__registers.read, "rdsd"))
+                    self.__decodeRDS()
+            raise aio.Return(self.__rds.get(self.__freq))
+
+        start = time.time();
+        bus = self.__asyncBus()
+        with (yield aio.From(bus.exclusive())):
+            yield aio.From(bus.run(self.__registers.read, "rdsd"))
+            self.__decodeRDS()
+
+        dur = self.__rds_period - (time.time() - start)
+        if(dur > 0):
+            yield aio.From(aio.sleep(dur))
+
+        raise aio.Return(self.__rds[self.__freq] if self.__freq in self.__rds else None)
+
+    def __decodeRDS(self):
+        '''
+        Decodes the RDS group held by the last registers read
+        '''
         decoded = False
-        if self.__registers.get("rdsr"):
-            rdsa = self.__registers.get("rdsa")
-            rdsb = self.__registers.get("rdsb")
-            rdsc = self.__registers.get("rdsc")
-            rdsd = self.__registers.get("rdsd")
-            chwa = self.__registers.get("blera")
-            chwb = self.__registers.get("blerb")
-            chwc = self.__registers.get("blerc")
-            chwd = self.__registers.get("blerd")
-
-            if self.__freq in self.__rds:
-                tmp_rds = copy.deepcopy(self.__rds[self.__freq])
-            else:
-                tmp_rds = RDS(region = self.__rds_region)
-            decoded = tmp_rds.decode(rdsa, chwa,
-                                     rdsb, chwb,
-                                     rdsc, chwc,
-                                     rdsd, chwd)
+        rdsr, rdsa, chwa, rdsb, chwb, rdsc, chwc, rdsd, chwd = self.__rds_group()
+        if rdsr:
+            # the decoder rejects a group before changing anything, the
+            # state of the station is updated in place
+            rds = self.__rds.get(self.__freq)
+            if rds is None:
+                rds = RDS(region = self.__rds_region)
+            decoded = rds.decode(rdsa, chwa,
+                                 rdsb, chwb,
+                                 rdsc, chwc,
+                                 rdsd, chwd)
             if decoded:
-                self.__rds[self.__freq] = tmp_rds
+                self.__rds[self.__freq] = rds
 
                 if self.__debug:
                     print(self.__rds[self.__freq])
             else:
                 if self.__debug:
                     print(("RDS status:" +
-                           " A:{0} - B:{1} - C:{2} - C:{3}").format(self.__rds_errors[self.__registers.get("blera")],
-                                                                    self.__rds_errors[self.__registers.get("blerb")],
-                                                                    self.__rds_errors[self.__registers.get("blerc")],
-                                                                    self.__rds_errors[self.__registers.get("blerd")]))
-
-        dur = 0.086 - (time.time() - start)
-        if(dur > 0):
-            time.sleep(dur)
-
-        if self.__freq in self.__rds:
-            return self.__rds[self.__freq]
-        else:
-            return None
+                           " A:{0} - B:{1} - C:{2} - C:{3}").format(self.__rds_errors[chwa],
+                                                                    self.__rds_errors[chwb],
+                                                                    self.__rds_errors[chwc],
+                                                                    self.__rds_errors[chwd]))
+        return decoded
 
 
     def getRSSI(self):
-        self.__registers.read(end = "statusrssi")
-        return int(self.__registers.get("rssi"))
+        with self.__i2c.exclusive():
+            self.__registers.read(end = "statusrssi")
+            return int(self.__registers.get("rssi"))
 
 
     def setSoftMute(self, mute = True, attenuation = 16, speed = "fastest", **kwargs):
@@ -238,38 +591,69 @@ class SI470x:
         Freq (MHz) = Spacing (MHz) x Channel + 87.5 MHz
         By default the station is tuned
         '''
-        if frequence > self.__band_max[self.__region & 0x0F]: frequence = self.__band_max[self.__region & 0x0F]
-        channel = int((frequence - self.__band_min[self.__region & 0x0F]) / self.__spacing[self.__region & 0xF0])
-        self.__registers.set("channel", channel)
+        with self.__i2c.exclusive():
+            # the register shadow is shared with the other threads
+            self.__setChannelRegister(frequence)
+            if tune:
+                self.__registers.set("tune")
+                self.__registers.write(end = "channel")
+
+                # wait that station is tuned
+                self.__wait_stc(1, timeout, "tune")
+
+                self.__registers.set("tune", 0x0)
+                self.__registers.write(end = "channel")
+
+                # clear the STC bit
+                self.__wait_stc(0, timeout)
+                self.__registers.read(end = "readchan")
+
+                if self.__debug == True:
+                    frequence = self.getChannel()
+                    channel = self.__registers.get("readchan")
+                    print(("Frequency tuned to {0}MHz\n" +
+                           " - READCHAN[9:0] = 0x{1:X}").format(frequence, channel))
+            else:
+                self.__update_registers(**kwargs)
 
-        if self.__debug == True:
-            print(("Setting frequency: {0}MHz translated in:\n" +
-                   " - CHANNEL[9:0] = 0x{1:X}").format(frequence, channel))
-        
-        if tune:
+            self.__updateFreq()
+
+    @aio.coroutine
+    def setChannelAsync(self, frequence, timeout = 0.5):
+        '''
+        Coroutine variant of setChannel(), the station is always tuned and
+        the tuning delays are awaited on the event loop
+        '''
+        bus = self.__asyncBus()
+        with (yield aio.From(bus.exclusive())):
+            self.__setChannelRegister(frequence)
             self.__registers.set("tune")
-            self.__registers.write(end = "channel")
-            time.sleep(.060) # wait 60ms
+            yield aio.From(bus.run(self.__registers.write, "channel"))
 
             # wait that station is tuned
-            self.__wait_stc(1, timeout)
+            yield aio.From(self.__waitStcAsync(1, timeout, "tune"))
 
             self.__registers.set("tune", 0x0)
-            self.__registers.write(end = "channel")
+            yield aio.From(bus.run(self.__registers.write, "channel"))
 
             # clear the STC bit
-            self.__wait_stc(0, timeout)
-            self.__registers.read(end = "readchan")
+            yield aio.From(self.__waitStcAsync(0, timeout))
+            yield aio.From(bus.run(self.__updateFreq))
 
-            if self.__debug == True:
-                frequence = self.getChannel()
-                channel = self.__registers.get("readchan")
-                print(("Frequency tuned to {0}MHz\n" +
-                       " - READCHAN[9:0] = 0x{1:X}").format(frequence, channel))
-        else:
-            self.__update_registers(**kwargs)
+    def __setChannelRegister(self, frequence):
+        if frequence > self.__band_max[self.__region & 0x0F]: frequence = self.__band_max[self.__region & 0x0F]
+        channel = int((frequence - self.__band_min[self.__region & 0x0F]) / self.__spacing[self.__region & 0xF0])
+        self.__registers.set("channel", channel)
 
-        self.__updateFreq()
+        if self.__debug == True:
+            print(("Setting frequency: {0}MHz translated in:\n" +
+                   " - CHANNEL[9:0] = 0x{1:X}").format(frequence, channel))
+
+    def getRDSRegion(self):
+        '''
+        Return the region of the RDS decoding (RDS.EUROPE, RDS.USA...)
+        '''
+        return self.__rds_region
 
     def getChannel(self, **kwargs):
         '''
@@ -293,6 +677,53 @@ class SI470x:
              seek_fm_counts      = 0x8,
              **kwargs):
         # the defaults values are the one recommanded in AN284
+        with self.__i2c.exclusive():
+            self.__setSeekRegisters(direction, mode, seek_rssi_threshold,
+                                    seek_snr_threshold, seek_fm_counts)
+            self.__registers.write(end = "powercfg")
+            self.__wait_stc(1, timeout, "seek")
+
+            if self.__registers.get("sfbl"):
+                print("Seek fail or reached the and of the band!")
+
+            self.__registers.set("seek", 0)
+            self.__registers.write(end = "powercfg")
+            self.__wait_stc(0, timeout)
+
+            self.__updateFreq()
+
+            if self.__debug == True:
+                frequence = self.getChannel()
+                channel = self.__registers.get("readchan")
+                print(("Frequency seeked to {0}MHz\n" +
+                       " - READCHAN[9:0] = 0x{1:X}").format(frequence, channel))
+
+    @aio.coroutine
+    def seekAsync(self, direction = UP, mode = WRAP, timeout = 1,
+                  seek_rssi_threshold = 0x19,
+                  seek_snr_threshold  = 0x4,
+                  seek_fm_counts      = 0x8):
+        '''
+        Coroutine variant of seek()
+        '''
+        bus = self.__asyncBus()
+        with (yield aio.From(bus.exclusive())):
+            self.__setSeekRegisters(direction, mode, seek_rssi_threshold,
+                                    seek_snr_threshold, seek_fm_counts)
+            yield aio.From(bus.run(self.__registers.write, "powercfg"))
+            yield aio.From(self.__waitStcAsync(1, timeout, "seek"))
+
+            if self.__registers.get("sfbl"):
+                print("Seek fail or reached the and of the band!")
+
+            self.__registers.set("seek", 0)
+            yield aio.From(bus.run(self.__registers.write, "powercfg"))
+            yield aio.From(self.__waitStcAsync(0, timeout))
+
+            yield aio.From(bus.run(self.__updateFreq))
+
+    def __setSeekRegisters(self, direction, mode, seek_rssi_threshold,
+                           seek_snr_threshold, seek_fm_counts):
         self.__registers.set("seekth", seek_rssi_threshold)
         self.__registers.set("sksnr", seek_snr_threshold)
         self.__registers.set("skcnt", seek_fm_counts)
@@ -301,24 +732,6 @@ class SI470x:
         self.__registers.set("seekup", direction)
         self.__registers.set("seek", 1)
 
-        self.__registers.write(end = "powercfg")
-        self.__wait_stc(1, timeout)
-
-        if self.__registers.get("sfbl"):
-            print("Seek fail or reached the and of the band!")
-
-        self.__registers.set("seek", 0)
-        self.__registers.write(end = "powercfg")
-        self.__wait_stc(0, timeout)
-
-        self.__updateFreq()
-
-        if self.__debug == True:
-            frequence = self.getChannel()
-            channel = self.__registers.get("readchan")
-            print(("Frequency seeked to {0}MHz\n" +
-                   " - READCHAN[9:0] = 0x{1:X}").format(frequence, channel))
-
 
     def setRegion(self, region, **kwargs):
         '''
@@ -387,13 +800,13 @@ class SI470x:
         '''
         Mute/unmute the radio
         '''
-        self.__registers.set("dmute", ~(self.__registers.get("dmute")))
-        self.__update_registers(**kwargs)
+        with self.__i2c.exclusive():
+            self.__registers.set("dmute", ~(self.__registers.get("dmute")))
+            self.__update_registers(**kwargs)
 
 
     # --------------------------------------------------------------------------
     class Registers:
-        __update_regs = 0x08
         class BitsInfo:
             def __init__(self, reg, pos, mask):
                 self.reg  = reg
@@ -402,62 +815,152 @@ class SI470x:
 
         def __init__(self, i2c):
             self.__i2c = i2c
+            self.__buffer = bytearray(32)
 
-        def set(self, bit, value = 0x1):
-            info_bit = self.__bits[bit]
-            reg = self.__reg_addr[info_bit.reg]
-            self.__update_regs = max(reg, self.__update_regs)
+            # values set and values last read from or written to the chip,
+            # the registers that differ are the ones still to be written
+            self.__registers = array.array('H', [0] * 16)
+            self.__written   = array.array('H', [0] * 16)
+            self.__depth     = 0 # nesting of the transactions
+            self.__getters   = {}
+            self.resetStats()
 
-            wiped_bits = self.__registers[reg] & (~(info_bit.mask << info_bit.pos))
-            self.__registers[reg] = wiped_bits | ((value & info_bit.mask) << info_bit.pos)
+        def set(self, bit, value = 0x1):
+            reg, pos, mask = self.__fields[bit]
+            wiped_bits = self.__registers[reg] & ~(mask << pos)
+            self.__registers[reg] = wiped_bits | ((value & mask) << pos)
 
 
         def get(self, bit):
-            info_bit = self.__bits[bit]
-            reg = self.__reg_addr[info_bit.reg]
-            return (self.__registers[reg] >> info_bit.pos) & info_bit.mask
+            reg, pos, mask = self.__fields[bit]
+            return (self.__registers[reg] >> pos) & mask
+
+        def getter(self, *bits):
+            '''
+            Returns a function without argument giving the value of a
+            field, or the tuple of the values of several fields, in the
+            registers last read. The register, shift and mask of each field
+            are looked up once, to be kept in the polling loops:
+
+                status = registers.getter("rdsr", "stc", "rssi")
+                rdsr, stc, rssi = status()
+            '''
+            func = self.__getters.get(bits)
+            if func is None:
+                func = self.__getter(self.__registers, [ self.__fields[bit] for bit in bits ])
+                self.__getters[bits] = func
+            return func
+
+        @staticmethod
+        def __getter(r, fields):
+            # closures over the registers and the constants of the fields
+            if len(fields) == 1:
+                reg, pos, mask = fields[0]
+                return lambda: (r[reg] >> pos) & mask
+            return lambda: tuple([ (r[reg] >> pos) & mask for reg, pos, mask in fields ])
+
+        def fields(self, *bits):
+            '''
+            Returns the tuple of the values of several fields
+            '''
+            return self.getter(*bits)()
 
         def set_reg(self, reg, value):
             '''
             This method write the register
             '''
-            reg_addr = self.__reg_addr[reg]
-            self.__update_regs = max(reg_addr, self.__update_regs)
-            self.__registers[reg_addr] = value
+            self.__registers[self.__reg_addr[reg]] = value
 
         def read(self, end = "bootconfig"):
             '''
             This command read all 16 registers bytes by bytes starting by
-            the registers 0x0Ah
+            the registers 0x0Ah, the values set and not written yet are
+            kept
             '''
-            end = self.__reg_addr[end]
-            pos_end = [pos for pos, reg in enumerate(self.__read_order) if  reg == end][0] + 1
+            pos_end = self.__read_pos[self.__reg_addr[end]] + 1
 
-            regs_values = self.__i2c.read_block((self.__registers[0x02] >> 8), pos_end * 2)
-            for i, r in enumerate(self.__read_order[:pos_end]):
-                self.__registers[r] = (regs_values[2*i] << 8) + regs_values[2*i+1]
+            self.__i2c.read_into((self.__registers[0x02] >> 8), self.__buffer, pos_end * 2)
+            words = self.__read_layouts[pos_end].unpack_from(self.__buffer)
+            for r, w in zip(self.__read_order, words):
+                if self.__registers[r] == self.__written[r]:
+                    self.__registers[r] = w
+                self.__written[r] = w
+
+        def dirty(self):
+            '''
+            Returns the highest register set to a value the chip does not
+            hold yet, None if the chip is up to date
+            '''
+            for r in reversed(self.__write_order):
+                if self.__registers[r] != self.__written[r]:
+                    return r
+            return None
 
-               
         def write(self, end = "all"):
             '''
-            This method write the registers 0x02 to addr(end), if end
-            is not defined it goes to the addr of the highest register
-            modified since the lase write
+            This method write the registers 0x02 to addr(end), extended to
+            the highest register modified since the last write. If end is
+            not defined only the modified registers are written, nothing
+            if none changed or during a transaction (written at its end)
             '''
-            end = self.__update_regs if end == "all" else self.__reg_addr[end]
+            dirty = self.dirty()
+            if end == "all":
+                if self.__depth > 0:
+                    return
+                if dirty is None:
+                    self.__suppressed  += 1
+                    self.__bytes_saved += self.__full_write
+                    return
+                end = dirty
+            else:
+                end = self.__reg_addr[end] if dirty is None else max(self.__reg_addr[end], dirty)
 
-            pos_end = [pos for pos, reg in enumerate(self.__read_order) if  reg == end][0] + 1
-        
-            regs_values = [0]*len(self.__write_order[:pos_end])*2
+            count = end - self.__write_order[0] + 1
+            regs_values = [0] * count * 2
 
-            for i, r in enumerate(self.__write_order[:pos_end]):
+            for i, r in enumerate(self.__write_order[:count]):
                 regs_values[2*i    ] = self.__registers[r] >> 8
                 regs_values[2*i + 1] = self.__registers[r] & 0x00FF
             self.__i2c.write_block(regs_values[0], regs_values[1:])
-            self.__update_regs = 0x02
+            self.__written[self.__write_order[0]:end + 1] = self.__registers[self.__write_order[0]:end + 1]
+
+            self.__writes      += 1
+            self.__bytes_saved += self.__full_write - len(regs_values)
+
+        @contextlib.contextmanager
+        def transaction(self):
+            '''
+            Context manager deferring the writes: the registers set during
+            the transaction are written at its end in a single write of
+            0x02 up to the highest one that changed. If an exception is
+            raised the registers get back the values of the chip
+            '''
+            self.__depth += 1
+            try:
+                yield self
+            except:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.__registers[:] = self.__written
+                raise
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.write()
+
+        def stats(self):
+            '''
+            Returns the number of writes sent and skipped (nothing changed)
+            and the bytes saved compared to writing all of 0x02-0x08
+            '''
+            return { "writes"     : self.__writes,
+                     "suppressed" : self.__suppressed,
+                     "bytes_saved": self.__bytes_saved }
 
+        def resetStats(self):
+            self.__writes      = 0
+            self.__suppressed  = 0
+            self.__bytes_saved = 0
 
-       
         def __str__(self):
             pn    = self.get("pn")
             mfgid = self.get("mfgid")
@@ -480,10 +983,14 @@ class SI470x:
         def __get_name(self, reg_addr):
             return [name for name, reg in self.__reg_addr.iteritems() if  reg == reg_addr][0]
 
-        __registers = array.array('H', [0] * 16)
-
         __read_order  =  range(10, 16) + range(0, 10)
         __write_order =  range(2, 9)
+        __full_write  =  len(__write_order) * 2
+
+        # position of each register in the read order and big-endian
+        # layouts of the reads of 0 to 16 registers
+        __read_pos     = dict([(reg, pos) for pos, reg in enumerate(__read_order)])
+        __read_layouts = [struct.Struct(">{0}H".format(n)) for n in range(17)]
 
         # Registers
         __reg_addr = { "deviceid"  : 0x00,
@@ -577,6 +1084,10 @@ class SI470x:
             "rdsd"    : BitsInfo("rdsd"      ,  0, 0xFFFF),
             }
 
+        # (register, shift, mask) of the fields
+        __fields = dict([(bit, (__reg_addr[info.reg], info.pos, info.mask))
+                         for bit, info in __bits.items()])
+
     # --------------------------------------------------------------------------
     class Properties:
         def __init__(self, i2c):
@@ -4,3 +4,18 @@ import bmp085
 
 from bmp085 import BMP085
 __all__.extend(bmp085.__all__)
+
+import fleet
+
+from fleet import BMP085Fleet
+__all__.extend(fleet.__all__)
+
+import oversampling
+
+from oversampling import OversamplingPolicy
+__all__.extend(oversampling.__all__)
+
+import altimeter
+
+from altimeter import Altimeter
+__all__.extend(altimeter.__all__)
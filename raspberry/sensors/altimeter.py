@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "Altimeter" ]
+
+import array
+import collections
+import math
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# ===========================================================================
+# Altimeter Class
+# ===========================================================================
+
+class Altimeter :
+  """Quantities derived from pressure samples already acquired (by read(),
+  stream() or a fleet), the sensor is never accessed:
+
+    altimeter = Altimeter(seaLevelPressure = 101325)
+    for timestamp, pressure, temperature in bmp.stream(rate = 20):
+      altitude, speed = altimeter.update(timestamp, pressure)
+
+  The altitude is the one of the international barometric formula used
+  by BMP085.readAltitude(). For the batches it is interpolated linearly in
+  a table over [low, high] Pa (the range of the BMP085) whose step is
+  computed from the second derivative of the formula so that the error
+  stays below maxError meters, the pressures out of the table use the
+  formula itself. A single sample uses the formula: in the interpreter
+  pow() costs less than the table lookup"""
+
+  EXPONENT = 1. / 5.255
+
+  # samples between two exact recomputations of the running sums of the
+  # vertical speed, bounding the rounding errors of their updates
+  RESUM = 1000
+
+  def __init__(self, seaLevelPressure = 101325., low = 30000., high = 110000.,
+               maxError = 0.01, window = 1.):
+    self.low      = float(low)
+    self.high     = float(high)
+    self.maxError = maxError
+    self.window   = window
+    self.__samples = collections.deque() # (timestamp, altitude) of the window
+    self.__resum()
+    self.setSeaLevelPressure(seaLevelPressure)
+
+  def setSeaLevelPressure(self, seaLevelPressure):
+    """Changes the reference pressure, the table is rebuilt"""
+    self.seaLevelPressure = float(seaLevelPressure)
+
+    # |h''(p)| is the largest at the lowest pressure, the error of a
+    # linear interpolation is at most h'' * step^2 / 8
+    k = self.EXPONENT
+    curvature = 44330.0 * k * (1 - k) * self.low ** (k - 2) / self.seaLevelPressure ** k
+    step = math.sqrt(8 * self.maxError / curvature)
+    size = int(math.ceil((self.high - self.low) / step)) + 1
+
+    self.__step      = (self.high - self.low) / (size - 1)
+    self.__inv_step  = 1. / self.__step
+    self.__pressures = array.array('d', [ self.low + i * self.__step for i in range(size) ])
+    self.__altitudes = array.array('d', [ self.altitude(p) for p in self.__pressures ])
+    self.__slopes    = array.array('d', [ (self.__altitudes[i + 1] - self.__altitudes[i]) * self.__inv_step
+                                          for i in range(size - 1) ] + [ 0. ])
+    if numpy is not None:
+      self.__table = [ numpy.frombuffer(column, dtype = numpy.float64)
+                       for column in (self.__pressures, self.__altitudes, self.__slopes) ]
+
+  def tableSize(self):
+    return len(self.__pressures)
+
+  def altitude(self, pressure):
+    """Altitude in meters of the barometric formula"""
+    return 44330.0 * (1.0 - pow(pressure / self.seaLevelPressure, self.EXPONENT))
+
+  def altitudes(self, pressures):
+    """Altitudes of a sequence or numpy array of pressures, interpolated in
+    the table as a numpy array if numpy is available, a list otherwise"""
+    if numpy is None:
+      return [ self.altitude(p) for p in pressures ]
+
+    table_p, table_h, table_s = self.__table
+    pressures = numpy.asarray(pressures, dtype = numpy.float64)
+    inside = pressures.size == 0 or \
+             (pressures.min() >= self.low and pressures.max() < self.high)
+
+    # the table is uniform, the interval is found without a search
+    i = ((pressures - self.low) * self.__inv_step).astype(numpy.intp)
+    if not inside:
+      numpy.clip(i, 0, len(table_p) - 1, out = i)
+    result = table_h[i] + (pressures - table_p[i]) * table_s[i]
+    if not inside:
+      outside = (pressures < self.low) | (pressures >= self.high)
+      result[outside] = 44330.0 * (1.0 - numpy.power(pressures[outside] / self.seaLevelPressure,
+                                                      self.EXPONENT))
+    return result
+
+  @staticmethod
+  def seaLevelFactor(altitude):
+    """Factor bringing a pressure measured at altitude meters to the sea
+    level, constant for a sensor that does not move"""
+    return 1. / pow(1.0 - altitude / 44330.0, 5.255)
+
+  def toSeaLevel(self, pressure, altitude):
+    """Sea level pressure of a pressure measured at altitude meters"""
+    return pressure * self.seaLevelFactor(altitude)
+
+  def seaLevelPressures(self, pressures, altitude):
+    """Sea level pressures of pressures measured at altitude meters, a
+    numpy array if numpy is available"""
+    factor = self.seaLevelFactor(altitude)
+    if numpy is None:
+      return [ p * factor for p in pressures ]
+    return numpy.asarray(pressures, dtype = numpy.float64) * factor
+
+  def update(self, timestamp, pressure):
+    """Adds a sample, returns its altitude and the vertical speed in m/s,
+    slope of the least squares line of the altitudes of the last window
+    seconds (None until two samples are known). The sums of the fit are
+    updated with the samples entering and leaving the window"""
+    altitude = self.altitude(pressure)
+    samples  = self.__samples
+    if not samples:
+      self.__origin = timestamp
+    samples.append((timestamp, altitude))
+    self.__add(timestamp, altitude, 1)
+    while samples[0][0] < timestamp - self.window and len(samples) > 2:
+      t, a = samples.popleft()
+      self.__add(t, a, -1)
+
+    self.__updates += 1
+    if self.__updates >= self.RESUM:
+      self.__resum()
+    return altitude, self.__slope()
+
+  def __add(self, t, a, sign):
+    # the times are taken from an origin close to the window so that
+    # their squares keep their precision
+    t -= self.__origin
+    self.__n   += sign
+    self.__st  += sign * t
+    self.__sa  += sign * a
+    self.__stt += sign * t * t
+    self.__sta += sign * t * a
+
+  def __resum(self):
+    """Recomputes the running sums from the samples of the window"""
+    self.__origin  = self.__samples[0][0] if self.__samples else 0.
+    self.__updates = 0
+    self.__n = 0
+    self.__st = self.__sa = self.__stt = self.__sta = 0.
+    for t, a in self.__samples:
+      self.__add(t, a, 1)
+
+  def __slope(self):
+    n = self.__n
+    if n < 2:
+      return None
+    d = n * self.__stt - self.__st * self.__st
+    return (n * self.__sta - self.__st * self.__sa) / d if d > 0 else None
+
+  def verticalSpeeds(self, timestamps, altitudes):
+    """Vertical speeds (m/s) of a batch of samples, centered differences"""
+    if numpy is None:
+      raise ImportError("numpy is required by Altimeter.verticalSpeeds()")
+    return numpy.gradient(numpy.asarray(altitudes, dtype = numpy.float64),
+                          numpy.asarray(timestamps, dtype = numpy.float64))
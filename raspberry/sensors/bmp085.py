@@ -32,8 +32,18 @@
 
 __all__ = [ "BMP085" ]
 
+import collections
+import json
+import os
+import struct
 import time
+import zlib
+try:
+  import numpy
+except ImportError:
+  numpy = None
 from ..i2c import I2C
+from .. import aio
 
 # ===========================================================================
 # BMP085 Class
@@ -41,6 +51,7 @@ from ..i2c import I2C
 
 class BMP085 :
   __i2c = None
+  __async = None
 
   # Operating Modes
   ULTRALOWPOWER     = 0
@@ -65,6 +76,8 @@ class BMP085 :
   __BMP085_PRESSUREDATA      = 0xF6
   __BMP085_READTEMPCMD       = 0x2E
   __BMP085_READPRESSURECMD   = 0x34
+  __BMP085_SCO               = 0x20  # Start of conversion bit of the control register
+  __BMP085_TEMPTIME          = 0.0045
 
   # Private Fields
   __cal_AC1 = 0
@@ -79,15 +92,35 @@ class BMP085 :
   __cal_MC  = 0
   __cal_MD  = 0
 
-  __conversion_time = { ULTRALOWPOWER: 0.0045,
-                        STANDARD:      0.007,
-                        HIGHRES:       0.0135,
-                        ULTRAHIGHRES:  0.0255 }
+  # AC1 to AC6, B1, B2, MB, MC, MD: big-endian 16-bit words
+  __cal_layout = struct.Struct(">hhhHHHhhhhh")
+  # MC and MD, trimmed per part, read to check a cached calibration
+  __cal_sample = struct.Struct(">hh")
+
+  # Maximum conversion time (s) and RMS pressure noise (Pa) per mode
+  # (datasheet rev 1.2)
+  CONVERSION_TIME = { ULTRALOWPOWER: 0.0045,
+                      STANDARD:      0.0075,
+                      HIGHRES:       0.0135,
+                      ULTRAHIGHRES:  0.0255 }
+  PRESSURE_NOISE  = { ULTRALOWPOWER: 6.,
+                      STANDARD:      5.,
+                      HIGHRES:       4.,
+                      ULTRAHIGHRES:  3. }
 
 
   # Constructor
-  def __init__(self, address=0x77, mode = STANDARD, debug=False):
-    self.__i2c = I2C(address)
+  def __init__(self, address=0x77, mode = STANDARD, debug=False, retry = None,
+               calibration_cache = None, busnum = -1, route = None):
+    # busnum is the I2C bus, auto-detected if negative
+    # route is the (mux address, channel) of a sensor behind a TCA9548A
+    # retry is the RetryPolicy of the transfers, I2C.DEFAULT_RETRY if None
+    # calibration_cache is the path of a file keeping the calibration of
+    # the sensors between runs, see readCalibrationData()
+    self.__i2c = I2C(address, busnum, retry = retry, route = route)
+    self.__pressure_buffer = bytearray(3)
+    self.__pending = None
+    self.setTemperatureCache(0)
 
     self.debug = debug
 
@@ -100,23 +133,93 @@ class BMP085 :
       self.mode = mode
 
     # Read the calibration data
-    self.readCalibrationData()
+    self.readCalibrationData(calibration_cache)
+
+
+  def readCalibrationData(self, cache = None):
+    """Reads the calibration data from the IC in a single transfer. With
+    cache, the path of a calibration cache file, the coefficients stored
+    there for this bus/address are used instead if they pass their
+    checksum and match MC and MD read from the IC (4 bytes instead of 22),
+    otherwise the ones read are stored"""
+
+    calibration = None
+    if cache is not None:
+      calibration = self.__loadCalibration(cache)
+    self.__cal_source = "cache" if calibration is not None else "device"
+
+    if calibration is None:
+      calibration = self.__i2c.read_struct(self.__BMP085_CAL_AC1, self.__cal_layout)
+      if cache is not None:
+        self.__storeCalibration(cache, calibration)
+
+    (self.__cal_AC1, self.__cal_AC2, self.__cal_AC3,
+     self.__cal_AC4, self.__cal_AC5, self.__cal_AC6,
+     self.__cal_B1,  self.__cal_B2,
+     self.__cal_MB,  self.__cal_MC,  self.__cal_MD) = calibration
+
+
+  def calibration(self):
+    """Returns the calibration coefficients AC1 to AC6, B1, B2, MB, MC, MD"""
+    return (self.__cal_AC1, self.__cal_AC2, self.__cal_AC3,
+            self.__cal_AC4, self.__cal_AC5, self.__cal_AC6,
+            self.__cal_B1,  self.__cal_B2,
+            self.__cal_MB,  self.__cal_MC,  self.__cal_MD)
+
+
+  def calibrationSource(self):
+    """"cache" or "device", where the calibration data were loaded from"""
+    return self.__cal_source
+
+
+  def __cacheKey(self):
+    route = self.__i2c.route()
+    return "{0}:{1}{2:#04x}".format(self.__i2c.busnum(),
+                                   "" if route is None else "{0:#04x}:{1}/".format(*route),
+                                   self.__i2c.address())
+
+
+  def __checksum(self, calibration):
+    return zlib.crc32(self.__cal_layout.pack(*calibration)) & 0xFFFFFFFF
+
+
+  def __readCache(self, cache):
+    try:
+      with open(cache, "r") as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return {}
+
 
+  def __loadCalibration(self, cache):
+    entry = self.__readCache(cache).get(self.__cacheKey())
+    try:
+      calibration = tuple(entry["calibration"])
+      if len(calibration) != 11 or self.__checksum(calibration) != entry["crc"]:
+        return None
+    except (TypeError, KeyError, struct.error):
+      return None
 
-  def readCalibrationData(self):
-    """Reads the calibration data from the IC"""
+    # a sensor swapped at the same address has another trimming
+    if self.__i2c.read_struct(self.__BMP085_CAL_MC, self.__cal_sample) != calibration[9:]:
+      return None
+    return calibration
 
-    self.__cal_AC1 = self.__i2c.read_signed_short(self.__BMP085_CAL_AC1)
-    self.__cal_AC2 = self.__i2c.read_signed_short(self.__BMP085_CAL_AC2)
-    self.__cal_AC3 = self.__i2c.read_signed_short(self.__BMP085_CAL_AC3)
-    self.__cal_AC4 = self.__i2c.read_short       (self.__BMP085_CAL_AC4)
-    self.__cal_AC5 = self.__i2c.read_short       (self.__BMP085_CAL_AC5)
-    self.__cal_AC6 = self.__i2c.read_short       (self.__BMP085_CAL_AC6)
-    self.__cal_B1  = self.__i2c.read_signed_short(self.__BMP085_CAL_B1) 
-    self.__cal_B2  = self.__i2c.read_signed_short(self.__BMP085_CAL_B2) 
-    self.__cal_MB  = self.__i2c.read_signed_short(self.__BMP085_CAL_MB) 
-    self.__cal_MC  = self.__i2c.read_signed_short(self.__BMP085_CAL_MC) 
-    self.__cal_MD  = self.__i2c.read_signed_short(self.__BMP085_CAL_MD) 
+
+  def __storeCalibration(self, cache, calibration):
+    entries = self.__readCache(cache)
+    entries[self.__cacheKey()] = { "calibration": list(calibration),
+                                   "crc": self.__checksum(calibration) }
+    # written aside then renamed, the daemons sharing the file never see
+    # it half written
+    tmp = "{0}.{1}".format(cache, os.getpid())
+    try:
+      with open(tmp, "w") as f:
+        json.dump(entries, f)
+      os.rename(tmp, cache)
+    except (IOError, OSError):
+      if self.debug:
+        print "Cannot write the calibration cache {0}".format(cache)
 
 
   def showCalibrationData(self):
@@ -134,68 +237,263 @@ class BMP085 :
       print "MD  = {0}".format(self.__cal_MD)
 
 
-  def readRawTemp(self):
-    """Reads the raw (uncompensated) temperature from the sensor"""
-    self.__i2c.write_byte(self.__BMP085_CONTROL, self.__BMP085_READTEMPCMD)
-    time.sleep(0.0045)  # Wait 4.5ms
-
-    raw = self.__i2c.read_short(self.__BMP085_TEMPDATA)
+  def setTemperatureCache(self, max_age = 1.0, max_delta = 0.1):
+    """Reuses the temperature term (B5) of the last temperature conversion
+    in the pressure compensation for up to max_age seconds, so that read()
+    mostly does a pressure conversion only. When a refresh finds that the
+    temperature moved by more than max_delta C the interval is halved (down
+    to max_age / 8), it grows back to max_age otherwise. 0 disables it"""
+    self.__cache_age   = max_age
+    self.__cache_delta = max_delta
+    self.__b5          = None
+    self.__b5_new      = False
+    self.__b5_time     = 0.
+    self.__b5_interval = max_age
+    self.__b5_hits      = 0
+    self.__b5_refreshes = 0
+
+
+  def temperatureCacheStats(self):
+    """Returns the number of pressures compensated with a reused temperature
+    term (read(), collect() and stream()), of temperature conversions and
+    the current refresh interval"""
+    return { "hits"     : self.__b5_hits,
+             "refreshes": self.__b5_refreshes,
+             "interval" : self.__b5_interval }
+
+
+  def needsTemperature(self):
+    """True if the next pressure reading needs a temperature conversion
+    first (no cached temperature term or a stale one)"""
+    return not (self.__cache_age > 0 and self.__b5 is not None and
+                time.time() - self.__b5_time < self.__b5_interval)
+
+
+  def __takeB5(self):
+    """Temperature term compensating a pressure, a hit unless it was
+    converted for this pressure"""
+    if self.__b5 is None:
+      raise RuntimeError("A temperature has to be read before the pressure")
+    if self.__b5_new:
+      self.__b5_new = False
+    else:
+      self.__b5_hits += 1
+    return self.__b5
+
+
+  def __storeB5(self, B5):
+    """Records the term of the last temperature conversion"""
+    if self.__cache_age > 0 and self.__b5 is not None:
+      # B5 is in 1/16 of 0.1C
+      if abs(B5 - self.__b5) / 160. > self.__cache_delta:
+        self.__b5_interval = max(self.__b5_interval / 2., self.__cache_age / 8.)
+      else:
+        self.__b5_interval = min(self.__b5_interval * 2., self.__cache_age)
+    if self.__cache_age > 0:
+      self.__b5_refreshes += 1
+    self.__b5 = B5
+    self.__b5_new = True
+    self.__b5_time = time.time()
+    return B5
+
+
+  # --------------------------------------------------------------------------
+  # Split conversions: the caller is free to use the time of the conversion
+  class Conversion :
+    """Handle of a conversion started by startTemperature() or
+    startPressure(), ready at the latest at deadline"""
+    TEMPERATURE = 0
+    PRESSURE    = 1
+
+    def __init__(self, kind, mode, duration):
+      self.kind     = kind
+      self.mode     = mode
+      self.started  = time.time()
+      self.deadline = self.started + duration
+      self.ready    = False
+
+    def remaining(self):
+      """Seconds left before the deadline"""
+      return max(0., self.deadline - time.time())
+
+
+  def __start(self, kind, command, duration):
+    with self.__i2c.exclusive():
+      self.__i2c.write_byte(self.__BMP085_CONTROL, command)
+      # the sensor runs one conversion at a time
+      self.__pending = BMP085.Conversion(kind, self.mode, duration)
+      return self.__pending
+
+
+  def startTemperature(self):
+    """Starts a temperature conversion and returns its Conversion"""
+    return self.__start(BMP085.Conversion.TEMPERATURE,
+                        self.__BMP085_READTEMPCMD, self.__BMP085_TEMPTIME)
+
+
+  def startPressure(self):
+    """Starts a pressure conversion in the current mode and returns its
+    Conversion"""
+    return self.__start(BMP085.Conversion.PRESSURE,
+                        self.__BMP085_READPRESSURECMD + (self.mode << 6),
+                        self.CONVERSION_TIME[self.mode])
+
+
+  def isReady(self, conversion, poll = False):
+    """True once the conversion time elapsed, with poll the start of
+    conversion bit of the control register is read before the deadline
+    (the conversions usually end well before their maximum time)"""
+    if not conversion.ready:
+      if time.time() >= conversion.deadline:
+        conversion.ready = True
+      elif poll:
+        status = self.__i2c.read_byte(self.__BMP085_CONTROL)
+        conversion.ready = not (status & self.__BMP085_SCO)
+    return conversion.ready
+
+
+  def __collectRaw(self, conversion, wait):
+    if conversion is not self.__pending:
+      raise RuntimeError("The conversion was superseded by another one")
+    if not self.isReady(conversion):
+      if not wait:
+        return None
+      time.sleep(conversion.remaining())
+
+    with self.__i2c.exclusive():
+      if conversion.kind == BMP085.Conversion.TEMPERATURE:
+        raw = self.__i2c.read_short(self.__BMP085_TEMPDATA)
+      else:
+        self.__i2c.read_into(self.__BMP085_PRESSUREDATA, self.__pressure_buffer)
+        msb, lsb, xlsb = self.__pressure_buffer
+        raw = self.__rawPressure(msb, lsb, xlsb, conversion.mode)
+      self.__pending = None
     return raw
 
 
-  def readRawPressure(self):
-    """Reads the raw (uncompensated) pressure level from the sensor"""
-    
-    self.__i2c.write_byte(self.__BMP085_CONTROL,
-                          self.__BMP085_READPRESSURECMD + (self.mode << 6))
-
-    time.sleep(self.__conversion_time[self.mode])
-
-    msb  = self.__i2c.read_byte(self.__BMP085_PRESSUREDATA)
-    lsb  = self.__i2c.read_byte(self.__BMP085_PRESSUREDATA+1)
-    xlsb = self.__i2c.read_byte(self.__BMP085_PRESSUREDATA+2)
+  def collect(self, conversion, wait = True):
+    """Reads and compensates the result of the conversion, waiting for its
+    deadline if needed (None is returned instead if wait is False). A
+    temperature conversion gives the temperature in C, a pressure one the
+    pressure in pascal and the temperature, compensated with the last
+    temperature collected or read"""
+    raw = self.__collectRaw(conversion, wait)
+    if raw is None:
+      return None
+
+    if conversion.kind == BMP085.Conversion.TEMPERATURE:
+      B5 = self.__storeB5(self.__computeB5(raw))
+      return ((B5 + 8) >> 4) / 10.0
+
+    return self.__compensate(self.__takeB5(), raw, conversion.mode)
+
+
+  def __startSample(self):
+    """Starts the conversion of the next sample, a temperature one first if
+    the cached term is stale"""
+    if self.needsTemperature():
+      return self.startTemperature()
+    return self.startPressure()
+
+
+  def __waitReady(self, conversion, poll):
+    while poll and not self.isReady(conversion, poll = True):
+      time.sleep(min(0.0005, conversion.remaining()))
+    return self.collect(conversion)
+
+
+  def stream(self, rate = None, oversample = 1, decimate = None, count = None,
+             poll = False):
+    """Generator of (timestamp, pressure, temperature) samples, count of
+    them or endlessly. The conversions are pipelined: the next one is
+    started as soon as the previous one is read, so it runs while the
+    sample is compensated and consumed. With setTemperatureCache()
+    enabled most samples only take a pressure conversion.
+
+    Each sample averages the last oversample hardware samples and one is
+    produced every decimate hardware samples (decimate = oversample by
+    default, block averaging). rate is the target of samples per second,
+    None for the highest rate of the mode. poll ends the conversions on the
+    start of conversion bit instead of their maximum time.
+
+    The sensor must not be used by other threads while streaming"""
+    decimate = oversample if decimate is None else decimate
+    period   = 1. / (rate * decimate) if rate else 0.
+    window   = collections.deque(maxlen = oversample)
+    taken    = 0
+    produced = 0
+
+    slot = time.time()
+    conversion = None
+    while count is None or produced < count:
+      if conversion is None:
+        delay = slot - time.time()
+        if delay > 0:
+          time.sleep(delay)
+        slot = max(slot + period, time.time() - period)
+        conversion = self.__startSample()
+
+      if conversion.kind == BMP085.Conversion.TEMPERATURE:
+        self.__waitReady(conversion, poll)
+        conversion = self.startPressure()
+        continue
+
+      started = conversion.started
+      pressure, temp = self.__waitReady(conversion, poll)
+      window.append((started, pressure, temp))
+      taken += 1
+      output = len(window) == oversample and taken % decimate == 0
+
+      # no conversion is left running after the last sample
+      conversion = None
+      if slot <= time.time() and not (output and produced + 1 == count):
+        conversion = self.__startSample()
+
+      if output:
+        produced += 1
+        n = float(len(window))
+        yield (sum([ w[0] for w in window ]) / n,
+               sum([ w[1] for w in window ]) / n,
+               sum([ w[2] for w in window ]) / n)
 
-    raw = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - self.mode)
-
-    return raw
 
+  def readRawTemp(self):
+    """Reads the raw (uncompensated) temperature from the sensor"""
+    # The bus stays free for the other devices during the conversion
+    with self.__i2c.exclusive():
+      return self.__collectRaw(self.startTemperature(), True)
 
-  def readTemperature(self):
-    """Gets the compensated temperature in degrees celcius"""
 
-    # Read raw temp before aligning it with the calibration values
-    UT = self.readRawTemp()
-    X1 = ((UT - self.__cal_AC6) * self.__cal_AC5) >> 15
-    X2 = (self.__cal_MC << 11) / (X1 + self.__cal_MD)
-    B5 = X1 + X2
-    temp = ((B5 + 8) >> 4) / 10.0
+  def readRawPressure(self):
+    """Reads the raw (uncompensated) pressure level from the sensor"""
 
-    return temp
+    with self.__i2c.exclusive():
+      return self.__collectRaw(self.startPressure(), True)
 
 
-  def read(self):
-    """Gets the compensated pressure in pascal and the temperature"""
+  def __rawPressure(self, msb, lsb, xlsb, mode):
+    return ((msb << 16) + (lsb << 8) + xlsb) >> (8 - mode)
 
-    UT = self.readRawTemp()
-    UP = self.readRawPressure()
 
-    # True Temperature Calculations
+  def __computeB5(self, UT):
+    """Temperature term shared by the temperature and pressure compensations"""
     X1 = ((UT - self.__cal_AC6) * self.__cal_AC5) >> 15
     X2 = (self.__cal_MC << 11) / (X1 + self.__cal_MD)
-    B5 = X1 + X2
-    temp = ((B5 + 8) >> 4) / 10.0
+    return X1 + X2
 
-    # Pressure Calculations
+
+  def __computePressure(self, UP, B5, mode):
+    """Compensated pressure in pascal"""
     B6 = B5 - 4000
     X1 = (self.__cal_B2 * (B6 * B6) >> 12) >> 11
     X2 = (self.__cal_AC2 * B6) >> 11
     X3 = X1 + X2
-    B3 = (((self.__cal_AC1 * 4 + X3) << self.mode) + 2) / 4
+    B3 = (((self.__cal_AC1 * 4 + X3) << mode) + 2) / 4
     X1 = (self.__cal_AC3 * B6) >> 13
     X2 = (self.__cal_B1 * ((B6 * B6) >> 12)) >> 16
     X3 = ((X1 + X2) + 2) >> 2
     B4 = (self.__cal_AC4 * (X3 + 32768)) >> 15
-    B7 = (UP - B3) * (50000 >> self.mode)
+    B7 = (UP - B3) * (50000 >> mode)
     if (B7 < 0x80000000):
       p = (B7 * 2) / B4
     else:
@@ -205,13 +503,109 @@ class BMP085 :
     X1 = (X1 * 3038) >> 16
     X2 = (-7357 * p) >> 16
 
-    p = p + ((X1 + X2 + 3791) >> 4)
+    return p + ((X1 + X2 + 3791) >> 4)
+
+
+  def __compensate(self, B5, UP, mode):
+    temp = ((B5 + 8) >> 4) / 10.0
+    return (1. * self.__computePressure(UP, B5, mode), temp)
+
+
+  @staticmethod
+  def compensateArrays(calibration, mode, UT, UP, seaLevelPressure = 101325):
+    """Compensates arrays of raw temperatures UT and pressures UP (numpy
+    arrays or sequences) sampled in mode with the coefficients returned by
+    calibration(). Returns the arrays of pressures (Pa), temperatures (C)
+    and altitudes (m), bit-exact with read() and readAltitude(): the
+    integer arithmetic is done in int64, the shifts are arithmetic and the
+    divisions floored as the python 2 ones"""
+    if numpy is None:
+      raise ImportError("numpy is required by BMP085.compensateArrays()")
+
+    AC1, AC2, AC3, AC4, AC5, AC6, B1, B2, MB, MC, MD = [ numpy.int64(c) for c in calibration ]
+    UT = numpy.asarray(UT, dtype = numpy.int64)
+    UP = numpy.asarray(UP, dtype = numpy.int64)
+
+    X1 = ((UT - AC6) * AC5) >> 15
+    X2 = (MC << 11) // (X1 + MD)
+    B5 = X1 + X2
+    temp = ((B5 + 8) >> 4) / 10.0
+
+    B6 = B5 - 4000
+    X1 = (B2 * (B6 * B6) >> 12) >> 11
+    X2 = (AC2 * B6) >> 11
+    X3 = X1 + X2
+    B3 = (((AC1 * 4 + X3) << mode) + 2) >> 2 # floored / 4
+    X1 = (AC3 * B6) >> 13
+    X2 = (B1 * ((B6 * B6) >> 12)) >> 16
+    X3 = ((X1 + X2) + 2) >> 2
+    B4 = (AC4 * (X3 + 32768)) >> 15
+    B7 = (UP - B3) * (50000 >> mode)
+    p = (B7 * 2) // B4
+    large = B7 >= 0x80000000
+    if large.any():
+      p[large] = (B7[large] // B4[large]) * 2
+
+    X1 = (p >> 8) * (p >> 8)
+    X1 = (X1 * 3038) >> 16
+    X2 = (-7357 * p) >> 16
+    pressure = (p + ((X1 + X2 + 3791) >> 4)).astype(numpy.float64)
+
+    altitude = 44330.0 * (1.0 - numpy.power(pressure / seaLevelPressure, 1./5.255))
+    return pressure, temp, altitude
 
-    return (1. * p, temp)
 
-  def readAltitude(self, seaLevelPressure=101325):
-    "Calculates the altitude in meters"
+  def readTemperature(self):
+    """Gets the compensated temperature in degrees celcius"""
+
+    # Read raw temp before aligning it with the calibration values
+    B5 = self.__storeB5(self.__computeB5(self.readRawTemp()))
+    temp = ((B5 + 8) >> 4) / 10.0
+
+    return temp
+
+
+  def read(self):
+    """Gets the compensated pressure in pascal and the temperature, the
+    temperature is the cached one if setTemperatureCache() is enabled"""
+
+    with self.__i2c.exclusive():
+      if self.needsTemperature():
+        self.__storeB5(self.__computeB5(self.readRawTemp()))
+      UP = self.readRawPressure()
+      B5 = self.__takeB5()
+
+    return self.__compensate(B5, UP, self.mode)
+
+
+  @aio.coroutine
+  def readAsync(self):
+    """Coroutine variant of read(), the conversion delays are awaited on the
+    event loop instead of blocking the thread"""
+    if self.__async is None:
+      self.__async = aio.AsyncI2C(self.__i2c)
+    bus = self.__async
+
+    with (yield aio.From(bus.exclusive())):
+      self.__pending = None
+      if self.needsTemperature():
+        yield aio.From(bus.write_byte(self.__BMP085_CONTROL, self.__BMP085_READTEMPCMD))
+        yield aio.From(aio.sleep(self.__BMP085_TEMPTIME))
+        UT = yield aio.From(bus.read_short(self.__BMP085_TEMPDATA))
+        self.__storeB5(self.__computeB5(UT))
+
+      yield aio.From(bus.write_byte(self.__BMP085_CONTROL,
+                                    self.__BMP085_READPRESSURECMD + (self.mode << 6)))
+      yield aio.From(aio.sleep(self.CONVERSION_TIME[self.mode]))
+      msb, lsb, xlsb = yield aio.From(bus.read_registers(self.__BMP085_PRESSUREDATA, 3))
+      B5 = self.__takeB5()
+
+    raise aio.Return(self.__compensate(B5, self.__rawPressure(msb, lsb, xlsb, self.mode), self.mode))
+
+  def readAltitude(self, seaLevelPressure=101325, pressure=None):
+    """Calculates the altitude in meters, of pressure if given instead of a
+    new read() (see Altimeter for the samples already acquired)"""
     altitude = 0.0
-    pressure = float(self.read()[0])
+    pressure = float(self.read()[0] if pressure is None else pressure)
     altitude = 44330.0 * (1.0 - pow(pressure / seaLevelPressure, 1./5.255))
     return altitude
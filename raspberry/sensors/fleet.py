@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "BMP085Fleet" ]
+
+import contextlib
+import time
+from ..i2c import I2C, I2CError
+from .bmp085 import BMP085
+
+# ===========================================================================
+# BMP085Fleet Class
+# ===========================================================================
+
+class BMP085Fleet :
+  """Polls many BMP085, each one identified by its bus, its multiplexer
+  channel (TCA9548A) if any and its address:
+
+    fleet = BMP085Fleet()
+    mux = TCA9548A(0x70, busnum = 1)
+    for channel in range(8):
+      fleet.add(mux = mux, channel = channel)
+    fleet.add(busnum = 0)
+    readings = fleet.poll()   # { name: (timestamp, pressure, temperature) }
+
+  A poll starts the conversions of every sensor before collecting them,
+  so that their waits overlap. The sensors are visited sorted by bus,
+  multiplexer and channel, each channel being selected once to start and
+  once to collect, and the direction alternates between the temperature
+  and pressure phases so that a phase begins on the channel the previous
+  one ended on. The sensors enabled with setTemperatureCache() only take
+  part in the temperature phase when their term is stale"""
+
+  class Sensor :
+    def __init__(self, name, bmp, busnum, mux, channel, address):
+      self.name    = name
+      self.bmp     = bmp
+      self.busnum  = busnum
+      self.mux     = mux
+      self.channel = channel
+      self.address = address
+
+    def route(self):
+      return (self.busnum,
+              -1 if self.mux is None else self.mux.address(),
+              -1 if self.channel is None else self.channel,
+              self.address)
+
+  def __init__(self):
+    self.__sensors  = []
+    self.__names    = {}
+    self.__muxes    = {} # busnum: [ muxes ]
+    self.__forward  = True
+    self.__errors   = {}
+    self.__switches = 0
+    self.__rounds   = 0
+    self.__samples  = 0
+    self.__failures = 0
+    self.__busy     = 0. # time spent polling
+    self.__last     = 0. # duration of the last poll
+
+  def add(self, name = None, address = 0x77, busnum = -1, mux = None, channel = None,
+          mode = BMP085.STANDARD, **kwargs):
+    """Creates and registers the BMP085 at address, on busnum or behind the
+    channel of mux, the other arguments are the ones of BMP085"""
+    if (mux is None) != (channel is None):
+      raise ValueError("A multiplexer channel needs both mux and channel")
+    if mux is not None:
+      busnum = mux.busnum()
+      if mux not in self.__muxes.setdefault(busnum, []):
+        self.__muxes[busnum].append(mux)
+    elif busnum < 0:
+      busnum = I2C.getPiI2CBusNumber()
+
+    if name is None:
+      name = "{0}/{1}{2:#04x}".format(busnum,
+                                      "" if mux is None else "{0:#04x}:{1}/".format(mux.address(), channel),
+                                      address)
+    if name in self.__names:
+      raise ValueError("A sensor is already named {0}".format(name))
+
+    # the calibration is read through the channel
+    with self.__route(busnum, mux, channel):
+      bmp = BMP085(address, mode, busnum = busnum,
+                   route = None if mux is None else mux.route(channel), **kwargs)
+
+    sensor = BMP085Fleet.Sensor(name, bmp, busnum, mux, channel, address)
+    self.__names[name] = sensor
+    self.__sensors.append(sensor)
+    self.__sensors.sort(key = BMP085Fleet.Sensor.route)
+    return bmp
+
+  def sensor(self, name):
+    """BMP085 registered as name"""
+    return self.__names[name].bmp
+
+  def names(self):
+    """Names of the sensors in polling order"""
+    return [ s.name for s in self.__sensors ]
+
+  @contextlib.contextmanager
+  def __route(self, busnum, mux, channel):
+    """Connects the channel of mux to the bus until the block exits, the
+    other multiplexers of the bus being disconnected (their devices may
+    share addresses)"""
+    for other in self.__muxes.get(busnum, []):
+      if other is not mux and other.select(None):
+        self.__switches += 1
+    if mux is None:
+      yield
+      return
+    switches = mux.switches()
+    with mux.use(channel):
+      self.__switches += mux.switches() - switches
+      yield
+
+  def __failed(self, sensor, err, failed):
+    self.__errors[sensor.name] = err
+    self.__failures += 1
+    failed.add(sensor.name)
+
+  def __phase(self, sensors, temperature, failed):
+    """Starts a conversion on every sensor then collects them in the same
+    order, returns [ (sensor, conversion, result) ]"""
+    if not self.__forward:
+      sensors = sensors[::-1]
+    self.__forward = not self.__forward
+
+    started = []
+    for sensor in sensors:
+      try:
+        with self.__route(sensor.busnum, sensor.mux, sensor.channel):
+          if temperature:
+            started.append((sensor, sensor.bmp.startTemperature()))
+          else:
+            started.append((sensor, sensor.bmp.startPressure()))
+      except I2CError, err:
+        self.__failed(sensor, err, failed)
+
+    results = []
+    for sensor, conversion in started:
+      try:
+        with self.__route(sensor.busnum, sensor.mux, sensor.channel):
+          results.append((sensor, conversion, sensor.bmp.collect(conversion)))
+      except I2CError, err:
+        self.__failed(sensor, err, failed)
+    return results
+
+  def poll(self):
+    """Reads every sensor once, returns { name: (timestamp, pressure,
+    temperature) }. The sensors that failed are left out, see errors()"""
+    start  = time.time()
+    failed = set()
+
+    stale = [ s for s in self.__sensors if s.bmp.needsTemperature() ]
+    if stale:
+      self.__phase(stale, True, failed)
+
+    readings = {}
+    ready = [ s for s in self.__sensors if s.name not in failed ]
+    for sensor, conversion, (pressure, temp) in self.__phase(ready, False, failed):
+      readings[sensor.name] = (conversion.started, pressure, temp)
+
+    self.__last = time.time() - start
+    self.__busy += self.__last
+    self.__rounds  += 1
+    self.__samples += len(readings)
+    return readings
+
+  def stream(self, rate = None, count = None):
+    """Generator of the polls, count of them or endlessly, at rate polls
+    per second or as fast as possible"""
+    period = 1. / rate if rate else 0.
+    slot = time.time()
+    polled = 0
+    while count is None or polled < count:
+      delay = slot - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      slot = max(slot + period, time.time() - period)
+      polled += 1
+      yield self.poll()
+
+  def errors(self):
+    """Last error of each sensor that failed"""
+    return dict(self.__errors)
+
+  def stats(self):
+    """Returns the number of sensors, polls, samples read, failures and
+    multiplexer switches, the aggregate samples per second while polling
+    and the duration of the last poll"""
+    return { "sensors"        : len(self.__sensors),
+             "rounds"         : self.__rounds,
+             "samples"        : self.__samples,
+             "failures"       : self.__failures,
+             "switches"       : self.__switches,
+             "samples_per_sec": self.__samples / self.__busy if self.__busy > 0 else 0.,
+             "last_round"     : self.__last }
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+__all__ = [ "OversamplingPolicy" ]
+
+import collections
+import math
+import time
+from .bmp085 import BMP085
+
+# ===========================================================================
+# OversamplingPolicy Class
+# ===========================================================================
+
+class OversamplingPolicy :
+  """Picks the hardware mode of a BMP085 and the number of samples averaged
+  in software per output so that outputs come at rate per second with an
+  RMS pressure noise of at most noise Pa, for the least conversion time
+  (the least bus occupancy) per output:
+
+    policy = OversamplingPolicy(BMP085(), rate = 10, noise = 2.)
+    for timestamp, pressure, temperature in policy.stream():
+      ...
+
+  The noise of each mode starts at its datasheet value and the time of a
+  sample at its conversion time, the ones of the mode in use are then
+  measured on the samples (half the mean square difference of consecutive
+  samples, the last one of the previous output included so that a plan
+  without oversampling is measured too, the slow pressure changes cancel
+  out) and the plan is revised
+  every evaluate outputs. When no plan meets both targets the rate wins
+  and the noise is made as low as the rate allows"""
+
+  # RMS noise of the pressure in Pa and maximum conversion time per mode,
+  # the starting points of the measures
+  NOISE      = BMP085.PRESSURE_NOISE
+  CONVERSION = BMP085.CONVERSION_TIME
+
+  MAX_OVERSAMPLE = 64
+
+  def __init__(self, bmp, rate, noise, evaluate = 10, alpha = 0.05):
+    self.__bmp      = bmp
+    self.__rate     = float(rate)
+    self.__noise    = float(noise)
+    self.__evaluate = evaluate
+    self.__alpha    = alpha
+
+    self.__variance = dict([ (m, n * n) for m, n in self.NOISE.items() ])
+    self.__time     = dict(self.CONVERSION)
+    self.__measured = dict([ (m, 0) for m in self.NOISE ])
+    self.__last     = None # (mode, last hardware sample of the last output)
+
+    self.__decisions = collections.deque(maxlen = 32)
+    self.__switches  = 0
+    self.__outputs   = 0
+    self.__started   = None
+    self.__mode      = None
+    self.__revise("initial")
+
+  # --------------------------------------------------------------------------
+  def plan(self):
+    """Returns (mode, oversample, feasible): the cheapest plan meeting the
+    rate and the noise, or the least noisy one at the rate if none does"""
+    period = 1. / self.__rate
+    best = None
+    for mode in sorted(self.NOISE):
+      n = max(1, int(math.ceil(self.__variance[mode] / self.__noise ** 2)))
+      cost = n * self.__time[mode]
+      if n <= self.MAX_OVERSAMPLE and cost <= period and (best is None or cost < best[2]):
+        best = (mode, n, cost)
+    if best is not None:
+      return best[0], best[1], True
+
+    best = None
+    for mode in sorted(self.NOISE):
+      n = min(self.MAX_OVERSAMPLE, int(period / self.__time[mode]))
+      if n < 1:
+        continue
+      noise = self.__variance[mode] / n
+      if best is None or noise < best[2]:
+        best = (mode, n, noise)
+    if best is None: # even one sample is too slow
+      return BMP085.ULTRALOWPOWER, 1, False
+    return best[0], best[1], False
+
+  def __revise(self, reason):
+    mode, oversample, feasible = self.plan()
+    if mode == self.__mode and oversample == self.__oversample:
+      return False
+
+    if self.__mode is not None:
+      self.__switches += 1
+    self.__mode, self.__oversample, self.__feasible = mode, oversample, feasible
+    self.__decisions.append({ "time"          : time.time(),
+                              "reason"        : reason,
+                              "mode"          : mode,
+                              "oversample"    : oversample,
+                              "feasible"      : feasible,
+                              "expected_noise": self.expectedNoise(),
+                              "sample_time"   : self.__time[mode] })
+    return True
+
+  def __measure(self, mode, samples, end):
+    """Updates the noise and the sample time of mode from a burst of
+    consecutive hardware samples that ended at end"""
+    a = self.__alpha
+    chain = samples
+    if self.__last is not None and self.__last[0] == mode:
+      chain = [ self.__last[1] ] + samples
+    for previous, sample in zip(chain, chain[1:]):
+      d = sample[1] - previous[1]
+      self.__variance[mode] += a * (d * d / 2. - self.__variance[mode])
+      self.__measured[mode] += 1
+    self.__last = (mode, samples[-1])
+
+    # from the start of a sample to the start of the next one, to the end
+    # of the burst for the last one
+    starts = [ s[0] for s in samples ] + [ end ]
+    for start, following in zip(starts, starts[1:]):
+      self.__time[mode] += a * ((following - start) - self.__time[mode])
+
+  def expectedNoise(self):
+    """RMS noise of the outputs of the current plan"""
+    return math.sqrt(self.__variance[self.__mode] / self.__oversample)
+
+  # --------------------------------------------------------------------------
+  def stream(self, count = None):
+    """Generator of (timestamp, pressure, temperature) outputs at the
+    target rate, count of them or endlessly"""
+    period = 1. / self.__rate
+    slot   = time.time()
+    produced = 0
+    if self.__started is None:
+      self.__started = slot
+
+    while count is None or produced < count:
+      delay = slot - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      slot = max(slot + period, time.time() - period)
+
+      # a burst of back to back samples, none left converting afterwards
+      mode = self.__mode
+      self.__bmp.mode = mode
+      samples = list(self.__bmp.stream(count = self.__oversample))
+      self.__measure(mode, samples, time.time())
+
+      n = float(len(samples))
+      produced += 1
+      self.__outputs += 1
+      if self.__outputs % self.__evaluate == 0:
+        self.__revise("measured")
+
+      yield (sum([ s[0] for s in samples ]) / n,
+             sum([ s[1] for s in samples ]) / n,
+             sum([ s[2] for s in samples ]) / n)
+
+  def stats(self):
+    """Returns the current plan, the targets, the achieved rate, the
+    expected noise, the estimates per mode (noise in Pa, time per sample,
+    samples measured), the number of plan switches and the last
+    decisions"""
+    elapsed = time.time() - self.__started if self.__started is not None else 0.
+    return { "mode"          : self.__mode,
+             "oversample"    : self.__oversample,
+             "feasible"      : self.__feasible,
+             "target_rate"   : self.__rate,
+             "target_noise"  : self.__noise,
+             "achieved_rate" : self.__outputs / elapsed if elapsed > 0 else 0.,
+             "expected_noise": self.expectedNoise(),
+             "noise"         : dict([ (m, math.sqrt(v)) for m, v in self.__variance.items() ]),
+             "sample_time"   : dict(self.__time),
+             "measured"      : dict(self.__measured),
+             "switches"      : self.__switches,
+             "decisions"     : list(self.__decisions) }
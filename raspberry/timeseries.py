@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Fixed capacity time series of sensor readings.
+
+The samples are kept in preallocated array columns (a timestamp and one
+double per field) used as a ring buffer, an append overwrites the oldest
+sample once full. Each append also updates min/max/mean rollups at
+several resolutions (1s, 1min and 1h by default) so that windows can be
+summarized without scanning the raw samples:
+
+  series = TimeSeries(("pressure", "temperature"), capacity = 3600 * 10)
+  for t, p, temp in bmp.stream(rate = 10):
+    series.append(t, p, temp)
+  ...
+  series.summary("pressure", time.time() - 3600)   # (min, max, mean, count)
+  series.rollup(60).buckets("pressure")            # per minute
+
+The rollups usually outlive the raw samples: a summary covers what is
+still held at each level. The timestamps are expected in increasing
+order. The columns are plain array('d') that numpy.frombuffer() can wrap
+without copy.
+'''
+
+__all__ = [ "TimeSeries", "Rollup" ]
+
+import array
+import math
+import threading
+
+# (resolution in seconds, number of buckets kept): 1 hour of 1s buckets,
+# 1 day of 1min buckets and 1 week of 1h buckets
+RESOLUTIONS = ( (1., 3600), (60., 1440), (3600., 168) )
+
+
+def _doubles(n):
+  return array.array('d', [ 0. ]) * n
+
+
+# ===========================================================================
+# Rollup Class
+# ===========================================================================
+
+class Rollup :
+  """Ring of the min/max/sum/count of the samples per bucket of resolution
+  seconds, updated in place as the samples come"""
+
+  def __init__(self, fields, resolution, capacity):
+    self.fields     = tuple(fields)
+    self.resolution = float(resolution)
+    self.capacity   = capacity
+
+    self.__ids    = array.array('l', [ -1 ]) * capacity # bucket number, -1 if empty
+    self.__counts = array.array('L', [ 0 ]) * capacity
+    self.__mins   = [ _doubles(capacity) for f in fields ]
+    self.__maxs   = [ _doubles(capacity) for f in fields ]
+    self.__sums   = [ _doubles(capacity) for f in fields ]
+    self.__last   = None # last bucket number
+
+  def __slot(self, bucket):
+    """Slot holding bucket, None if it is not (or no longer) kept"""
+    if self.__last is None or bucket > self.__last or self.__last - bucket >= self.capacity:
+      return None
+    slot = bucket % self.capacity
+    return slot if self.__ids[slot] == bucket else None
+
+  def add(self, timestamp, values):
+    bucket = int(math.floor(timestamp / self.resolution))
+    if self.__last is None or bucket > self.__last:
+      # buckets skipped without any sample stay empty
+      if self.__last is not None:
+        for b in range(max(self.__last + 1, bucket - self.capacity + 1), bucket):
+          self.__ids[b % self.capacity] = -1
+      self.__last = bucket
+      slot = bucket % self.capacity
+      self.__ids[slot]    = bucket
+      self.__counts[slot] = 0
+    elif self.__last - bucket >= self.capacity: # older than the buckets kept
+      return
+    else:
+      slot = bucket % self.capacity
+      if self.__ids[slot] != bucket:
+        # late sample of a bucket skipped while empty
+        self.__ids[slot]    = bucket
+        self.__counts[slot] = 0
+
+    count = self.__counts[slot]
+    for i, value in enumerate(values):
+      if count == 0:
+        self.__mins[i][slot] = self.__maxs[i][slot] = self.__sums[i][slot] = value
+      else:
+        if value < self.__mins[i][slot]: self.__mins[i][slot] = value
+        if value > self.__maxs[i][slot]: self.__maxs[i][slot] = value
+        self.__sums[i][slot] += value
+    self.__counts[slot] = count + 1
+
+  def accumulate(self, field, start, end, acc):
+    """Merges the buckets starting in [start, end) in acc, a [min, max,
+    sum, count] list"""
+    if self.__last is None:
+      return acc
+    i = self.fields.index(field)
+    first = int(max(self.__last - self.capacity + 1, math.ceil(start / self.resolution)))
+    last  = int(min(self.__last + 1, math.ceil(end / self.resolution)))
+    for bucket in range(first, last):
+      slot = self.__slot(bucket)
+      if slot is None or self.__counts[slot] == 0:
+        continue
+      if acc[3] == 0 or self.__mins[i][slot] < acc[0]: acc[0] = self.__mins[i][slot]
+      if acc[3] == 0 or self.__maxs[i][slot] > acc[1]: acc[1] = self.__maxs[i][slot]
+      acc[2] += self.__sums[i][slot]
+      acc[3] += self.__counts[slot]
+    return acc
+
+  def buckets(self, field, start = None, end = None):
+    """List of (bucket start, min, max, mean, count) of the buckets kept,
+    oldest first"""
+    if self.__last is None:
+      return []
+    i = self.fields.index(field)
+    first = self.__last - self.capacity + 1
+    last  = self.__last + 1
+    if start is not None: first = max(first, int(math.ceil(start / self.resolution)))
+    if end   is not None: last  = min(last,  int(math.ceil(end / self.resolution)))
+
+    result = []
+    for bucket in range(first, last):
+      slot = self.__slot(bucket)
+      if slot is None or self.__counts[slot] == 0:
+        continue
+      count = self.__counts[slot]
+      result.append((bucket * self.resolution, self.__mins[i][slot], self.__maxs[i][slot],
+                     self.__sums[i][slot] / count, count))
+    return result
+
+  def summary(self, field, start = None, end = None):
+    """(min, max, mean, count) of the buckets starting in [start, end)"""
+    start = -float("inf") if start is None else start
+    end   =  float("inf") if end is None else end
+    return _summary(self.accumulate(field, start, end, [ None, None, 0., 0 ]))
+
+
+def _summary(acc):
+  if acc[3] == 0:
+    return (None, None, None, 0)
+  return (acc[0], acc[1], acc[2] / acc[3], acc[3])
+
+
+# ===========================================================================
+# TimeSeries Class
+# ===========================================================================
+
+class TimeSeries :
+  """Ring buffer of capacity (timestamp, field values...) samples with
+  rollups at the resolutions given as (seconds, buckets kept) pairs"""
+
+  def __init__(self, fields, capacity, resolutions = RESOLUTIONS):
+    self.fields   = tuple(fields)
+    self.capacity = capacity
+
+    self.__times   = _doubles(capacity)
+    self.__columns = [ _doubles(capacity) for f in self.fields ]
+    self.__next    = 0 # slot of the next sample
+    self.__size    = 0
+    self.__lock    = threading.Lock()
+
+    # finest first
+    self.__rollups = [ Rollup(self.fields, r, n) for r, n in sorted(resolutions) ]
+
+  def __len__(self):
+    return self.__size
+
+  def append(self, timestamp, *values):
+    """Adds a sample, the values in the order of the fields"""
+    if len(values) != len(self.fields):
+      raise ValueError("{0} values expected, got {1}".format(len(self.fields), len(values)))
+
+    with self.__lock:
+      slot = self.__next
+      self.__times[slot] = timestamp
+      for column, value in zip(self.__columns, values):
+        column[slot] = value
+      self.__next = (slot + 1) % self.capacity
+      self.__size = min(self.__size + 1, self.capacity)
+
+      for rollup in self.__rollups:
+        rollup.add(timestamp, values)
+
+  def __slot(self, i):
+    """Slot of the i-th sample kept, oldest first"""
+    return (self.__next - self.__size + i) % self.capacity
+
+  def __bisect(self, timestamp):
+    """Index of the first sample kept not older than timestamp"""
+    low, high = 0, self.__size
+    while low < high:
+      mid = (low + high) // 2
+      if self.__times[self.__slot(mid)] < timestamp:
+        low = mid + 1
+      else:
+        high = mid
+    return low
+
+  def last(self):
+    """Latest (timestamp, values...) sample, None if empty"""
+    with self.__lock:
+      if self.__size == 0:
+        return None
+      slot = self.__slot(self.__size - 1)
+      return tuple([ self.__times[slot] ] + [ c[slot] for c in self.__columns ])
+
+  def column(self, field = None, start = None, end = None):
+    """Copy of the values of field (the timestamps if None) of the samples
+    in [start, end), oldest first, as an array('d')"""
+    with self.__lock:
+      data  = self.__times if field is None else self.__columns[self.fields.index(field)]
+      first = 0 if start is None else self.__bisect(start)
+      last  = self.__size if end is None else self.__bisect(end)
+      if first >= last:
+        return _doubles(0)
+
+      begin, stop = self.__slot(first), self.__slot(last - 1) + 1
+      if begin < stop:
+        return data[begin:stop]
+      return data[begin:] + data[:stop]
+
+  def samples(self, start = None, end = None):
+    """List of the (timestamp, values...) samples in [start, end)"""
+    columns = [ self.column(None, start, end) ] + \
+              [ self.column(f, start, end) for f in self.fields ]
+    return zip(*columns)
+
+  def rollup(self, resolution):
+    """Rollup of resolution seconds"""
+    for rollup in self.__rollups:
+      if rollup.resolution == resolution:
+        return rollup
+    raise KeyError("No rollup of {0}s".format(resolution))
+
+  def summary(self, field, start = None, end = None):
+    """(min, max, mean, count) of field over [start, end). The window is
+    split in the coarsest buckets it contains, the raw samples only cover
+    what is left at the edges below the finest resolution"""
+    with self.__lock:
+      if self.__size == 0:
+        return _summary([ None, None, 0., 0 ])
+      start = self.__times[self.__slot(0)] if start is None else start
+      end   = self.__times[self.__slot(self.__size - 1)] + 1e-9 if end is None else end
+      acc = [ None, None, 0., 0 ]
+      self.__summarize(len(self.__rollups) - 1, field, start, end, acc)
+      return _summary(acc)
+
+  def __summarize(self, level, field, start, end, acc):
+    if start >= end:
+      return
+    if level < 0:
+      # edges finer than the finest rollup: raw samples
+      column = self.__columns[self.fields.index(field)]
+      for i in range(self.__bisect(start), self.__bisect(end)):
+        value = column[self.__slot(i)]
+        if acc[3] == 0 or value < acc[0]: acc[0] = value
+        if acc[3] == 0 or value > acc[1]: acc[1] = value
+        acc[2] += value
+        acc[3] += 1
+      return
+
+    resolution = self.__rollups[level].resolution
+    first = math.ceil(start / resolution) * resolution
+    last  = math.floor(end / resolution) * resolution
+    if first >= last:
+      self.__summarize(level - 1, field, start, end, acc)
+      return
+    self.__rollups[level].accumulate(field, first, last, acc)
+    self.__summarize(level - 1, field, start, first, acc)
+    self.__summarize(level - 1, field, last, end, acc)
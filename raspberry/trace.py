@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, netWorms
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Record and replay of the I2C transfers.
+
+A Recorder installed before the devices are created writes every smbus
+operation of every bus in a binary trace:
+
+  rec = Recorder("session.trace").install()
+  bmp = BMP085()
+  ...
+  rec.close()
+
+A Replayer serves the same operations back to the unmodified drivers,
+without any hardware, either as fast as possible or with the recorded
+timing:
+
+  Replayer("session.trace", realtime = False).install()
+  bmp = BMP085()
+
+The replay only removes the bus: the delays of the drivers themselves
+(conversion times, tuning) are still slept.
+
+Trace format, little-endian: the header "RPIT" + version byte, then one
+record per operation made of a 11 bytes header
+
+  delta (uint32, us since the previous record), bus (uint8),
+  operation (uint8), address (uint8), register (uint8),
+  errno (uint8, 0 if the operation succeeded), payload length (uint16)
+
+followed by the payload: the bytes written or read. For i2c_rdwr the
+register field holds the number of messages and the payload is, for each
+message, its flags (uint8), its length (uint16) and its data.
+'''
+
+__all__ = [ "Recorder", "Replayer", "TraceMismatch" ]
+
+import ctypes
+import struct
+import threading
+import time
+
+from .i2c import I2CBus, I2C_M_RD
+
+MAGIC   = b"RPIT"
+VERSION = 1
+
+_record = struct.Struct("<IBBBBBH")
+_msg    = struct.Struct("<BH")
+_word   = struct.Struct("<H")
+
+# smbus operations and their code in the trace
+OPERATIONS = [ "read_byte", "write_byte",
+               "read_byte_data", "write_byte_data",
+               "read_word_data", "write_word_data",
+               "read_i2c_block_data", "write_i2c_block_data",
+               "i2c_rdwr" ]
+_codes = dict([ (op, code) for code, op in enumerate(OPERATIONS) ])
+
+
+class TraceMismatch(Exception):
+  """The drivers issued an operation that differs from the trace"""
+  pass
+
+
+def _msgBytes(msg):
+  return bytearray(ctypes.string_at(msg.buf, msg.len))
+
+
+def _encode(op, args, result = None):
+  """Returns (address, register, payload) of an operation, result is None
+  for the operations that failed"""
+  if op == "i2c_rdwr":
+    payload = bytearray()
+    for msg in args:
+      payload += _msg.pack(msg.flags & I2C_M_RD, msg.len) + _msgBytes(msg)
+    return args[0].addr, len(args), payload
+
+  address = args[0]
+  if op == "write_byte":
+    return address, 0, bytearray([ args[1] ])
+  reg = args[1] if op != "read_byte" else 0
+
+  if   result is None and op.startswith("read"): payload = bytearray()
+  elif op == "read_byte":            payload = bytearray([ result ])
+  elif op == "read_byte_data":       payload = bytearray([ result ])
+  elif op == "write_byte_data":      payload = bytearray([ args[2] ])
+  elif op == "read_word_data":       payload = bytearray(_word.pack(result))
+  elif op == "write_word_data":      payload = bytearray(_word.pack(args[2]))
+  elif op == "read_i2c_block_data":  payload = bytearray(result)
+  else:                              payload = bytearray(args[2])
+  return address, reg, payload
+
+
+# ===========================================================================
+# Recorder Class
+# ===========================================================================
+
+class Recorder :
+  """Writes the smbus operations of the buses opened after install()"""
+
+  def __init__(self, path):
+    self.__file     = open(path, "wb")
+    self.__lock     = threading.Lock()
+    self.__last     = None
+    self.__count    = 0
+    self.__previous = None # factory replaced by install()
+    self.__file.write(MAGIC + bytearray([ VERSION ]))
+
+  def install(self):
+    self.__factory  = I2CBus.factory()
+    self.__previous = I2CBus.setFactory(self.open)
+    return self
+
+  def open(self, busnum):
+    return Recorder.SMBus(self.__factory(busnum), busnum, self)
+
+  def count(self):
+    """Number of operations recorded"""
+    return self.__count
+
+  def close(self):
+    """Stops the recording, the buses opened afterwards are not recorded
+    and use the factory replaced by install() again"""
+    I2CBus.setFactory(self.__previous)
+    with self.__lock:
+      self.__file.close()
+
+  def write(self, busnum, op, args, result, error = 0):
+    now = time.time()
+    address, reg, payload = _encode(op, args, result)
+    with self.__lock:
+      if self.__file.closed:
+        return
+      delta = 0 if self.__last is None else int((now - self.__last) * 1e6)
+      self.__last = now
+      self.__file.write(_record.pack(min(delta, 0xFFFFFFFF), busnum,
+                                     _codes[op], address, reg,
+                                     min(error, 0xFF), len(payload)))
+      self.__file.write(payload)
+      self.__count += 1
+
+  # --------------------------------------------------------------------------
+  class SMBus :
+    """Wraps an smbus handle and records its operations"""
+
+    def __init__(self, handle, busnum, recorder):
+      self.__handle   = handle
+      self.__busnum   = busnum
+      self.__recorder = recorder
+
+    def __getattr__(self, name):
+      func = getattr(self.__handle, name)
+      if name not in OPERATIONS:
+        return func
+
+      busnum   = self.__busnum
+      recorder = self.__recorder
+      def recorded(*args):
+        try:
+          result = func(*args)
+        except IOError, err:
+          recorder.write(busnum, name, args, None, err.errno or 0xFF)
+          raise
+        recorder.write(busnum, name, args, result)
+        return result
+
+      setattr(self, name, recorded)
+      return recorded
+
+
+# ===========================================================================
+# Replayer Class
+# ===========================================================================
+
+class Replayer :
+  """Serves the operations of a trace to the buses opened after install()"""
+
+  def __init__(self, path, realtime = False):
+    self.__realtime = realtime
+    self.__lock     = threading.Lock()
+    self.__records  = {}
+    self.__count    = 0
+    self.__start    = None
+    self.__previous = None # factory replaced by install()
+
+    with open(path, "rb") as f:
+      data = bytearray(f.read())
+    if data[:len(MAGIC)] != bytearray(MAGIC) or data[len(MAGIC)] != VERSION:
+      raise ValueError("{0} is not an I2C trace".format(path))
+
+    offset = len(MAGIC) + 1
+    clock  = 0.
+    while offset < len(data):
+      delta, busnum, code, address, reg, error, length = \
+          _record.unpack_from(buffer(data), offset)
+      offset += _record.size
+      clock  += delta * 1e-6
+      self.__records.setdefault(busnum, []).append(
+        (clock, OPERATIONS[code], address, reg, error, data[offset:offset + length]))
+      offset += length
+
+    for records in self.__records.values():
+      records.reverse() # popped from the end
+
+  def install(self):
+    self.__previous = I2CBus.setFactory(self.open)
+    return self
+
+  def uninstall(self):
+    """Sets back the factory replaced by install()"""
+    I2CBus.setFactory(self.__previous)
+
+  def open(self, busnum):
+    return Replayer.SMBus(self, busnum)
+
+  def remaining(self):
+    """Number of operations not replayed yet"""
+    with self.__lock:
+      return sum([ len(r) for r in self.__records.values() ])
+
+  def count(self):
+    """Number of operations replayed"""
+    return self.__count
+
+  def next(self, busnum, op, address, reg):
+    with self.__lock:
+      records = self.__records.get(busnum, [])
+      if not records:
+        raise TraceMismatch("{0}({1:#x}, {2:#x}) on bus {3} past the end of the trace".format(
+            op, address, reg, busnum))
+      record = records.pop()
+      self.__count += 1
+
+    clock, t_op, t_address, t_reg, error, payload = record
+    if (t_op, t_address, t_reg) != (op, address, reg):
+      raise TraceMismatch("{0}({1:#x}, {2:#x}) on bus {3} while the trace has {4}({5:#x}, {6:#x})".format(
+          op, address, reg, busnum, t_op, t_address, t_reg))
+
+    if self.__realtime:
+      if self.__start is None:
+        self.__start = time.time() - clock
+      wait = self.__start + clock - time.time()
+      if wait > 0:
+        time.sleep(wait)
+
+    if error:
+      raise IOError(error, "replayed error")
+    return payload
+
+  # --------------------------------------------------------------------------
+  class SMBus :
+    """smbus like handle served by a Replayer"""
+
+    def __init__(self, replayer, busnum):
+      self.__replayer = replayer
+      self.__busnum   = busnum
+
+    def __check(self, op, address, reg, written, payload):
+      if written != payload:
+        raise TraceMismatch("{0}({1:#x}, {2:#x}) wrote {3} while the trace has {4}".format(
+            op, address, reg, list(written), list(payload)))
+
+    def close(self):
+      pass
+
+    def read_byte(self, address):
+      return self.__replayer.next(self.__busnum, "read_byte", address, 0)[0]
+
+    def write_byte(self, address, value):
+      payload = self.__replayer.next(self.__busnum, "write_byte", address, 0)
+      self.__check("write_byte", address, 0, bytearray([ value ]), payload)
+
+    def read_byte_data(self, address, reg):
+      return self.__replayer.next(self.__busnum, "read_byte_data", address, reg)[0]
+
+    def write_byte_data(self, address, reg, value):
+      payload = self.__replayer.next(self.__busnum, "write_byte_data", address, reg)
+      self.__check("write_byte_data", address, reg, bytearray([ value ]), payload)
+
+    def read_word_data(self, address, reg):
+      payload = self.__replayer.next(self.__busnum, "read_word_data", address, reg)
+      return _word.unpack(bytes(payload))[0]
+
+    def write_word_data(self, address, reg, value):
+      payload = self.__replayer.next(self.__busnum, "write_word_data", address, reg)
+      self.__check("write_word_data", address, reg, bytearray(_word.pack(value)), payload)
+
+    def read_i2c_block_data(self, address, reg, length):
+      return list(self.__replayer.next(self.__busnum, "read_i2c_block_data", address, reg))
+
+    def write_i2c_block_data(self, address, reg, data):
+      payload = self.__replayer.next(self.__busnum, "write_i2c_block_data", address, reg)
+      self.__check("write_i2c_block_data", address, reg, bytearray(data), payload)
+
+    def i2c_rdwr(self, *msgs):
+      payload = self.__replayer.next(self.__busnum, "i2c_rdwr", msgs[0].addr, len(msgs))
+      offset = 0
+      for msg in msgs:
+        flags, length = _msg.unpack_from(buffer(payload), offset)
+        offset += _msg.size
+        data = payload[offset:offset + length]
+        offset += length
+        if msg.flags & I2C_M_RD:
+          ctypes.memmove(msg.buf, bytes(data), length)
+        else:
+          self.__check("i2c_rdwr", msg.addr, len(msgs), _msgBytes(msg), data)
@@ -0,0 +1,21 @@
+import gc
+
+import pytest
+
+from raspberry.i2c import I2CBus
+from raspberry.emulators import EmulatedBus
+
+# The scripts driving real hardware are examples, only the modules running
+# on the emulators are collected
+collect_ignore = [ "test_lcd_sparkfun.py", "test_sensor_bmp085.py", "test_si4703.py" ]
+
+
+@pytest.fixture
+def bus():
+  """Emulated bus served as the auto-detected bus"""
+  bus = EmulatedBus().install()
+  yield bus
+  # the devices of the test release the bus, the next test opens its own
+  gc.collect()
+  EmulatedBus.uninstallAll()
+  assert I2CBus.opened() == []
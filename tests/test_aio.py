@@ -0,0 +1,182 @@
+import threading
+import time
+
+import pytest
+
+asyncio = pytest.importorskip("trollius")
+From = asyncio.From
+
+from raspberry.aio import AsyncI2C
+from raspberry.i2c import I2C
+from raspberry.radio import SI470x
+from raspberry.sensors import BMP085
+from raspberry.emulators import BMP085Emulator, SI4703Emulator
+
+
+@pytest.fixture
+def loop():
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  yield loop
+  AsyncI2C.closeLoop(loop)
+  loop.close()
+  asyncio.set_event_loop(None)
+
+@pytest.fixture
+def bmp085(bus):
+  return bus.attach(BMP085Emulator(temperature = 21.5, pressure = 99000., instant = True), 0x77)
+
+@pytest.fixture
+def si4703(bus):
+  return bus.attach(SI4703Emulator(stations = { 88.0: 30, 98.0: 40, 101.5: 50 },
+                                   instant = True))
+
+def waitFor(condition, timeout = 2.):
+  deadline = time.time() + timeout
+  while not condition():
+    assert time.time() < deadline, "timed out"
+    time.sleep(0.001)
+
+
+# ---------------------------------------------------------------------------
+# Drivers
+def test_read_async(loop, bmp085):
+  bmp = BMP085()
+  pressure, temp = loop.run_until_complete(bmp.readAsync())
+  assert abs(pressure - 99000.) <= 1
+  assert abs(temp - 21.5) <= 0.1
+
+def test_read_async_concurrent(loop, bmp085):
+  first, second = BMP085(), BMP085()
+  readings = loop.run_until_complete(asyncio.gather(first.readAsync(), second.readAsync()))
+  for pressure, temp in readings:
+    assert abs(pressure - 99000.) <= 1
+
+def test_set_channel_async(loop, si4703):
+  radio = SI470x(rst_pin = None)
+  loop.run_until_complete(radio.setChannelAsync(98.0))
+  assert radio.getChannel() == pytest.approx(98.0)
+
+def test_seek_async(loop, si4703):
+  radio = SI470x(rst_pin = None)
+  radio.setChannel(90.0)
+  loop.run_until_complete(radio.seekAsync(SI470x.UP))
+  assert radio.getChannel() == pytest.approx(98.0)
+  assert si4703.seeks == 1
+
+def test_set_channel_async_waits_for_the_transaction(loop, si4703):
+  radio = SI470x(rst_pin = None)
+  radio.setChannel(88.0)
+  entered, leave = threading.Event(), threading.Event()
+  def rolledBack():
+    try:
+      with radio.transaction():
+        radio.setVolume(10)
+        entered.set()
+        leave.wait(2.)
+        raise ValueError()
+    except ValueError:
+      pass
+  thread = threading.Thread(target = rolledBack)
+  thread.start()
+  assert entered.wait(2.)
+
+  task = loop.create_task(radio.setChannelAsync(98.0))
+  loop.run_until_complete(asyncio.sleep(0.05))
+  leave.set()
+  thread.join()
+  loop.run_until_complete(task)
+  assert radio.getChannel() == pytest.approx(98.0)
+
+def test_poll_rds_async(loop, si4703):
+  radio = SI470x(rst_pin = None)
+  radio.setChannel(98.0)
+  si4703.injectStation(0x1234, ps = "HELLO FM")
+
+  @asyncio.coroutine
+  def poll(groups):
+    rds = None
+    for i in range(groups):
+      rds = (yield From(radio.pollRDSAsync())) or rds
+    raise asyncio.Return(rds)
+
+  rds = loop.run_until_complete(poll(si4703.pendingRDS()))
+  assert si4703.pendingRDS() == 0
+  assert rds.getCompleteProgramName() == "HELLO FM"
+
+
+# ---------------------------------------------------------------------------
+# Device lock
+@asyncio.coroutine
+def readChipId(bus):
+  with (yield From(bus.exclusive())):
+    value = yield From(bus.read_byte(0xD0))
+  raise asyncio.Return(value)
+
+def test_exclusive_cancelled_while_waiting(loop, bmp085):
+  i2c  = I2C(0x77)
+  bus  = AsyncI2C(i2c)
+  held = i2c.exclusive()
+  held.acquire()
+  try:
+    task = loop.create_task(readChipId(bus))
+    # the bus executor waits for the device
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert held.stats()["contended"] == 1
+    task.cancel()
+    loop.run_until_complete(asyncio.wait([ task ]))
+    assert task.cancelled()
+  finally:
+    held.release()
+
+  # the executor got the device after the cancellation and gave it back
+  value = loop.run_until_complete(asyncio.wait_for(readChipId(bus), 2.))
+  assert value == BMP085Emulator.CHIP_ID
+  AsyncI2C.closeLoop(loop)
+  def acquire():
+    with held:
+      pass
+  thread = threading.Thread(target = acquire)
+  thread.start()
+  thread.join(2.)
+  assert not thread.is_alive()
+  i2c.close()
+
+
+# ---------------------------------------------------------------------------
+# Executors
+def test_close_loop_stops_the_executors(bmp085):
+  threads = threading.active_count()
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  try:
+    loop.run_until_complete(BMP085().readAsync())
+    assert threading.active_count() == threads + 1
+    AsyncI2C.closeLoop(loop)
+    assert threading.active_count() == threads
+    # the loop starts over with a new executor
+    loop.run_until_complete(BMP085().readAsync())
+    AsyncI2C.closeLoop(loop)
+  finally:
+    loop.close()
+    asyncio.set_event_loop(None)
+  assert threading.active_count() == threads
+
+def test_closed_loop_executors_stopped_by_the_next_loop(bmp085):
+  threads = threading.active_count()
+  first = asyncio.new_event_loop()
+  asyncio.set_event_loop(first)
+  first.run_until_complete(BMP085().readAsync())
+  first.close()
+  assert threading.active_count() == threads + 1
+
+  second = asyncio.new_event_loop()
+  asyncio.set_event_loop(second)
+  try:
+    second.run_until_complete(BMP085().readAsync())
+    waitFor(lambda: threading.active_count() == threads + 1)
+    AsyncI2C.closeLoop(second)
+  finally:
+    second.close()
+    asyncio.set_event_loop(None)
+  assert threading.active_count() == threads
@@ -0,0 +1,123 @@
+import collections
+import random
+
+import pytest
+
+import raspberry.sensors.altimeter
+from raspberry.sensors.altimeter import Altimeter
+
+
+def slope(samples):
+  """Least squares slope of the (t, a) samples, the brute force way"""
+  n = float(len(samples))
+  mt = sum([ t for t, a in samples ]) / n
+  ma = sum([ a for t, a in samples ]) / n
+  return sum([ (t - mt) * (a - ma) for t, a in samples ]) / \
+         sum([ (t - mt) ** 2 for t, a in samples ])
+
+def flight(n, rate = 20., speed = 3., noise = 0.2, start = 1.5e9, seed = 1):
+  """n (timestamp, pressure) samples of a climb at speed m/s"""
+  rand = random.Random(seed)
+  altimeter = Altimeter()
+  samples = []
+  for i in range(n):
+    altitude = 100. + speed * i / rate + rand.gauss(0., noise)
+    # inverse of the barometric formula
+    pressure = altimeter.seaLevelPressure * (1. - altitude / 44330.) ** 5.255
+    samples.append((start + i / rate, pressure))
+  return samples
+
+
+# ---------------------------------------------------------------------------
+# Altitudes
+@pytest.mark.parametrize("maxError", [ 0.001, 0.01, 0.1, 1. ])
+@pytest.mark.parametrize("seaLevelPressure", [ 95000., 101325., 104000. ])
+def test_table_error_bound(maxError, seaLevelPressure):
+  numpy = pytest.importorskip("numpy")
+  altimeter = Altimeter(seaLevelPressure, maxError = maxError)
+  pressures = numpy.linspace(altimeter.low, altimeter.high, 200001)[:-1]
+  exact = 44330.0 * (1.0 - numpy.power(pressures / seaLevelPressure, Altimeter.EXPONENT))
+  assert numpy.abs(altimeter.altitudes(pressures) - exact).max() <= maxError
+
+def test_table_size_follows_the_bound():
+  sizes = [ Altimeter(maxError = e).tableSize() for e in (0.001, 0.01, 0.1) ]
+  assert sizes == sorted(sizes, reverse = True)
+  # the error is quadratic in the step
+  assert sizes[0] == pytest.approx(sizes[1] * 10 ** 0.5, rel = 0.01)
+
+def test_altitudes_out_of_the_table():
+  numpy = pytest.importorskip("numpy")
+  altimeter = Altimeter(low = 80000., high = 105000.)
+  pressures = [ 30000., 79999.9, 105000., 110000. ]
+  assert altimeter.altitudes(pressures).tolist() == \
+      pytest.approx([ altimeter.altitude(p) for p in pressures ], abs = 1e-9)
+
+def test_altitudes_mixed():
+  numpy = pytest.importorskip("numpy")
+  altimeter = Altimeter(low = 80000., high = 105000.)
+  pressures = numpy.array([ 70000., 90000., 101325., 108000. ])
+  altitudes = altimeter.altitudes(pressures)
+  assert isinstance(altitudes, numpy.ndarray)
+  assert altitudes.tolist() == \
+      pytest.approx([ altimeter.altitude(p) for p in pressures ], abs = altimeter.maxError)
+  assert altimeter.altitudes([]).tolist() == []
+
+def test_altitudes_without_numpy(monkeypatch):
+  monkeypatch.setattr(raspberry.sensors.altimeter, "numpy", None)
+  altimeter = Altimeter()
+  pressures = [ 90000., 101325. ]
+  assert altimeter.altitudes(pressures) == [ altimeter.altitude(p) for p in pressures ]
+  assert altimeter.altitude(101325.) == 0.
+
+def test_sea_level():
+  altimeter = Altimeter()
+  pressure = 95000.
+  altitude = altimeter.altitude(pressure)
+  assert altimeter.toSeaLevel(pressure, altitude) == pytest.approx(101325.)
+
+
+# ---------------------------------------------------------------------------
+# Vertical speed
+def check(altimeter, samples):
+  """Updates altimeter with samples, checking every speed against a least
+  squares fit of the window"""
+  window = collections.deque()
+  for timestamp, pressure in samples:
+    altitude, speed = altimeter.update(timestamp, pressure)
+    assert altitude == altimeter.altitude(pressure)
+    window.append((timestamp, altitude))
+    while window[0][0] < timestamp - altimeter.window and len(window) > 2:
+      window.popleft()
+    if len(window) < 2:
+      assert speed is None
+    else:
+      # relative to the origin, as an exact sum would be
+      origin = window[0][0]
+      assert speed == pytest.approx(slope([ (t - origin, a) for t, a in window ]),
+                                    rel = 1e-6, abs = 1e-6)
+  return speed
+
+def test_vertical_speed():
+  altimeter = Altimeter(window = 1.)
+  speed = check(altimeter, flight(200))
+  assert speed == pytest.approx(3., abs = 1.)
+
+def test_vertical_speed_first_samples():
+  altimeter = Altimeter()
+  assert altimeter.update(0., 100000.)[1] is None
+  assert altimeter.update(1., 100000.)[1] == 0.
+
+def test_vertical_speed_resummed():
+  # past RESUM updates the sums start over from the window
+  altimeter = Altimeter(window = 2.)
+  check(altimeter, flight(3 * Altimeter.RESUM + 10, noise = 1.))
+
+def test_vertical_speed_resummed_often(monkeypatch):
+  monkeypatch.setattr(Altimeter, "RESUM", 7)
+  altimeter = Altimeter(window = 0.5)
+  check(altimeter, flight(300))
+
+def test_vertical_speed_gaps():
+  # the window keeps two samples at least
+  altimeter = Altimeter(window = 1.)
+  check(altimeter, [ (t, p) for i, (t, p) in enumerate(flight(100)) if i % 30 < 3 ])
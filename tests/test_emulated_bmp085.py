@@ -0,0 +1,228 @@
+import json
+import time
+
+import pytest
+
+from raspberry.sensors import BMP085
+from raspberry.emulators import BMP085Emulator
+
+
+@pytest.fixture
+def emulator(bus):
+  return bus.attach(BMP085Emulator(temperature = 21.5, pressure = 99000., instant = True))
+
+
+@pytest.mark.parametrize("mode", [ BMP085.ULTRALOWPOWER, BMP085.STANDARD,
+                                   BMP085.HIGHRES, BMP085.ULTRAHIGHRES ])
+def test_read(emulator, mode):
+  bmp = BMP085(mode = mode)
+  pressure, temp = bmp.read()
+  assert abs(pressure - 99000.) <= 1
+  assert abs(temp - 21.5) <= 0.1
+  assert bmp.readTemperature() == pytest.approx(21.5, abs = 0.1)
+
+def test_read_follows_conditions(emulator):
+  bmp = BMP085()
+  emulator.setConditions(temperature = 30., pressure = 101000.)
+  pressure, temp = bmp.read()
+  assert abs(pressure - 101000.) <= 1
+  assert abs(temp - 30.) <= 0.1
+
+def test_calibration(emulator):
+  bmp = BMP085()
+  assert bmp.calibration() == BMP085Emulator.CALIBRATION
+  assert bmp.calibrationSource() == "device"
+
+
+# ---------------------------------------------------------------------------
+# Temperature cache
+def test_temperature_cache(emulator):
+  bmp = BMP085()
+  bmp.setTemperatureCache(10.)
+  for i in range(5):
+    bmp.read()
+  stats = bmp.temperatureCacheStats()
+  assert stats["refreshes"] == 1
+  assert stats["hits"] == 4
+  assert not bmp.needsTemperature()
+
+def test_temperature_cache_disabled(emulator):
+  bmp = BMP085()
+  bmp.setTemperatureCache(0)
+  for i in range(3):
+    bmp.read()
+  assert bmp.needsTemperature()
+  assert bmp.temperatureCacheStats()["hits"] == 0
+  assert emulator.conversions == 6
+
+def test_temperature_cache_collect(emulator):
+  bmp = BMP085()
+  bmp.setTemperatureCache(10.)
+  bmp.collect(bmp.startTemperature())
+  for i in range(3):
+    pressure, temp = bmp.collect(bmp.startPressure())
+    assert abs(pressure - 99000.) <= 1
+  # the first pressure used the temperature converted for it
+  assert bmp.temperatureCacheStats()["hits"] == 2
+
+def test_temperature_cache_stream(emulator):
+  bmp = BMP085()
+  bmp.setTemperatureCache(10.)
+  samples = list(bmp.stream(count = 5))
+  assert len(samples) == 5
+  stats = bmp.temperatureCacheStats()
+  assert stats["refreshes"] == 1
+  assert stats["hits"] == 4
+
+
+# ---------------------------------------------------------------------------
+# start/isReady/collect
+def test_split_conversion(emulator):
+  bmp = BMP085(mode = BMP085.ULTRAHIGHRES)
+  conversion = bmp.startTemperature()
+  assert not bmp.isReady(conversion)
+  # the emulated conversions complete at once, so does the SCO bit
+  assert bmp.isReady(conversion, poll = True)
+  assert bmp.collect(conversion) == pytest.approx(21.5, abs = 0.1)
+
+  conversion = bmp.startPressure()
+  pressure, temp = bmp.collect(conversion)
+  assert abs(pressure - 99000.) <= 1
+
+def test_collect_without_waiting(emulator):
+  bmp = BMP085()
+  conversion = bmp.startTemperature()
+  assert bmp.collect(conversion, wait = False) is None
+  time.sleep(conversion.remaining())
+  assert bmp.collect(conversion, wait = False) == pytest.approx(21.5, abs = 0.1)
+
+def test_collect_superseded(emulator):
+  bmp = BMP085()
+  first = bmp.startTemperature()
+  bmp.startTemperature()
+  with pytest.raises(RuntimeError):
+    bmp.collect(first)
+
+def test_pressure_needs_temperature(emulator):
+  bmp = BMP085()
+  with pytest.raises(RuntimeError):
+    bmp.collect(bmp.startPressure())
+
+
+# ---------------------------------------------------------------------------
+# Calibration cache
+def test_calibration_cache(emulator, tmpdir):
+  cache = str(tmpdir.join("calibration.json"))
+  assert BMP085(calibration_cache = cache).calibrationSource() == "device"
+
+  bmp = BMP085(calibration_cache = cache)
+  assert bmp.calibrationSource() == "cache"
+  assert bmp.calibration() == BMP085Emulator.CALIBRATION
+  assert abs(bmp.read()[0] - 99000.) <= 1
+
+def test_calibration_cache_other_sensor(bus, tmpdir):
+  cache = str(tmpdir.join("calibration.json"))
+  bus.attach(BMP085Emulator(instant = True))
+  BMP085(calibration_cache = cache)
+
+  # swapped for a sensor with another trimming at the same address
+  calibration = BMP085Emulator.CALIBRATION[:9] + (-8000, 2800)
+  bus.attach(BMP085Emulator(calibration = calibration, instant = True))
+  bmp = BMP085(calibration_cache = cache)
+  assert bmp.calibrationSource() == "device"
+  assert bmp.calibration() == calibration
+
+def test_calibration_cache_corrupted(emulator, tmpdir):
+  cache = tmpdir.join("calibration.json")
+  BMP085(calibration_cache = str(cache))
+
+  entries = json.loads(cache.read())
+  for entry in entries.values():
+    entry["calibration"][0] += 1
+  cache.write(json.dumps(entries))
+  bmp = BMP085(calibration_cache = str(cache))
+  assert bmp.calibrationSource() == "device"
+  assert bmp.calibration() == BMP085Emulator.CALIBRATION
+
+def test_calibration_cache_unreadable(emulator, tmpdir):
+  cache = tmpdir.join("calibration.json")
+  cache.write("not json")
+  assert BMP085(calibration_cache = str(cache)).calibrationSource() == "device"
+  assert BMP085(calibration_cache = str(cache)).calibrationSource() == "cache"
+
+
+# ---------------------------------------------------------------------------
+# compensateArrays()
+def recordRaw(bmp):
+  """Records the raw values read() compensates"""
+  raw = { "readRawTemp": [], "readRawPressure": [] }
+  for name, values in raw.items():
+    def recorded(read = getattr(bmp, name), values = values):
+      values.append(read())
+      return values[-1]
+    setattr(bmp, name, recorded)
+  return raw["readRawTemp"], raw["readRawPressure"]
+
+def b7(calibration, mode, UT, UP):
+  """Term of the compensation whose sign bit selects the division order"""
+  AC1, AC2, AC3, AC4, AC5, AC6, B1, B2, MB, MC, MD = calibration
+  X1 = ((UT - AC6) * AC5) >> 15
+  B6 = X1 + (MC << 11) // (X1 + MD) - 4000
+  X3 = ((B2 * (B6 * B6) >> 12) >> 11) + ((AC2 * B6) >> 11)
+  B3 = (((AC1 * 4 + X3) << mode) + 2) // 4
+  return (UP - B3) * (50000 >> mode)
+
+@pytest.mark.parametrize("mode", [ BMP085.ULTRALOWPOWER, BMP085.STANDARD,
+                                   BMP085.HIGHRES, BMP085.ULTRAHIGHRES ])
+def test_compensate_arrays_bit_exact(emulator, mode):
+  numpy = pytest.importorskip("numpy")
+  bmp = BMP085(mode = mode)
+  UT, UP = recordRaw(bmp)
+  readings = []
+  # 135 kPa is past the range of the sensor, B7 then exceeds 0x80000000
+  for temperature in (-20., 0., 21.5, 60.):
+    for pressure in (30000., 80000., 99000., 110000., 135000.):
+      emulator.setConditions(temperature, pressure)
+      readings.append(bmp.read())
+  assert any([ b7(bmp.calibration(), mode, ut, up) >= 0x80000000 for ut, up in zip(UT, UP) ])
+
+  pressures, temps, altitudes = BMP085.compensateArrays(bmp.calibration(), mode, UT, UP)
+  assert pressures.tolist() == [ r[0] for r in readings ]
+  assert temps.tolist() == [ r[1] for r in readings ]
+  assert altitudes.tolist() == [ bmp.readAltitude(pressure = r[0]) for r in readings ]
+
+
+# ---------------------------------------------------------------------------
+# stream()
+def test_stream(emulator):
+  bmp = BMP085()
+  samples = list(bmp.stream(count = 5))
+  assert len(samples) == 5
+  timestamps = [ s[0] for s in samples ]
+  assert timestamps == sorted(timestamps)
+  for timestamp, pressure, temp in samples:
+    assert abs(pressure - 99000.) <= 1
+    assert abs(temp - 21.5) <= 0.1
+
+def test_stream_oversampling(emulator):
+  bmp = BMP085()
+  bmp.setTemperatureCache(10.)
+  samples = list(bmp.stream(oversample = 4, count = 2))
+  assert len(samples) == 2
+  # a single temperature conversion, then pressure ones only
+  assert bmp.temperatureCacheStats()["refreshes"] == 1
+  assert emulator.conversions == 1 + 4 * 2
+
+def test_stream_decimation(emulator):
+  bmp = BMP085()
+  bmp.setTemperatureCache(10.)
+  samples = list(bmp.stream(oversample = 4, decimate = 1, count = 3))
+  assert len(samples) == 3
+  # the first sample needs a full window, then one per conversion
+  assert emulator.conversions == 1 + 4 + 2
+
+def test_stream_rate(emulator):
+  bmp = BMP085()
+  start = time.time()
+  list(bmp.stream(rate = 50, count = 5))
+  assert time.time() - start >= 4 / 50.
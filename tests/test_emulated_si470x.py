@@ -0,0 +1,335 @@
+import random
+import threading
+import time
+
+import pytest
+
+import raspberry.radio.si470x
+from raspberry.i2c import I2C
+from raspberry.radio import SI470x
+from raspberry.radio.rds import RDS
+from raspberry.radio.rdsworker import RDSWorker
+from raspberry.emulators import SI4703Emulator
+
+
+STATIONS = { 88.0: 30, 98.0: 40, 101.5: 50 }
+
+@pytest.fixture
+def emulator(bus):
+    return bus.attach(SI4703Emulator(stations = STATIONS, instant = True))
+
+
+def pollRDS(radio, groups):
+    rds = None
+    for i in range(groups):
+        rds = radio.pollRDS() or rds
+    return rds
+
+
+# ---------------------------------------------------------------------------
+# Tuning
+def test_tune(emulator):
+    radio = SI470x(rst_pin = None)
+    tunes = emulator.tunes
+    radio.setChannel(101.5)
+    assert radio.getChannel() == pytest.approx(101.5)
+    radio.setChannel(98.0)
+    assert radio.getChannel() == pytest.approx(98.0)
+    assert emulator.tunes == tunes + 2
+    assert radio.tuneStats()["tune"]["count"] == tunes + 2
+
+def test_tune_band_limit(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(120.)
+    assert radio.getChannel() == pytest.approx(108.)
+
+def test_tune_waits_for_stc(bus):
+    bus.attach(SI4703Emulator(stations = STATIONS, tune_time = 0.02))
+    radio = SI470x(rst_pin = None)
+    start = time.time()
+    radio.setChannel(98.0)
+    assert time.time() - start >= 0.02
+    assert radio.getChannel() == pytest.approx(98.0)
+
+def test_tune_stats(bus):
+    bus.attach(SI4703Emulator(stations = STATIONS, tune_time = 0.02))
+    radio = SI470x(rst_pin = None)
+    radio.resetTuneStats()
+    expected = radio.tuneStats()["tune"]["expected"]
+    for i in range(8):
+        radio.setChannel(98.0 if i % 2 else 101.5)
+    stats = radio.tuneStats()["tune"]
+    assert stats["count"] == 8
+    assert stats["timeouts"] == 0
+    assert 0.02 <= stats["min_latency"] <= stats["max_latency"]
+    assert stats["total_time"] >= 8 * 0.02
+    # the duration expected moves to the one of the chip, the polling
+    # then starts right before the end of the tune
+    assert abs(stats["expected"] - 0.02) < abs(expected - 0.02)
+    assert stats["last_polls"] <= 3
+    assert radio.tuneStats()["seek"]["count"] == 0
+
+    radio.resetTuneStats()
+    assert radio.tuneStats()["tune"]["count"] == 0
+
+def test_seek_up(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(90.0)
+    radio.seek(SI470x.UP)
+    assert radio.getChannel() == pytest.approx(98.0)
+    radio.seek(SI470x.UP)
+    assert radio.getChannel() == pytest.approx(101.5)
+    assert emulator.seeks == 2
+
+def test_seek_down(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(100.0)
+    radio.seek(SI470x.DOWN)
+    assert radio.getChannel() == pytest.approx(98.0)
+
+def test_seek_wraps(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(101.5)
+    radio.seek(SI470x.UP, SI470x.WRAP)
+    assert radio.getChannel() == pytest.approx(88.0)
+
+def test_seek_stops_at_band_limit(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(101.5)
+    radio.seek(SI470x.UP, SI470x.LIMIT)
+    assert radio.getChannel() not in (pytest.approx(88.0), pytest.approx(98.0))
+
+
+# ---------------------------------------------------------------------------
+# Transactions
+def test_transaction_single_write(emulator):
+    radio = SI470x(rst_pin = None)
+    writes = radio.writeStats()["writes"]
+    with radio.transaction():
+        radio.setVolume(10)
+        radio.setSoftMute(False)
+    assert radio.writeStats()["writes"] == writes + 1
+
+def test_transaction_skips_unchanged_writes(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setVolume(10)
+    stats = radio.writeStats()
+    with radio.transaction():
+        radio.setVolume(10)
+    assert radio.writeStats()["writes"] == stats["writes"]
+    assert radio.writeStats()["suppressed"] == stats["suppressed"] + 1
+
+def test_unchanged_write_skipped(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setVolume(12)
+    writes = radio.writeStats()["writes"]
+    radio.setVolume(12)
+    assert radio.writeStats()["writes"] == writes
+    assert radio.writeStats()["bytes_saved"] > 0
+
+def test_set_channel_waits_for_the_transaction(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(88.0)
+    thread = threading.Thread(target = radio.setChannel, args = (98.0,))
+    # a transaction rolled back while setChannel() waits for the chip does
+    # not undo the channel it is about to tune
+    with pytest.raises(ValueError):
+        with radio.transaction():
+            radio.setVolume(10)
+            thread.start()
+            time.sleep(0.05)
+            raise ValueError()
+    thread.join()
+    assert radio.getChannel() == pytest.approx(98.0)
+
+
+# ---------------------------------------------------------------------------
+# Register fields
+def test_getters_agree_with_get():
+    registers = SI470x.Registers(None)
+    names = sorted(registers._Registers__fields)
+    values = registers._Registers__registers
+    rand = random.Random(1)
+    for i in range(20):
+        for reg in range(len(values)):
+            values[reg] = rand.randint(0, 0xFFFF)
+        for name in names:
+            assert registers.getter(name)() == registers.get(name), name
+        assert registers.fields(*names) == tuple([ registers.get(n) for n in names ])
+
+def test_getter_follows_the_registers():
+    registers = SI470x.Registers(None)
+    stc = registers.getter("stc")
+    assert registers.getter("stc") is stc
+    registers.set("stc", 1)
+    assert stc() == 1
+    registers.set("stc", 0)
+    assert stc() == 0
+
+
+# ---------------------------------------------------------------------------
+# RDS
+def test_rds_decode(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(98.0)
+    emulator.injectStation(0x1234, ps = "HELLO FM", rt = "Some radio text")
+    rds = pollRDS(radio, emulator.pendingRDS())
+    assert emulator.pendingRDS() == 0
+    assert rds.getCompleteProgramName() == "HELLO FM"
+    assert rds.getCompleteRadioText() == "Some radio text"
+
+def test_rds_per_station(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(98.0)
+    emulator.injectStation(0x1234, ps = "STATION1")
+    first = pollRDS(radio, emulator.pendingRDS())
+    radio.setChannel(101.5)
+    emulator.injectStation(0x5678, ps = "STATION2")
+    second = pollRDS(radio, emulator.pendingRDS())
+    assert first is not second
+    assert first.getCompleteProgramName() == "STATION1"
+    assert second.getCompleteProgramName() == "STATION2"
+
+def test_rds_alternative_frequencies(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(98.0)
+    emulator.injectStation(0x1234, ps = "HELLO FM", afs = (88.0, 101.5))
+    rds = pollRDS(radio, emulator.pendingRDS())
+    assert sorted(rds.getAlternativeFrequencies()) == [ pytest.approx(88.0), pytest.approx(101.5) ]
+
+def test_rds_rejects_uncorrectable_groups(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(98.0)
+    emulator.injectStation(0x1234, ps = "HELLO FM")
+    rds = pollRDS(radio, emulator.pendingRDS())
+    # a PS segment with block D beyond correction is dropped
+    emulator.injectRDS(0x1234, 0, 0xE0CD, (ord("X") << 8) | ord("X"), errors = (0, 0, 0, 3))
+    assert pollRDS(radio, 1).getCompleteProgramName() == "HELLO FM"
+    assert rds.getCompleteProgramName() == "HELLO FM"
+
+def test_rds_decoder_leaves_state_on_rejection():
+    rds = RDS(RDS.EUROPE)
+    assert rds.decode(0x1234, 0, 0, 0, 0xE0CD, 0, (ord("H") << 8) | ord("I"), 0)
+    assert not rds.decode(0x5678, 3, 0, 0, 0xE0CD, 0, (ord("X") << 8) | ord("X"), 0)
+    assert rds.getProgramName().startswith("HI")
+
+def test_next_rds_group(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(98.0)
+    emulator.injectRDS(0x1234, 0x0000, 0xE0CD, 0x4142, errors = (0, 1, 0, 0))
+    a, b, c, d, errors, timestamp = radio.nextRDSGroup(timeout = 0.2)
+    assert (a, b, c, d) == (0x1234, 0x0000, 0xE0CD, 0x4142)
+    assert errors == (0, 1, 0, 0)
+    assert radio.nextRDSGroup(timeout = 0.05) is None
+
+def test_rds_worker(emulator):
+    radio = SI470x(rst_pin = None)
+    radio.setChannel(98.0)
+    names = []
+    worker = RDSWorker(radio)
+    worker.subscribe("ps", lambda freq, ps: names.append((freq, ps)))
+    emulator.injectStation(0x1234, ps = "HELLO FM")
+    worker.start()
+    try:
+        deadline = time.time() + 2
+        while not names and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        worker.stop()
+    assert worker.error() is None
+    assert names == [ (pytest.approx(98.0), "HELLO FM") ]
+    assert worker.rds(98.0).getCompleteProgramName() == "HELLO FM"
+
+
+# ---------------------------------------------------------------------------
+# Interrupt mode
+class GPIO :
+    '''RPi.GPIO stand-in recording the edge callbacks'''
+
+    BCM, IN, OUT, PUD_UP, FALLING, LOW, HIGH = range(7)
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down = None):
+        pass
+
+    def output(self, pin, value):
+        pass
+
+    def add_event_detect(self, pin, edge, callback):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        del self.callbacks[pin]
+
+    def edge(self, pin):
+        if pin in self.callbacks:
+            self.callbacks[pin](pin)
+
+IRQ_PIN = 17
+
+@pytest.fixture
+def gpio(monkeypatch):
+    gpio = GPIO()
+    monkeypatch.setattr(raspberry.radio.si470x, "gpio", gpio)
+    yield gpio
+    # the callbacks hold the radio, hence the bus
+    gpio.callbacks.clear()
+
+def interruptible(emulator, gpio):
+    radio = SI470x(rst_pin = None)
+    radio.enableInterrupts(IRQ_PIN)
+    # GPIO2 of the chip wired to the pin
+    emulator.setInterrupt(lambda: gpio.edge(IRQ_PIN))
+    return radio
+
+def registerReads():
+    return sum([ e["count"] for (address, op), e in I2C.statsSnapshot().items()
+                 if address == SI4703Emulator.ADDRESS and op != "write_i2c_block_data" ])
+
+def test_interrupt_seek(bus, gpio):
+    emulator = bus.attach(SI4703Emulator(stations = STATIONS, tune_time = 0.05))
+    radio = interruptible(emulator, gpio)
+    radio.setChannel(90.0)
+    interrupts = radio.interrupts()
+    radio.seek(SI470x.UP)
+    assert radio.getChannel() == pytest.approx(98.0)
+    assert radio.interrupts() == interrupts + 1
+    # the status is read before the wait and once the chip signals the end
+    assert radio.tuneStats()["seek"]["last_polls"] == 2
+
+def test_interrupt_poll_rds(emulator, gpio):
+    radio = interruptible(emulator, gpio)
+    radio.setChannel(98.0)
+    # the interrupt of the tune
+    radio.pollRDS()
+    I2C.enableStats()
+    try:
+        # no group, no read
+        reads = registerReads()
+        start = time.time()
+        assert radio.pollRDS() is None
+        assert time.time() - start >= 0.08
+        assert registerReads() == reads
+
+        emulator.injectStation(0x1234, ps = "HELLO FM")
+        rds = pollRDS(radio, emulator.pendingRDS())
+        assert emulator.pendingRDS() == 0
+        assert rds.getCompleteProgramName() == "HELLO FM"
+    finally:
+        I2C.enableStats(False)
+
+def test_disable_interrupts(emulator, gpio):
+    radio = interruptible(emulator, gpio)
+    assert IRQ_PIN in gpio.callbacks
+    radio.disableInterrupts()
+    assert gpio.callbacks == {}
+    radio.setChannel(98.0)
+    assert radio.getChannel() == pytest.approx(98.0)
@@ -0,0 +1,107 @@
+import errno
+
+import pytest
+
+from raspberry.i2c import I2CError, RetryPolicy
+from raspberry.mux import TCA9548A
+from raspberry.sensors import BMP085, BMP085Fleet
+from raspberry.emulators import EmulatedBus, BMP085Emulator, TCA9548AEmulator
+from raspberry.emulators.bus import EmulatedDevice
+
+
+MUXES = ( 0x70, 0x71 )
+
+class Unplugged(EmulatedDevice) :
+  """Sensor that stopped answering"""
+
+  ADDRESS = 0x77
+
+  def write(self, data):
+    raise IOError(errno.EREMOTEIO, "Remote I/O error")
+
+  def read(self, length):
+    raise IOError(errno.EREMOTEIO, "Remote I/O error")
+
+
+@pytest.fixture
+def muxbus(bus):
+  """Bus 1 with two multiplexers, a BMP085 on every channel, all of them at
+  the same address, and one BMP085 on the bus of the test"""
+  muxbus = EmulatedBus().install(1)
+  for address in MUXES:
+    mux = muxbus.attach(TCA9548AEmulator(), address)
+    for channel in range(8):
+      mux.attach(channel, BMP085Emulator(temperature = 20. + channel,
+                                         pressure = expected(address, channel),
+                                         instant = True))
+  bus.attach(BMP085Emulator(temperature = 25., pressure = 95000., instant = True))
+  return muxbus
+
+def expected(address, channel):
+  return 100000. + (address - 0x70) * 100. + channel
+
+def fleetOf(**kwargs):
+  fleet = BMP085Fleet()
+  for address in MUXES:
+    mux = TCA9548A(address, busnum = 1)
+    for channel in range(8):
+      fleet.add(mux = mux, channel = channel, **kwargs)
+  fleet.add(busnum = 0, **kwargs)
+  return fleet
+
+def muxWrites(muxbus):
+  return sum([ muxbus.device(address).writes for address in MUXES ])
+
+
+def test_fleet_poll(muxbus):
+  fleet = fleetOf()
+  readings = fleet.poll()
+  assert len(readings) == 17
+  for address in MUXES:
+    for channel in range(8):
+      timestamp, pressure, temp = readings["1/{0:#04x}:{1}/0x77".format(address, channel)]
+      assert abs(pressure - expected(address, channel)) <= 1
+      assert temp == pytest.approx(20. + channel, abs = 0.1)
+  timestamp, pressure, temp = readings["0/0x77"]
+  assert abs(pressure - 95000.) <= 1
+  assert fleet.errors() == {}
+
+def test_fleet_switches(muxbus):
+  fleet = fleetOf()
+  switches, writes = fleet.stats()["switches"], muxWrites(muxbus)
+  for readings in fleet.stream(count = 3):
+    assert len(readings) == 17
+  stats = fleet.stats()
+  # every selection the fleet counted went to a multiplexer
+  assert stats["switches"] - switches == muxWrites(muxbus) - writes
+  assert stats["rounds"] == 3
+  assert stats["samples"] == 3 * 17
+
+def test_fleet_switches_once_per_channel_and_phase(muxbus):
+  fleet = fleetOf()
+  fleet.poll()
+  for name in fleet.names():
+    fleet.sensor(name).setTemperatureCache(10.)
+  fleet.poll()
+  switches = fleet.stats()["switches"]
+  # a pressure phase only: each channel selected to start then to collect,
+  # plus the first multiplexer turned off to go to the second one
+  fleet.poll()
+  assert fleet.stats()["switches"] - switches == 2 * (16 + 1)
+
+def test_fleet_failing_sensor(muxbus):
+  fleet = fleetOf(retry = RetryPolicy(attempts = 1))
+  name = "1/0x70:3/0x77"
+  assert name in fleet.poll()
+
+  muxbus.device(0x70).attach(3, Unplugged())
+  readings = fleet.poll()
+  assert name not in readings
+  assert len(readings) == 16
+  assert fleet.errors().keys() == [ name ]
+  assert isinstance(fleet.errors()[name], I2CError)
+  assert fleet.stats()["failures"] == 1
+
+  # plugged back
+  muxbus.device(0x70).attach(3, BMP085Emulator(pressure = expected(0x70, 3), instant = True))
+  assert name in fleet.poll()
@@ -0,0 +1,607 @@
+import ctypes
+import errno
+import gc
+import struct
+import threading
+import time
+
+import pytest
+
+import raspberry.i2c
+from raspberry.i2c import I2C, I2CBus, I2CError, I2CStats, FairLock, RetryPolicy, \
+     UnsupportedTransfer
+from raspberry.emulators import EmulatedBus
+from raspberry.emulators.bus import EmulatedDevice
+
+
+class RegisterDevice(EmulatedDevice) :
+  """256 plain 8-bit registers, recording the writes. The next failures
+  transfers fail with error"""
+
+  ADDRESS = 0x40
+
+  def __init__(self):
+    self.regs     = bytearray(256)
+    self.pointer  = 0
+    self.writes   = []
+    self.failures = 0
+    self.error    = errno.EIO
+
+  def __fail(self):
+    if self.failures > 0:
+      self.failures -= 1
+      raise IOError(self.error, "Emulated error")
+
+  def write(self, data):
+    self.__fail()
+    self.pointer = data[0]
+    if len(data) > 1:
+      self.regs[self.pointer:self.pointer + len(data) - 1] = bytearray(data[1:])
+      self.writes.append((self.pointer, list(data[1:])))
+
+  def read(self, length):
+    self.__fail()
+    return list(self.regs[self.pointer:self.pointer + length])
+
+
+class ClosingBus(EmulatedBus) :
+  """Emulated bus counting how many times its handle was closed"""
+
+  def __init__(self):
+    EmulatedBus.__init__(self)
+    self.closed = 0
+
+  def close(self):
+    self.closed += 1
+
+
+NO_WAIT = RetryPolicy(attempts = 3, backoff = 0.)
+
+@pytest.fixture
+def device(bus):
+  return bus.attach(RegisterDevice())
+
+@pytest.fixture
+def i2c(device):
+  i2c = I2C(RegisterDevice.ADDRESS, retry = NO_WAIT)
+  yield i2c
+  i2c.close()
+
+
+# ---------------------------------------------------------------------------
+# Bus registry
+def refcount(busnum):
+  """References held on the bus, not counting the one taken to look"""
+  bus = I2CBus.acquire(busnum)
+  try:
+    return bus.refcount() - 1
+  finally:
+    bus.release()
+
+def test_devices_share_the_bus(bus):
+  bus.attach(RegisterDevice(), 0x40)
+  bus.attach(RegisterDevice(), 0x41)
+  first, second = I2C(0x40), I2C(0x41)
+  busnum = first.busnum()
+  assert I2CBus.opened() == [ busnum ]
+  assert refcount(busnum) == 2
+
+  first.write_byte(0x10, 1)
+  second.write_byte(0x10, 2)
+  assert bus.device(0x40).writes == [ (0x10, [ 1 ]) ]
+  assert bus.device(0x41).writes == [ (0x10, [ 2 ]) ]
+  first.close()
+  second.close()
+
+def test_close_releases_the_bus():
+  bus = ClosingBus().install()
+  try:
+    bus.attach(RegisterDevice())
+    first, second = I2C(RegisterDevice.ADDRESS), I2C(RegisterDevice.ADDRESS)
+    busnum = first.busnum()
+
+    first.close()
+    assert refcount(busnum) == 1
+    assert bus.closed == 0
+    # closing twice drops a single reference
+    first.close()
+    assert refcount(busnum) == 1
+
+    second.close()
+    assert bus.closed == 1
+    assert I2CBus.opened() == []
+  finally:
+    EmulatedBus.uninstallAll()
+
+def test_garbage_collected_device_releases_the_bus():
+  bus = ClosingBus().install()
+  try:
+    bus.attach(RegisterDevice())
+    i2c = I2C(RegisterDevice.ADDRESS)
+    del i2c
+    gc.collect()
+    assert bus.closed == 1
+    assert I2CBus.opened() == []
+  finally:
+    EmulatedBus.uninstallAll()
+
+def test_bus_reopened_after_last_release():
+  first = ClosingBus().install()
+  try:
+    first.attach(RegisterDevice())
+    I2C(RegisterDevice.ADDRESS).close()
+
+    # a bus opened again gets a new handle from the factory
+    second = ClosingBus().install()
+    second.attach(RegisterDevice())
+    i2c = I2C(RegisterDevice.ADDRESS)
+    i2c.write_byte(0x10, 1)
+    i2c.close()
+    assert first.device(RegisterDevice.ADDRESS).writes == []
+    assert second.device(RegisterDevice.ADDRESS).writes == [ (0x10, [ 1 ]) ]
+  finally:
+    EmulatedBus.uninstallAll()
+
+def test_pi_revision_read_once(monkeypatch):
+  reads = []
+  def readPiRevision():
+    reads.append(1)
+    return 2
+  monkeypatch.setattr(I2C, "_I2C__revision", None)
+  monkeypatch.setattr(I2C, "_I2C__readPiRevision", staticmethod(readPiRevision))
+
+  assert I2C.getPiRevision() == 2
+  assert I2C.getPiRevision() == 2
+  assert I2C.getPiI2CBusNumber() == 1
+  assert len(reads) == 1
+
+@pytest.mark.parametrize("revision, busnum", [ (0, 0), (1, 0), (2, 1) ])
+def test_pi_bus_number(monkeypatch, revision, busnum):
+  monkeypatch.setattr(I2C, "_I2C__revision", revision)
+  assert I2C.getPiI2CBusNumber() == busnum
+
+
+# ---------------------------------------------------------------------------
+# Combined transactions
+smbus2 = pytest.mark.skipif(raspberry.i2c.i2c_msg is None, reason = "smbus2 is not installed")
+
+def spy(bus, name):
+  """Records the calls of the smbus operation name of bus"""
+  calls = []
+  operation = getattr(bus, name)
+  def recorded(*args):
+    calls.append(args)
+    return operation(*args)
+  setattr(bus, name, recorded)
+  return calls
+
+@pytest.fixture
+def python_smbus(monkeypatch):
+  """Runs the test on the python-smbus code paths, without i2c_rdwr"""
+  monkeypatch.setattr(raspberry.i2c, "i2c_msg", None)
+
+@smbus2
+def test_transfer(bus, device, i2c):
+  device.regs[0x10:0x14] = bytearray([ 1, 2, 3, 4 ])
+  combined = spy(bus, "i2c_rdwr")
+  assert i2c.transfer([ 0x10 ], 4) == [ 1, 2, 3, 4 ]
+  assert i2c.transfer([ 0x20, 5, 6 ]) == []
+  assert device.regs[0x20:0x22] == bytearray([ 5, 6 ])
+  assert len(combined) == 2
+
+@smbus2
+def test_transfer_beyond_smbus_limits(bus, device, i2c):
+  device.regs[0x00:0x40] = bytearray(range(0x40))
+  combined = spy(bus, "i2c_rdwr")
+  # a single transaction, more than a block read and after two bytes
+  assert i2c.transfer([ 0x00 ], 0x40) == range(0x40)
+  assert i2c.read_registers(0x00, 0x40) == range(0x40)
+  assert i2c.transfer([ 0x08, 0x08 ], 2) == [ 0x08, 0x09 ]
+  assert len(combined) == 3
+
+def test_transfer_python_smbus(bus, device, i2c, python_smbus):
+  device.regs[0x10:0x14] = bytearray([ 1, 2, 3, 4 ])
+  blocks = spy(bus, "read_i2c_block_data")
+  assert i2c.transfer([ 0x10 ], 4) == [ 1, 2, 3, 4 ]
+  assert len(blocks) == 1
+  assert i2c.transfer([ 0x20, 5, 6 ]) == []
+  assert device.regs[0x20:0x22] == bytearray([ 5, 6 ])
+
+def test_transfer_unsupported_by_python_smbus(device, i2c, python_smbus):
+  with pytest.raises(UnsupportedTransfer):
+    i2c.transfer([ 0x10, 0x11 ], 2)
+  with pytest.raises(UnsupportedTransfer):
+    i2c.transfer([ 0x10 ], I2C.BLOCK_MAX + 1)
+  assert device.writes == []
+
+def test_read_registers_python_smbus(bus, device, i2c, python_smbus):
+  device.regs[0x00:0x40] = bytearray(range(0x40))
+  blocks = spy(bus, "read_i2c_block_data")
+  assert i2c.read_registers(0x00, 0x40) == range(0x40)
+  assert len(blocks) == 2
+
+
+# ---------------------------------------------------------------------------
+# Reads into buffers
+@smbus2
+def test_read_into_zero_copy(bus, device, i2c):
+  device.regs[0x10:0x14] = bytearray([ 1, 2, 3, 4 ])
+  buf = bytearray(4)
+  combined = spy(bus, "i2c_rdwr")
+  assert i2c.read_into(0x10, buf) == 4
+  assert buf == bytearray([ 1, 2, 3, 4 ])
+  # the read message pointed to buf itself
+  write, read = combined[0]
+  address = ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+  assert ctypes.cast(read.buf, ctypes.c_void_p).value == address
+
+@smbus2
+def test_read_into_length(bus, device, i2c):
+  device.regs[0x10:0x14] = bytearray([ 1, 2, 3, 4 ])
+  buf = bytearray(6)
+  assert i2c.read_into(0x10, buf, 2) == 2
+  assert buf == bytearray([ 1, 2, 0, 0, 0, 0 ])
+
+def test_read_into_memoryview(device, i2c):
+  device.regs[0x10:0x14] = bytearray([ 1, 2, 3, 4 ])
+  buf = bytearray(8)
+  assert i2c.read_into(0x10, memoryview(buf)[2:6]) == 4
+  assert buf == bytearray([ 0, 0, 1, 2, 3, 4, 0, 0 ])
+
+def test_read_into_python_smbus(bus, device, i2c, python_smbus):
+  device.regs[0x10:0x14] = bytearray([ 1, 2, 3, 4 ])
+  blocks = spy(bus, "read_i2c_block_data")
+  buf = bytearray(4)
+  assert i2c.read_into(0x10, buf) == 4
+  assert buf == bytearray([ 1, 2, 3, 4 ])
+  assert len(blocks) == 1
+
+def test_read_struct(device, i2c):
+  device.regs[0x10:0x15] = bytearray([ 0xFF, 0xFE, 0x12, 0x34, 0x80 ])
+  layout = struct.Struct(">hHb")
+  assert i2c.read_struct(0x10, layout) == (-2, 0x1234, -128)
+  buf = bytearray(8)
+  assert i2c.read_struct(0x10, layout, buf) == (-2, 0x1234, -128)
+  assert buf[:layout.size] == device.regs[0x10:0x15]
+
+def test_read_shorts(device, i2c):
+  device.regs[0x10:0x12] = bytearray([ 0xFF, 0xFE ])
+  assert i2c.read_short(0x10) == 0xFFFE
+  assert i2c.read_signed_short(0x10) == -2
+
+
+# ---------------------------------------------------------------------------
+# Retry policy
+def test_retry_recovers(device, i2c):
+  device.regs[0x20] = 9
+  device.failures = 2
+  assert i2c.read_byte(0x20) == 9
+  assert i2c.retryStats() == { "retries": 2, "recovered": 1, "failures": 0 }
+
+def test_retry_gives_up(device, i2c):
+  device.failures = 3
+  with pytest.raises(I2CError) as info:
+    i2c.read_byte(0x20)
+  assert info.value.attempts == 3
+  assert info.value.reg == 0x20
+  assert info.value.errno == errno.EIO
+  assert i2c.retryStats() == { "retries": 2, "recovered": 0, "failures": 1 }
+
+def test_retry_not_retryable_error(device, i2c):
+  device.failures = 1
+  device.error    = errno.EINVAL
+  with pytest.raises(I2CError) as info:
+    i2c.write_byte(0x10, 1)
+  assert info.value.attempts == 1
+  assert i2c.retryStats()["retries"] == 0
+
+def test_retry_policy_backoff():
+  policy = RetryPolicy(attempts = 5, backoff = 0.001, factor = 2., max_backoff = 0.003)
+  assert [ policy.delay(a) for a in range(1, 5) ] == [ 0.001, 0.002, 0.003, 0.003 ]
+  err = IOError(errno.EIO, "")
+  assert policy.shouldRetry(err, 4)
+  assert not policy.shouldRetry(err, 5)
+  assert not policy.shouldRetry(IOError(errno.EINVAL, ""), 1)
+
+def test_retry_policy_per_device(device, i2c):
+  i2c.setRetryPolicy(RetryPolicy(attempts = 1))
+  device.failures = 1
+  with pytest.raises(I2CError):
+    i2c.read_byte(0x20)
+
+
+# ---------------------------------------------------------------------------
+# Shadow registers
+def test_shadow_skips_unchanged_writes(device, i2c):
+  i2c.enableShadow()
+  i2c.write_byte(0x10, 5)
+  i2c.write_byte(0x10, 5)
+  i2c.write_byte(0x10, 6)
+  assert device.writes == [ (0x10, [ 5 ]), (0x10, [ 6 ]) ]
+  assert i2c.shadowStats()["suppressed"] == 1
+  assert i2c.shadowStats()["bytes_saved"] == 1
+
+def test_shadow_learns_from_reads(device, i2c):
+  device.regs[0x20] = 7
+  i2c.enableShadow()
+  assert i2c.read_byte(0x20) == 7
+  i2c.write_byte(0x20, 7)
+  assert device.writes == []
+
+def test_shadow_volatile_registers_are_written(device, i2c):
+  i2c.enableShadow(volatile = [ 0xF4 ])
+  i2c.write_byte(0xF4, 0x2E)
+  i2c.write_byte(0xF4, 0x2E)
+  assert device.writes == [ (0xF4, [ 0x2E ]) ] * 2
+
+def test_shadow_invalidate(device, i2c):
+  i2c.enableShadow()
+  i2c.write_byte(0x10, 5)
+  i2c.invalidateShadow(0x10)
+  i2c.write_byte(0x10, 5)
+  assert len(device.writes) == 2
+
+def test_shadow_disabled_writes_everything(device, i2c):
+  i2c.write_byte(0x10, 5)
+  i2c.write_byte(0x10, 5)
+  assert len(device.writes) == 2
+  assert i2c.shadowStats() == {}
+
+
+# ---------------------------------------------------------------------------
+# Batches
+def test_batch_flushes_on_exit(device, i2c):
+  i2c.enableShadow()
+  with i2c.batch():
+    i2c.write_byte(0x12, 3)
+    i2c.write_byte(0x10, 1)
+    i2c.write_byte(0x11, 2)
+    assert device.writes == []
+  assert device.writes == [ (0x10, [ 1, 2, 3 ]) ]
+  assert i2c.shadowStats()["flushes"] == 1
+  assert i2c.shadowStats()["block_writes"] == 1
+
+def test_batch_bridges_known_registers(device, i2c):
+  i2c.enableShadow()
+  i2c.write_block(0x10, [ 0, 0, 0 ])
+  del device.writes[:]
+  with i2c.batch():
+    i2c.write_byte(0x10, 1)
+    i2c.write_byte(0x12, 3)
+  # 0x11 is rewritten with its known value rather than starting a transfer
+  assert device.writes == [ (0x10, [ 1, 0, 3 ]) ]
+
+def test_batch_skips_unchanged_registers(device, i2c):
+  i2c.enableShadow()
+  i2c.write_byte(0x10, 1)
+  with i2c.batch():
+    i2c.write_byte(0x10, 2)
+    i2c.write_byte(0x10, 1)
+  assert device.writes == [ (0x10, [ 1 ]) ]
+
+def test_batch_nested_flushes_once(device, i2c):
+  i2c.enableShadow()
+  with i2c.batch():
+    i2c.write_byte(0x10, 1)
+    with i2c.batch():
+      i2c.write_byte(0x11, 2)
+    assert device.writes == []
+  assert device.writes == [ (0x10, [ 1, 2 ]) ]
+
+def test_batch_volatile_write_flushes_first(device, i2c):
+  i2c.enableShadow(volatile = [ 0xF4 ])
+  with i2c.batch():
+    i2c.write_byte(0x10, 1)
+    i2c.write_byte(0xF4, 0x2E)
+  assert device.writes == [ (0x10, [ 1 ]), (0xF4, [ 0x2E ]) ]
+
+def test_batch_dropped_on_exception(device, i2c):
+  i2c.enableShadow()
+  with pytest.raises(ValueError):
+    with i2c.batch():
+      i2c.write_byte(0x10, 1)
+      raise ValueError()
+  assert device.writes == []
+  assert i2c.flush() == 0
+
+def test_batch_requires_shadow(i2c):
+  with pytest.raises(RuntimeError):
+    with i2c.batch():
+      pass
+
+def test_failed_write_invalidates_shadow(device, i2c):
+  i2c.enableShadow()
+  i2c.write_byte(0x10, 1)
+  device.failures = 3
+  with pytest.raises(I2CError):
+    i2c.write_byte(0x10, 2)
+  i2c.write_byte(0x10, 1)
+  assert device.writes == [ (0x10, [ 1 ]), (0x10, [ 1 ]) ]
+
+
+# ---------------------------------------------------------------------------
+# Transfer statistics
+@pytest.fixture
+def stats():
+  I2C.enableStats()
+  yield I2C.stats()
+  I2C.enableStats(False)
+
+def test_stats_counters(device, i2c, stats):
+  i2c.write_byte(0x10, 1)
+  i2c.write_block(0x20, [ 1, 2, 3 ])
+  i2c.read_byte(0x10)
+  i2c.read_byte(0x11)
+  snapshot = I2C.statsSnapshot()
+  address = RegisterDevice.ADDRESS
+  assert sorted(snapshot.keys()) == [ (address, "read_byte_data"),
+                                      (address, "write_byte_data"),
+                                      (address, "write_i2c_block_data") ]
+  reads = snapshot[(address, "read_byte_data")]
+  assert reads["count"] == 2
+  assert reads["bytes"] == 2
+  assert reads["errors"] == 0
+  assert sum(reads["histogram"]) == 2
+  assert reads["time_max"] <= reads["time_total"]
+  assert snapshot[(address, "write_i2c_block_data")]["bytes"] == 3
+
+def test_stats_errors(bus, stats):
+  # nobody acknowledges 0x50, a single attempt
+  i2c = I2C(0x50, retry = RetryPolicy(attempts = 1))
+  with pytest.raises(IOError):
+    i2c.read_byte(0x10)
+  i2c.close()
+  entry = I2C.statsSnapshot()[(0x50, "read_byte_data")]
+  assert (entry["count"], entry["errors"], entry["bytes"]) == (1, 1, 0)
+
+def test_stats_histogram():
+  stats = I2CStats()
+  # bucket i counts the latencies below 2**i microseconds
+  for latency in (0., 1e-6, 5e-6, 1e-3, 100.):
+    stats.record(0x40, "read_byte_data", 1, latency)
+  histogram = stats.snapshot()[(0x40, "read_byte_data")]["histogram"]
+  assert len(histogram) == I2CStats.HISTOGRAM_BUCKETS
+  assert [ i for i, n in enumerate(histogram) if n ] == \
+      [ 0, 1, 3, 10, I2CStats.HISTOGRAM_BUCKETS - 1 ]
+
+def test_stats_snapshot_is_a_copy():
+  stats = I2CStats()
+  stats.record(0x40, "read_byte_data", 1, 1e-4)
+  snapshot = stats.snapshot()
+  stats.record(0x40, "read_byte_data", 1, 1e-4)
+  assert snapshot[(0x40, "read_byte_data")]["count"] == 1
+  assert sum(snapshot[(0x40, "read_byte_data")]["histogram"]) == 1
+  stats.reset()
+  assert stats.snapshot() == {}
+
+def test_stats_reset(device, i2c, stats):
+  i2c.read_byte(0x10)
+  I2C.resetStats()
+  assert I2C.statsSnapshot() == {}
+  i2c.read_byte(0x10)
+  assert I2C.statsSnapshot()[(RegisterDevice.ADDRESS, "read_byte_data")]["count"] == 1
+
+def test_stats_swap_the_bus_handle(device, i2c):
+  bus = I2CBus.acquire(i2c.busnum())
+  try:
+    assert bus.smbus is bus.handle
+    I2C.enableStats()
+    assert isinstance(bus.smbus, I2CStats.SMBus)
+    i2c.read_byte(0x10)
+    assert len(I2C.statsSnapshot()) == 1
+
+    # back to the bare handle, nothing recorded
+    I2C.enableStats(False)
+    assert bus.smbus is bus.handle
+    assert I2C.stats() is None
+    i2c.read_byte(0x10)
+    assert I2C.statsSnapshot() == {}
+  finally:
+    I2C.enableStats(False)
+    bus.release()
+
+def test_stats_instrument_the_buses_opened_later(bus, stats):
+  bus.attach(RegisterDevice())
+  i2c = I2C(RegisterDevice.ADDRESS)
+  i2c.read_byte(0x10)
+  i2c.close()
+  assert len(I2C.statsSnapshot()) == 1
+
+
+# ---------------------------------------------------------------------------
+# Arbitration
+def waitFor(condition, timeout = 2.):
+  deadline = time.time() + timeout
+  while not condition():
+    assert time.time() < deadline, "timed out"
+    time.sleep(0.001)
+
+def test_fair_lock_first_come_first_served():
+  lock  = FairLock()
+  order = []
+  def worker(n):
+    with lock:
+      order.append(n)
+
+  lock.acquire()
+  threads = []
+  for n in range(5):
+    thread = threading.Thread(target = worker, args = (n,))
+    thread.start()
+    threads.append(thread)
+    # the next thread arrives once this one waits for its turn
+    waitFor(lambda: lock.stats()["contended"] == n + 1)
+  lock.release()
+  for thread in threads:
+    thread.join()
+  assert order == range(5)
+
+def test_fair_lock_reentrant():
+  lock = FairLock()
+  acquired = threading.Event()
+  def other():
+    with lock:
+      acquired.set()
+
+  with lock:
+    assert lock.acquire() == 0.
+    thread = threading.Thread(target = other)
+    thread.start()
+    lock.release()
+    # still held once
+    assert not acquired.wait(0.05)
+  assert acquired.wait(2.)
+  thread.join()
+  assert lock.stats()["acquisitions"] == 2
+
+def test_fair_lock_release_unowned():
+  lock = FairLock()
+  with pytest.raises(RuntimeError):
+    lock.release()
+  errors = []
+  def release():
+    try:
+      lock.release()
+    except RuntimeError, err:
+      errors.append(err)
+  with lock:
+    thread = threading.Thread(target = release)
+    thread.start()
+    thread.join()
+  assert len(errors) == 1
+
+def test_lock_stats(device, i2c):
+  hold = 0.05
+  with i2c.atomic():
+    thread = threading.Thread(target = i2c.read_byte, args = (0x10,))
+    thread.start()
+    waitFor(lambda: i2c.lockStats()["contended"] == 1)
+    time.sleep(hold)
+  thread.join()
+
+  stats = i2c.lockStats()
+  assert stats["contended"] == 1
+  assert stats["acquisitions"] == 2
+  assert stats["wait_total"] >= hold
+  assert stats["wait_max"] == pytest.approx(stats["wait_total"], abs = 1e-3)
+
+def test_lock_stats_uncontended(device, i2c):
+  for reg in range(10):
+    i2c.read_byte(reg)
+  stats = i2c.lockStats()
+  assert stats["acquisitions"] == 10
+  assert stats["contended"] == 0
+
+def test_device_lock_leaves_bus_free(bus, device, i2c):
+  bus.attach(RegisterDevice(), 0x41)
+  other = I2C(0x41)
+  done = threading.Event()
+  def write():
+    other.write_byte(0x10, 1)
+    done.set()
+  with i2c.exclusive():
+    thread = threading.Thread(target = write)
+    thread.start()
+    assert done.wait(2.)
+  thread.join()
+  other.close()
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from raspberry.sensors import BMP085
+from raspberry.sensors.oversampling import OversamplingPolicy
+from raspberry.emulators import BMP085Emulator
+
+
+# the conversions take their time, so that the sample times are measured
+@pytest.fixture
+def quiet(bus):
+  return bus.attach(BMP085Emulator(pressure = 99000.))
+
+@pytest.fixture
+def noisy(bus):
+  # the emulated noise is drawn from random
+  random.seed(1)
+  return bus.attach(BMP085Emulator(pressure = 99000., noise = 20.))
+
+
+def test_initial_plan(quiet):
+  policy = OversamplingPolicy(BMP085(), rate = 50, noise = 7.)
+  # the datasheet noise of the fastest mode is low enough
+  stats = policy.stats()
+  assert (stats["mode"], stats["oversample"], stats["feasible"]) == (BMP085.ULTRALOWPOWER, 1, True)
+  assert stats["expected_noise"] == pytest.approx(6.)
+
+def test_plan_without_oversampling_is_measured(quiet):
+  policy = OversamplingPolicy(BMP085(), rate = 50, noise = 7., evaluate = 5)
+  outputs = list(policy.stream(count = 20))
+  assert len(outputs) == 20
+  for timestamp, pressure, temp in outputs:
+    assert abs(pressure - 99000.) <= 1
+
+  stats = policy.stats()
+  # one pair per output, across the outputs of a single sample
+  assert stats["measured"][BMP085.ULTRALOWPOWER] == 19
+  assert stats["noise"][BMP085.ULTRALOWPOWER] < 6.
+  assert stats["sample_time"][BMP085.ULTRALOWPOWER] != OversamplingPolicy.CONVERSION[BMP085.ULTRALOWPOWER]
+  assert stats["switches"] == 0
+
+def test_plan_follows_the_measured_noise(noisy):
+  policy = OversamplingPolicy(BMP085(), rate = 50, noise = 7., evaluate = 5)
+  list(policy.stream(count = 60))
+
+  stats = policy.stats()
+  assert stats["measured"][BMP085.ULTRALOWPOWER] > 0
+  assert stats["noise"][BMP085.ULTRALOWPOWER] > 10.
+  assert stats["switches"] >= 1
+  assert [ d["reason"] for d in stats["decisions"] ][1:] == \
+      [ "measured" ] * (len(stats["decisions"]) - 1)
+  # 20 Pa of noise cannot be averaged down to 7 Pa at 50 outputs a second
+  assert not stats["feasible"]
+  assert stats["expected_noise"] > 7.
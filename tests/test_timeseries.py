@@ -0,0 +1,172 @@
+import math
+import random
+
+import pytest
+
+from raspberry.timeseries import TimeSeries, Rollup
+
+
+def scan(samples, start = None, end = None):
+  """(min, max, mean, count) of the (timestamp, value) samples in
+  [start, end), the brute force way"""
+  values = [ v for t, v in samples if (start is None or t >= start) and
+                                      (end is None or t < end) ]
+  if not values:
+    return (None, None, None, 0)
+  return (min(values), max(values), sum(values) / len(values), len(values))
+
+def assertSummary(summary, expected):
+  assert summary[3] == expected[3]
+  if expected[3]:
+    assert summary[0] == expected[0]
+    assert summary[1] == expected[1]
+    assert summary[2] == pytest.approx(expected[2])
+
+def walk(n, step = 0.25, seed = 1):
+  """n (timestamp, value) samples step seconds apart"""
+  rand = random.Random(seed)
+  return [ (i * step, rand.gauss(1000., 10.)) for i in range(n) ]
+
+
+# ---------------------------------------------------------------------------
+# Raw samples
+def test_ring_wraps_around():
+  series = TimeSeries(("v",), capacity = 10)
+  samples = walk(25)
+  for t, v in samples:
+    series.append(t, v)
+  assert len(series) == 10
+  assert series.samples() == samples[-10:]
+  assert series.last() == samples[-1]
+  assert series.column().tolist() == [ t for t, v in samples[-10:] ]
+
+def test_column_windows_across_the_wrap():
+  series = TimeSeries(("v",), capacity = 16)
+  samples = walk(40)
+  for t, v in samples:
+    series.append(t, v)
+  kept = samples[-16:]
+  for start in (None, 0., 6., 6.1, 7.25, 9.):
+    for end in (None, 6., 7.5, 8.8, 10., 100.):
+      expected = [ v for t, v in kept if (start is None or t >= start) and
+                                         (end is None or t < end) ]
+      assert series.column("v", start, end).tolist() == expected
+
+def test_append_checks_the_values():
+  series = TimeSeries(("a", "b"), capacity = 4)
+  with pytest.raises(ValueError):
+    series.append(0., 1.)
+
+
+# ---------------------------------------------------------------------------
+# Rollups
+def bruteBuckets(samples, resolution, capacity):
+  """Buckets a rollup of capacity buckets keeps, from the samples"""
+  buckets = {}
+  for t, v in samples:
+    buckets.setdefault(int(math.floor(t / resolution)), []).append(v)
+  last = max(buckets.keys())
+  return [ (b * resolution, min(values), max(values), sum(values) / len(values), len(values))
+           for b, values in sorted(buckets.items()) if last - b < capacity ]
+
+def assertBuckets(buckets, expected):
+  assert [ b[0] for b in buckets ] == [ b[0] for b in expected ]
+  for bucket, other in zip(buckets, expected):
+    assert bucket[1:3] == other[1:3]
+    assert bucket[3] == pytest.approx(other[3])
+    assert bucket[4] == other[4]
+
+def test_rollup_buckets():
+  rollup = Rollup(("v",), 1., 8)
+  samples = walk(60)
+  for t, v in samples:
+    rollup.add(t, [ v ])
+  assertBuckets(rollup.buckets("v"), bruteBuckets(samples, 1., 8))
+  assertBuckets(rollup.buckets("v", 10., 13.),
+                [ b for b in bruteBuckets(samples, 1., 8) if 10. <= b[0] < 13. ])
+
+def test_rollup_skips_empty_buckets():
+  rollup = Rollup(("v",), 1., 8)
+  samples = [ (0.5, 1.), (1.5, 2.), (6.5, 3.), (30.5, 4.), (33.5, 5.) ]
+  for t, v in samples:
+    rollup.add(t, [ v ])
+  # the buckets before 30 went out of the ring, even the ones of its slots
+  assert rollup.buckets("v") == [ (30., 4., 4., 4., 1), (33., 5., 5., 5., 1) ]
+
+def test_rollup_out_of_order():
+  rand = random.Random(2)
+  samples = [ (t + rand.uniform(-3., 3.), v) for t, v in walk(200, step = 0.1) ]
+  rollup = Rollup(("v",), 1., 8)
+  kept = []
+  for t, v in samples:
+    rollup.add(t, [ v ])
+    # a sample older than the buckets kept is dropped
+    if int(math.floor(t)) > max([ int(math.floor(k[0])) for k in kept ] or [ -1 ]) - 8:
+      kept.append((t, v))
+  assertBuckets(rollup.buckets("v"), bruteBuckets(kept, 1., 8))
+
+def test_rollup_late_sample_in_an_empty_bucket():
+  rollup = Rollup(("v",), 1., 10)
+  for t, v in [ (0.5, 1.), (5.5, 2.), (3.5, 3.) ]:
+    rollup.add(t, [ v ])
+  assert [ b[0] for b in rollup.buckets("v") ] == [ 0., 3., 5. ]
+
+def test_rollup_summary():
+  rollup = Rollup(("v",), 10., 100)
+  samples = walk(400)
+  for t, v in samples:
+    rollup.add(t, [ v ])
+  # the buckets starting in the window
+  assertSummary(rollup.summary("v", 15., 55.), scan(samples, 20., 60.))
+  assertSummary(rollup.summary("v"), scan(samples))
+
+
+# ---------------------------------------------------------------------------
+# summary()
+RESOLUTIONS = ( (1., 1000), (10., 1000), (60., 1000) )
+
+@pytest.fixture
+def series():
+  series = TimeSeries(("v",), capacity = 10000, resolutions = RESOLUTIONS)
+  for t, v in walk(2000):
+    series.append(t, v)
+  return series
+
+def test_summary_matches_a_scan(series):
+  samples = walk(2000)
+  rand = random.Random(3)
+  windows = [ (None, None), (0., 500.), (59.9, 120.1), (3.3, 3.6), (61., 62.),
+              (119.75, 240.), (450., 1000.) ]
+  windows += [ sorted([ rand.uniform(-10., 510.), rand.uniform(-10., 510.) ])
+               for i in range(200) ]
+  for start, end in windows:
+    assertSummary(series.summary("v", start, end), scan(samples, start, end))
+
+def test_summary_combines_the_levels(series, monkeypatch):
+  used = {}
+  accumulate = Rollup.accumulate
+  def recorded(self, field, start, end, acc):
+    used.setdefault(self.resolution, []).append((start, end))
+    return accumulate(self, field, start, end, acc)
+  monkeypatch.setattr(Rollup, "accumulate", recorded)
+
+  # 1 minute bucket, 10s ones on each side, 1s ones and raw samples at the edges
+  assertSummary(series.summary("v", 48.3, 131.7), scan(walk(2000), 48.3, 131.7))
+  assert used[60.] == [ (60., 120.) ]
+  assert used[10.] == [ (50., 60.), (120., 130.) ]
+  assert used[1.]  == [ (49., 50.), (130., 131.) ]
+
+def test_summary_empty():
+  series = TimeSeries(("v",), capacity = 10)
+  assert series.summary("v") == (None, None, None, 0)
+  series.append(1., 5.)
+  assert series.summary("v", 2., 3.) == (None, None, None, 0)
+  assert series.summary("v") == (5., 5., 5., 1)
+
+def test_summary_outlives_the_raw_samples():
+  series = TimeSeries(("v",), capacity = 10, resolutions = RESOLUTIONS)
+  samples = walk(400)
+  for t, v in samples:
+    series.append(t, v)
+  # the whole minute is in the rollups, long gone from the raw samples
+  assertSummary(series.summary("v", 0., 60.), scan(samples, 0., 60.))
@@ -0,0 +1,120 @@
+import gc
+
+import pytest
+
+from raspberry.i2c import I2C, I2CBus, I2CError, RetryPolicy
+from raspberry.trace import Recorder, Replayer, TraceMismatch
+from raspberry.sensors import BMP085
+from raspberry.emulators import EmulatedBus, BMP085Emulator
+
+
+@pytest.fixture
+def trace(tmpdir):
+  return str(tmpdir.join("session.trace"))
+
+def record(trace, session):
+  """Records session(), run on the emulated bus, in trace"""
+  recorder = Recorder(trace).install()
+  try:
+    result = session()
+  finally:
+    recorder.close()
+  # the next devices open the bus again, from the replayer
+  gc.collect()
+  return result, recorder.count()
+
+def readSensor():
+  bmp = BMP085(mode = BMP085.HIGHRES)
+  return bmp.calibration(), bmp.read()
+
+
+def test_replay(bus, trace):
+  bus.attach(BMP085Emulator(temperature = 18., pressure = 97000., instant = True))
+  recorded, count = record(trace, readSensor)
+  assert count > 0
+
+  # nothing answers on the bus any more
+  bus.detach(BMP085Emulator.ADDRESS)
+  replayer = Replayer(trace).install()
+  try:
+    assert readSensor() == recorded
+  finally:
+    replayer.uninstall()
+  assert replayer.count() == count
+  assert replayer.remaining() == 0
+
+def test_replay_realtime(bus, trace):
+  bus.attach(BMP085Emulator(instant = True))
+  recorded, count = record(trace, readSensor)
+
+  replayer = Replayer(trace, realtime = True).install()
+  try:
+    assert readSensor() == recorded
+  finally:
+    replayer.uninstall()
+
+def test_replay_errors(bus, trace):
+  retry = RetryPolicy(attempts = 2, backoff = 0.)
+  def absent():
+    with pytest.raises(I2CError):
+      I2C(0x42, retry = retry).read_byte(0x00)
+  record(trace, absent)
+
+  replayer = Replayer(trace).install()
+  try:
+    absent()
+  finally:
+    replayer.uninstall()
+  assert replayer.remaining() == 0
+
+def test_replay_mismatch(bus, trace):
+  bus.attach(BMP085Emulator(instant = True))
+  record(trace, readSensor)
+
+  replayer = Replayer(trace).install()
+  try:
+    with pytest.raises(TraceMismatch):
+      I2C(BMP085Emulator.ADDRESS).read_byte(0xD0)
+  finally:
+    replayer.uninstall()
+
+def test_replay_past_the_end(bus, trace):
+  bus.attach(BMP085Emulator(instant = True))
+  record(trace, lambda: I2C(BMP085Emulator.ADDRESS).read_byte(0xD0))
+
+  replayer = Replayer(trace).install()
+  i2c = I2C(BMP085Emulator.ADDRESS)
+  try:
+    assert i2c.read_byte(0xD0) == BMP085Emulator.CHIP_ID
+    with pytest.raises(TraceMismatch):
+      i2c.read_byte(0xD0)
+  finally:
+    i2c.close()
+    replayer.uninstall()
+
+def test_not_a_trace(trace):
+  with open(trace, "wb") as f:
+    f.write(b"not a trace")
+  with pytest.raises(ValueError):
+    Replayer(trace)
+
+def test_factory_restored(bus, trace):
+  recorder = Recorder(trace).install()
+  assert I2CBus.factory() == recorder.open
+  recorder.close()
+  assert I2CBus.factory() == EmulatedBus.open
+
+  replayer = Replayer(trace).install()
+  assert I2CBus.factory() == replayer.open
+  replayer.uninstall()
+  assert I2CBus.factory() == EmulatedBus.open
+
+def test_closed_recorder_stops_recording(bus, trace):
+  bus.attach(BMP085Emulator(instant = True))
+  recorder = Recorder(trace).install()
+  i2c = I2C(BMP085Emulator.ADDRESS)
+  i2c.read_byte(0xD0)
+  recorder.close()
+  i2c.read_byte(0xD0)
+  assert recorder.count() == 1
+  i2c.close()